@@ -0,0 +1,168 @@
+"""
+基准测试数据
+生成的数据使用固定随机种子，每次运行完全相同；也可以从 HTTP 录制存档中读取真实抓取的页面。
+"""
+import base64
+import json
+import random
+import uuid
+
+PROTOCOL_WEIGHTS = [("vmess", 4), ("vless", 3), ("ss", 3), ("trojan", 2), ("hysteria2", 1)]
+
+
+def _host(rng, ip_only=False):
+    """60% 为 IP 地址，其余为域名；ip_only 时只生成 IP 地址（解析主机名的代码不会触发真实的 DNS 查询）"""
+    if ip_only or rng.random() < 0.6:
+        return ".".join(str(rng.randint(1, 254)) for _ in range(4))
+    return f"node{rng.randint(1, 9999)}.example{rng.randint(1, 99)}.com"
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+
+def vmess_link(rng, ip_only=False):
+    config = {
+        "v": "2",
+        "ps": f"free-node-{rng.randint(1, 99999)}",
+        "add": _host(rng, ip_only),
+        "port": str(rng.choice([443, 8443, 80, 2053])),
+        "id": _uuid(rng),
+        "aid": "0",
+        "net": rng.choice(["ws", "tcp", "grpc"]),
+        "type": "none",
+        "host": "",
+        "path": "/ray",
+        "tls": rng.choice(["tls", ""]),
+    }
+    return "vmess://" + base64.b64encode(json.dumps(config).encode()).decode()
+
+
+def vless_link(rng, ip_only=False):
+    return (
+        f"vless://{_uuid(rng)}@{_host(rng, ip_only)}:{rng.choice([443, 8443])}"
+        f"?encryption=none&security=tls&type=ws&path=%2F#node{rng.randint(1, 9999)}"
+    )
+
+
+def ss_link(rng, ip_only=False):
+    userinfo = base64.b64encode(
+        f"aes-256-gcm:{rng.getrandbits(64):x}".encode()
+    ).decode()
+    return f"ss://{userinfo}@{_host(rng, ip_only)}:{rng.randint(1000, 65000)}#ss{rng.randint(1, 9999)}"
+
+
+def trojan_link(rng, ip_only=False):
+    return (
+        f"trojan://{rng.getrandbits(96):x}@{_host(rng, ip_only)}:443"
+        f"?security=tls&sni=example.com#trojan{rng.randint(1, 9999)}"
+    )
+
+
+def hysteria2_link(rng, ip_only=False):
+    return (
+        f"hysteria2://{rng.getrandbits(64):x}@{_host(rng, ip_only)}:{rng.randint(20000, 50000)}"
+        f"?sni=example.com&insecure=1#hy2-{rng.randint(1, 9999)}"
+    )
+
+
+LINK_BUILDERS = {
+    "vmess": vmess_link,
+    "vless": vless_link,
+    "ss": ss_link,
+    "trojan": trojan_link,
+    "hysteria2": hysteria2_link,
+}
+
+
+def random_links(count, seed=0, protocols=None, ip_only=False):
+    rng = random.Random(seed)
+    if protocols:
+        choices = [(p, 1) for p in protocols]
+    else:
+        choices = PROTOCOL_WEIGHTS
+    names = [p for p, _ in choices]
+    weights = [w for _, w in choices]
+    return [
+        LINK_BUILDERS[rng.choices(names, weights)[0]](rng, ip_only) for _ in range(count)
+    ]
+
+
+def telegram_html(messages=2000, links_per_message=2, seed=1):
+    """模拟 t.me/s/ 频道页面：大量消息块，节点链接夹在普通文字中"""
+    rng = random.Random(seed)
+    links = random_links(messages * links_per_message, seed=seed)
+    parts = ['<html><head><title>Channel</title></head><body><section class="tgme_channel_history">']
+    for i in range(messages):
+        body = "<br/>".join(
+            f"节点 {j}: <code>{links[i * links_per_message + j]}</code>"
+            for j in range(links_per_message)
+        )
+        parts.append(
+            f'<div class="tgme_widget_message_wrap"><div class="tgme_widget_message" data-post="ch/{i}">'
+            f'<div class="tgme_widget_message_text">每日更新 免费节点 {rng.randint(1, 999)}<br/>{body}'
+            f'<a href="https://t.me/ch/{i}">link</a></div>'
+            f'<span class="tgme_widget_message_views">{rng.randint(100, 99999)}</span></div></div>'
+        )
+    parts.append("</section></body></html>")
+    return "".join(parts)
+
+
+def base64_subscription(links=5000, seed=2):
+    """Base64 编码的订阅内容（每行一个链接）"""
+    return base64.b64encode("\n".join(random_links(links, seed=seed)).encode()).decode()
+
+
+def clash_yaml(proxies=2000, seed=3):
+    """Clash 配置：proxies 列表，夹带若干订阅地址"""
+    rng = random.Random(seed)
+    lines = ["port: 7890", "mode: rule", "proxies:"]
+    for i in range(proxies):
+        lines.append(
+            f"  - {{name: node{i}, server: {_host(rng)}, port: {rng.randint(1000, 65000)}, "
+            f"type: vmess, uuid: {_uuid(rng)}, alterId: 0, cipher: auto, tls: true}}"
+        )
+        if i % 100 == 0:
+            lines.append(f"  # https://sub.example{i}.com/clash/config.yaml")
+    lines.append("proxy-groups:")
+    lines.append("  - {name: auto, type: url-test, proxies: [node0, node1]}")
+    return "\n".join(lines)
+
+
+def vmess_page(links=3000, seed=4):
+    """纯文本页面，包含大量 vmess 链接"""
+    return "\n".join(random_links(links, seed=seed, protocols=["vmess"]))
+
+
+def captured_pages(archive_path, limit=200):
+    """从 HTTP 录制存档读取真实页面（见 singbox_crawler.http_archive），返回 [(url, text)]"""
+    from singbox_crawler.http_archive import HttpArchive
+
+    archive = HttpArchive(archive_path)
+    try:
+        pages = []
+        for url in archive.urls()[:limit]:
+            entry = archive.get("GET", url)
+            if entry and entry["status"] == 200:
+                pages.append((url, entry["body"].decode("utf-8", errors="ignore")))
+        return pages
+    finally:
+        archive.close()
+
+
+def geo_api_payloads(seed=5):
+    """四个 geo API 的典型返回"""
+    rng = random.Random(seed)
+    return [
+        ("ipinfo", {"ip": "1.2.3.4", "city": "Tokyo", "region": "Tokyo", "country": "JP"}),
+        (
+            "ipapi_co",
+            {"status": "success", "country": "Japan", "countryCode": "JP", "city": "Tokyo"},
+        ),
+        (
+            "ipgeolocation",
+            {"country_code2": "US", "country_name": "United States", "city": "Ashburn"},
+        ),
+        ("ipwho", {"country_code": "SG", "country": "Singapore", "city": "Singapore"}),
+        ("ipinfo", {"ip": "5.6.7.8", "country": rng.choice(["DE", "FR", "XX"])}),
+    ]
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+热点路径基准测试
+测量 UniversalSpider.extract_from_text、parse 的 Base64 解码路径、
+Database.save_resource / update_source_stats（不同批量大小）、extract_ip_from_url 和 parse_geo_data，
+输出每秒操作数、P50/P99 延迟和内存分配（JSON），并与保存的基线比较，发现性能回退时返回非零退出码。
+
+用法：
+    python benchmarks/run_benchmarks.py                        # 运行并与 benchmarks/baseline.json 比较
+    python benchmarks/run_benchmarks.py --save-baseline        # 把本次结果保存为基线
+    python benchmarks/run_benchmarks.py --only extract --archive tmp/http_archive.db
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "tmp", "benchmarks")
+
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "crawler"))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "scripts"))
+import fixtures
+
+# 默认参数
+ITERATIONS = 50  # 计时的次数
+WARMUP = 3  # 预热次数
+ALLOC_ITERATIONS = 3  # 在 tracemalloc 下运行的次数（跟踪开销大，不参与计时）
+REGRESSION_THRESHOLD = 0.25  # 吞吐下降或 P99 上升超过该比例视为回退
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(fn, iterations=ITERATIONS, warmup=WARMUP, items_per_op=1):
+    """运行 fn 并返回统计结果（延迟单位为微秒）"""
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        fn()
+        timings.append(time.perf_counter_ns() - start)
+    timings.sort()
+    total_sec = sum(timings) / 1e9
+
+    # 单独在 tracemalloc 下测量每次操作的峰值分配和残留内存
+    tracemalloc.start()
+    try:
+        peak = 0
+        retained = 0
+        for _ in range(ALLOC_ITERATIONS):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            fn()
+            after, op_peak = tracemalloc.get_traced_memory()
+            peak = max(peak, op_peak - before)
+            retained += after - before
+    finally:
+        tracemalloc.stop()
+
+    ops_per_sec = iterations / total_sec if total_sec else 0
+    return {
+        "iterations": iterations,
+        "ops_per_sec": round(ops_per_sec, 2),
+        "items_per_sec": round(ops_per_sec * items_per_op, 2),
+        "mean_us": round(total_sec * 1e6 / iterations, 2),
+        "p50_us": round(percentile(timings, 50) / 1000, 2),
+        "p99_us": round(percentile(timings, 99) / 1000, 2),
+        "alloc_peak_bytes": peak,
+        "alloc_retained_bytes": retained // ALLOC_ITERATIONS,
+    }
+
+
+class BenchmarkSuite:
+    def __init__(self, iterations=ITERATIONS, archive_path=None):
+        self.iterations = iterations
+        self.archive_path = archive_path
+        self.tmpdir = tempfile.mkdtemp(prefix="singbox_bench_")
+        self._spider = None
+        self._db = None
+        self._counter = itertools.count()
+
+    # ---- 被测对象（延迟创建，只运行部分基准时不需要导入 Scrapy 或数据库） ----
+
+    @property
+    def db(self):
+        if self._db is None:
+            from singbox_crawler.database import Database
+
+            # 第一次创建决定单例使用的数据库，基准测试使用临时数据库
+            self._db = Database(db_path=os.path.join(self.tmpdir, "bench.db"))
+        return self._db
+
+    @property
+    def spider(self):
+        if self._spider is None:
+            from singbox_crawler.spiders.universal_spider import UniversalSpider
+
+            self.db
+            self._spider = UniversalSpider()
+        return self._spider
+
+    # ---- 基准 ----
+
+    def bench_extract(self):
+        """extract_from_text 在不同类型的页面上"""
+        texts = {
+            "telegram_html": fixtures.telegram_html(),
+            "clash_yaml": fixtures.clash_yaml(),
+            "vmess_page": fixtures.vmess_page(),
+        }
+        if self.archive_path:
+            captured = fixtures.captured_pages(self.archive_path)
+            if captured:
+                texts["captured"] = "\n".join(text for _, text in captured)
+        spider = self.spider
+        results = {}
+        for name, text in texts.items():
+            count = sum(1 for _ in spider.extract_from_text(text, "https://bench/" + name))
+
+            def run(text=text, name=name):
+                for _ in spider.extract_from_text(text, "https://bench/" + name):
+                    pass
+
+            result = measure(run, self.iterations, items_per_op=count)
+            result["items_per_op"] = count
+            result["input_bytes"] = len(text.encode("utf-8"))
+            results[f"extract_from_text[{name}]"] = result
+        return results
+
+    def bench_parse_base64(self):
+        """parse 处理 Base64 订阅内容（包括解码和提取）"""
+        from scrapy.http import TextResponse
+
+        url = "https://bench/base64_subscription"
+        body = fixtures.base64_subscription().encode()
+        self.db.add_source(url)
+        response = TextResponse(
+            url=url, body=body, encoding="utf-8", headers={"Content-Type": "text/plain"}
+        )
+        spider = self.spider
+        count = sum(1 for _ in spider.parse(response))
+
+        def run():
+            for _ in spider.parse(response):
+                pass
+
+        result = measure(run, self.iterations, items_per_op=count)
+        result["items_per_op"] = count
+        result["input_bytes"] = len(body)
+        return {"parse[base64_subscription]": result}
+
+    def bench_database(self, batch_sizes=(1, 50, 500)):
+        """save_resource 和 update_source_stats，每次操作处理一批"""
+        db = self.db
+        links = fixtures.random_links(2000, seed=42)
+        source_url = "https://bench/source"
+        db.add_source(source_url)
+        results = {}
+        for batch_size in batch_sizes:
+            iterations = max(3, min(self.iterations, 20000 // batch_size))
+
+            def save_batch(batch_size=batch_size):
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                for _ in range(batch_size):
+                    # 每次写入新的 URL，避免只测到“已存在”分支
+                    n = next(self._counter)
+                    db.save_resource(
+                        {
+                            "url": f"{links[n % len(links)]}&bench={n}",
+                            "protocol": "vmess",
+                            "crawl_time": now,
+                        },
+                        source_url,
+                    )
+
+            def update_batch(batch_size=batch_size):
+                for i in range(batch_size):
+                    db.update_source_stats(source_url, is_success=i % 5 != 0)
+
+            results[f"save_resource[batch={batch_size}]"] = measure(
+                save_batch, iterations, items_per_op=batch_size
+            )
+            results[f"update_source_stats[batch={batch_size}]"] = measure(
+                update_batch, iterations, items_per_op=batch_size
+            )
+        return results
+
+    def bench_geo(self):
+        """extract_ip_from_url 和 parse_geo_data"""
+        from update_server_region_fixed import extract_ip_from_url, parse_geo_data
+
+        # 只使用 IP 地址：域名会由 extract_ip_from_server 做真实的 DNS 解析，测到的是网络延迟
+        links = fixtures.random_links(1000, seed=7, ip_only=True)
+        payloads = fixtures.geo_api_payloads()
+
+        def extract_all():
+            for link in links:
+                extract_ip_from_url(link)
+
+        def parse_all():
+            for api_name, data in payloads:
+                parse_geo_data(api_name, data)
+
+        return {
+            "extract_ip_from_url": measure(
+                extract_all, self.iterations, items_per_op=len(links)
+            ),
+            "parse_geo_data": measure(
+                parse_all, self.iterations * 20, items_per_op=len(payloads)
+            ),
+        }
+
+    BENCHMARKS = {
+        "extract": bench_extract,
+        "parse": bench_parse_base64,
+        "database": bench_database,
+        "geo": bench_geo,
+    }
+
+    def run(self, only=None):
+        results = {}
+        for name, bench in self.BENCHMARKS.items():
+            if only and name not in only:
+                continue
+            print(f"运行基准: {name}...")
+            results.update(bench(self))
+        return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """返回回退列表 [(名称, 指标, 基线值, 当前值)]"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if base["ops_per_sec"] and current["ops_per_sec"] < base["ops_per_sec"] * (1 - threshold):
+            regressions.append((name, "ops_per_sec", base["ops_per_sec"], current["ops_per_sec"]))
+        if base["p99_us"] and current["p99_us"] > base["p99_us"] * (1 + threshold):
+            regressions.append((name, "p99_us", base["p99_us"], current["p99_us"]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    base_results = (baseline or {}).get("results", {})
+    print(f"\n{'-'*110}")
+    print(
+        f"{'基准':42} | {'ops/s':>10} | {'items/s':>12} | {'P50 us':>10} | {'P99 us':>10} | {'峰值分配':>10} | 对比基线"
+    )
+    print(f"{'-'*110}")
+    for name, r in results.items():
+        delta = ""
+        base = base_results.get(name)
+        if base and base["ops_per_sec"]:
+            delta = f"{(r['ops_per_sec'] / base['ops_per_sec'] - 1) * 100:+.1f}%"
+        print(
+            f"{name:42} | {r['ops_per_sec']:10.1f} | {r['items_per_sec']:12.1f} | "
+            f"{r['p50_us']:10.1f} | {r['p99_us']:10.1f} | {r['alloc_peak_bytes']:10} | {delta}"
+        )
+    print(f"{'-'*110}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="热点路径基准测试")
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=sorted(BenchmarkSuite.BENCHMARKS),
+        help="只运行指定的基准",
+    )
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument(
+        "--archive", help="HTTP 录制存档路径，加入真实抓取页面的 extract_from_text 基准"
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help="回退判定阈值（比例）",
+    )
+    parser.add_argument("--output", help="结果 JSON 输出路径（默认 tmp/benchmarks/）")
+    args = parser.parse_args()
+
+    suite = BenchmarkSuite(iterations=args.iterations, archive_path=args.archive)
+    results = suite.run(args.only)
+
+    report = {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到: {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到: {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print("没有基线，跳过回退检查（使用 --save-baseline 保存）")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n发现 {len(regressions)} 项性能回退（阈值 {args.threshold:.0%}）:")
+        for name, metric, base, current in regressions:
+            print(f"  {name}: {metric} {base} -> {current}")
+        return 1
+    print("未发现性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
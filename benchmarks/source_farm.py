@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+合成源站压测
+在本地 HTTP 服务器上提供数千个合成源页面（可配置协议链接、Base64 订阅、外链、404 和慢响应的比例），
+写入临时数据库的 sources 表后驱动 UniversalSpider 完整爬取一轮，
+按秒记录抓取吞吐、数据库写入速率和内存曲线，结果写入 tmp/benchmarks/farm_*.json。
+完全离线运行。
+
+用法：
+    python benchmarks/source_farm.py --pages 2000 --concurrency 16
+    python benchmarks/source_farm.py --mix html=50,text=20,base64=20,notfound=5,slow=5 --slow-ms 3000
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "tmp", "benchmarks")
+
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "crawler"))
+import fixtures
+
+# 默认参数
+FARM_PAGES = 2000
+FARM_MIX = "html=40,text=25,base64=20,notfound=10,slow=5"
+FARM_LINKS_PER_PAGE = 20  # 每个页面的节点链接数
+FARM_OUTBOUND_PER_PAGE = 5  # 每个 HTML 页面指向其他合成页面的外链数
+FARM_SLOW_MS = 2000  # 慢响应的延迟
+FARM_CONCURRENCY = 16
+FARM_TIMEOUT_SEC = 600  # 单轮爬取的最长时间
+SAMPLE_INTERVAL_SEC = 1.0
+
+PAGE_KINDS = ("html", "text", "base64", "notfound", "slow")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in PAGE_KINDS:
+            raise ValueError(f"Unknown page kind: {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+class SourceFarm:
+    """
+    本地合成源站，页面 URL 为 /free/<类型>/<编号>
+    （路径包含 "free"，HTML 页面中的外链会被爬虫的链接发现逻辑收录）
+    """
+
+    def __init__(
+        self,
+        pages=FARM_PAGES,
+        mix=None,
+        links_per_page=FARM_LINKS_PER_PAGE,
+        outbound_per_page=FARM_OUTBOUND_PER_PAGE,
+        slow_ms=FARM_SLOW_MS,
+        seed=0,
+    ):
+        self.pages = pages
+        self.links_per_page = links_per_page
+        self.outbound_per_page = outbound_per_page
+        self.slow_sec = slow_ms / 1000
+        self.seed = seed
+        mix = mix or parse_mix(FARM_MIX)
+        rng = random.Random(seed)
+        kinds = list(mix)
+        weights = [mix[k] for k in kinds]
+        self.kinds = [rng.choices(kinds, weights)[0] for _ in range(pages)]
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = None
+
+    def page_url(self, i):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/free/{self.kinds[i]}/{i}"
+
+    def urls(self):
+        return [self.page_url(i) for i in range(self.pages)]
+
+    def render(self, kind, i):
+        """返回 (状态码, Content-Type, 内容)，同一页面每次生成的内容相同"""
+        if kind == "notfound":
+            return 404, "text/plain", b"not found"
+        links = fixtures.random_links(self.links_per_page, seed=self.seed * 1000003 + i)
+        if kind == "base64":
+            return 200, "text/plain", base64.b64encode("\n".join(links).encode())
+        if kind in ("text", "slow"):
+            return 200, "text/plain", "\n".join(links).encode()
+        rng = random.Random(i)
+        outbound = "".join(
+            f'<a href="{self.page_url(rng.randrange(self.pages))}">more</a>'
+            for _ in range(self.outbound_per_page)
+        )
+        body = "".join(f"<p>免费节点 <code>{link}</code></p>" for link in links)
+        html = f"<html><body>{body}{outbound}<a href='/style.css'>css</a></body></html>"
+        return 200, "text/html; charset=utf-8", html.encode()
+
+    def _handler(self):
+        farm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with farm._lock:
+                    farm.requests += 1
+                parts = self.path.strip("/").split("/")
+                if len(parts) != 3 or parts[0] != "free" or parts[1] not in PAGE_KINDS:
+                    self.send_error(404)
+                    return
+                kind, i = parts[1], int(parts[2])
+                if kind == "slow":
+                    time.sleep(farm.slow_sec)
+                status, content_type, body = farm.render(kind, i)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class CrawlSampler:
+    """在 reactor 中按秒记录抓取计数、数据库行数和内存"""
+
+    def __init__(self, crawler, db_path, interval=SAMPLE_INTERVAL_SEC):
+        from singbox_crawler.memory import rss_mb
+
+        self.crawler = crawler
+        self.db_path = db_path
+        self.interval = interval
+        self.rss_mb = rss_mb
+        self.samples = []
+        self.started = None
+        self.task = None
+
+    def _count(self, table):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        finally:
+            conn.close()
+
+    def sample(self):
+        stats = self.crawler.stats
+        self.samples.append(
+            {
+                "t": round(time.monotonic() - self.started, 2),
+                "responses": stats.get_value("response_received_count", 0),
+                "items": stats.get_value("item_scraped_count", 0),
+                "resources": self._count("resources"),
+                "sources": self._count("sources"),
+                "rss_mb": round(self.rss_mb(), 2),
+            }
+        )
+
+    def start(self):
+        from twisted.internet import task
+
+        self.started = time.monotonic()
+        self.task = task.LoopingCall(self.sample)
+        self.task.start(self.interval)
+
+    def stop(self):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.sample()
+
+
+def summarize(samples, seeded, farm_requests):
+    if not samples:
+        return {}
+    last = samples[-1]
+    duration = last["t"] or 1
+    first = samples[0]
+    return {
+        "duration_sec": duration,
+        "sources_seeded": seeded,
+        "farm_requests": farm_requests,
+        "responses": last["responses"],
+        "sources_per_min": round(last["responses"] / duration * 60, 1),
+        "pages_per_sec": round(last["responses"] / duration, 2),
+        "items_per_sec": round(last["items"] / duration, 2),
+        "db_resource_writes_per_sec": round(
+            (last["resources"] - first["resources"]) / duration, 2
+        ),
+        "sources_discovered": last["sources"] - seeded,
+        "peak_rss_mb": max(s["rss_mb"] for s in samples),
+        "final_rss_mb": last["rss_mb"],
+    }
+
+
+def run(args):
+    # 爬虫、数据库使用临时文件，不影响生产数据
+    tmpdir = tempfile.mkdtemp(prefix="singbox_farm_")
+    db_path = os.path.join(tmpdir, "farm.db")
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "singbox_crawler.settings")
+
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    from singbox_crawler.database import Database
+    from singbox_crawler.spiders.universal_spider import UniversalSpider
+
+    farm = SourceFarm(
+        pages=args.pages,
+        mix=parse_mix(args.mix),
+        links_per_page=args.links_per_page,
+        outbound_per_page=args.outbound_per_page,
+        slow_ms=args.slow_ms,
+        seed=args.seed,
+    ).start()
+    print(f"合成源站: http://127.0.0.1:{farm.server.server_address[1]}/ ({args.pages} 个页面)")
+
+    db = Database(db_path=db_path)
+    for url in farm.urls():
+        db.add_source(url)
+    print(f"已写入 {args.pages} 个源到 {db_path}")
+
+    settings = get_project_settings()
+    # 本地源直连：关闭代理中间件（否则请求会经过 PROXY_URL），也不写入正式的路由状态文件
+    middlewares = dict(settings.getdict("DOWNLOADER_MIDDLEWARES"))
+    middlewares["singbox_crawler.middlewares.ProxyPoolMiddleware"] = None
+    middlewares["singbox_crawler.middlewares.SmartProxyMiddleware"] = None
+    settings.setdict(
+        {
+            "JOBDIR": None,
+            "DOWNLOADER_MIDDLEWARES": middlewares,
+            "ROUTING_STATE_PATH": None,
+            "LOG_LEVEL": args.log_level,
+            "DOWNLOAD_DELAY": 0,
+            "AUTOTHROTTLE_ENABLED": False,
+            "CONCURRENT_REQUESTS": args.concurrency,
+            "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+            "CONCURRENT_REQUESTS_PER_IP": args.concurrency,
+            "CLOSESPIDER_TIMEOUT": args.timeout,
+            "RETRY_ENABLED": False,
+            "METRICS_ENABLED": False,
+            "HTTP_ARCHIVE_MODE": "",
+        },
+        priority="cmdline",
+    )
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(UniversalSpider)
+    sampler = CrawlSampler(crawler, db_path)
+
+    from scrapy import signals
+
+    crawler.signals.connect(sampler.start, signal=signals.engine_started)
+    crawler.signals.connect(sampler.stop, signal=signals.engine_stopped)
+    process.crawl(crawler, skip_initial_sources=True)
+    try:
+        process.start()
+    finally:
+        farm.close()
+
+    summary = summarize(sampler.samples, args.pages, farm.requests)
+    result = {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "params": {
+            "pages": args.pages,
+            "mix": args.mix,
+            "links_per_page": args.links_per_page,
+            "outbound_per_page": args.outbound_per_page,
+            "slow_ms": args.slow_ms,
+            "concurrency": args.concurrency,
+        },
+        "summary": summary,
+        "samples": sampler.samples,
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"farm_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'-'*60}")
+    for key, value in summary.items():
+        print(f"{key:28}: {value}")
+    print(f"{'-'*60}")
+    print(f"结果已保存到: {output}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成源站端到端爬取压测")
+    parser.add_argument("--pages", type=int, default=FARM_PAGES)
+    parser.add_argument(
+        "--mix", default=FARM_MIX, help=f"页面类型比例，可用类型: {', '.join(PAGE_KINDS)}"
+    )
+    parser.add_argument("--links-per-page", type=int, default=FARM_LINKS_PER_PAGE)
+    parser.add_argument("--outbound-per-page", type=int, default=FARM_OUTBOUND_PER_PAGE)
+    parser.add_argument("--slow-ms", type=int, default=FARM_SLOW_MS)
+    parser.add_argument("--concurrency", type=int, default=FARM_CONCURRENCY)
+    parser.add_argument("--timeout", type=int, default=FARM_TIMEOUT_SEC)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="结果 JSON 路径（默认 tmp/benchmarks/）")
+    parser.add_argument(
+        "--serve-only",
+        action="store_true",
+        help="只启动合成源站并打印源地址，不运行爬虫（配合外部爬虫进程使用）",
+    )
+    args = parser.parse_args()
+
+    if args.serve_only:
+        farm = SourceFarm(
+            pages=args.pages,
+            mix=parse_mix(args.mix),
+            links_per_page=args.links_per_page,
+            outbound_per_page=args.outbound_per_page,
+            slow_ms=args.slow_ms,
+            seed=args.seed,
+        ).start()
+        print(f"合成源站: http://127.0.0.1:{farm.server.server_address[1]}/free/<kind>/<n>")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            farm.close()
+        return
+
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
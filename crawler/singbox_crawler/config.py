@@ -14,8 +14,20 @@ class Config(BaseSettings):
     service_restart_delay_sec: int = 30
     service_max_restart_attempts: int = 5
     service_cpu_limit_percent: int = 50
+    # 超过 CPU 上限时对爬虫进程树做暂停/恢复的占空比节流（否则只记录日志）
+    service_cpu_throttle_enabled: bool = True
     service_memory_limit_mb: int = 1024
+    # 内存超限后等待爬虫排空（停止新请求、写完数据）的最长时间，超时才强制结束
+    service_drain_timeout_sec: int = 120
+    # tracemalloc 记录的调用栈深度，0 表示不跟踪；只在内存超过上限的 70% 后跟踪，写完快照即停止
+    service_tracemalloc_frames: int = 1
     service_gc_interval_hours: int = 2
+    # 常驻模式：一个进程内反复调度爬取轮次，而不是每轮启动一次 scrapy
+    service_persistent_crawler: bool = False
+    # 常驻进程内存超过该值时在本轮结束后退出并重启
+    service_recycle_memory_mb: int = 768
+    # 同时运行的爬虫进程数（>1 时通过 sources 表上的租约分配到期源，非常驻模式）
+    service_crawler_workers: int = 1
 
     # Crawler Configuration
     crawler_max_concurrent_requests: int = 5
@@ -23,6 +35,11 @@ class Config(BaseSettings):
     crawler_retry_times: int = 2
     crawler_retry_backoff_factor: float = 2
     crawler_request_timeout: int = 30
+    # 用已验证节点组成的本地代理池爬取限速严重的站点
+    crawler_proxy_pool_enabled: bool = False
+    crawler_proxy_pool_size: int = 20
+    # 按租约分批领取到期源，多个爬虫进程（或共享数据库文件的多台主机）可以同时运行
+    crawler_source_leases_enabled: bool = False
 
     # Database Configuration
     database_max_connections: int = 20
@@ -45,6 +62,13 @@ class Config(BaseSettings):
 
     # Monitoring Configuration
     monitoring_p99_response_limit_sec: float = 2
+    # 本地 /metrics 端点（Prometheus 文本格式）
+    monitoring_metrics_enabled: bool = True
+    monitoring_metrics_port: int = 9410
+    # 启动时开启性能分析的阶段（parse,pipeline,db,geo,test 或 all），为空表示不开启
+    monitoring_profile_stages: str = ""
+    monitoring_profile_mode: str = "sample"
+    monitoring_profile_duration_sec: float = 60
 
 
 # 全局配置实例
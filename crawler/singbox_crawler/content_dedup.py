@@ -0,0 +1,115 @@
+"""
+按内容哈希跳过重复的响应体
+很多来源是同一份节点列表的镜像或 fork，返回的内容逐字节相同。爬虫对响应体（以及 Base64 解码后的内容）
+计算 blake2b 摘要，最近处理过的摘要保存在内存 LRU 中，启动时从 SQLite 的 content_hashes 表加载；
+重复的内容不再提取资源，只把来源与已有内容关联（source_content 表），保留来源归属和产出统计。
+数据库写入由 SourceWriter 与其他 sources 更新一起批量提交，反应器线程只访问内存。
+"""
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from hashlib import blake2b
+
+CONTENT_DEDUP_TTL_HOURS = 24  # 内容在该时间内再次出现时跳过提取
+CONTENT_DEDUP_MEMORY_SIZE = 50_000  # 内存中保存的摘要数
+CONTENT_RETENTION_DAYS = 30  # 超过该时间未再出现的内容记录被清理
+
+
+def ensure_schema(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS content_hashes (
+            hash TEXT PRIMARY KEY,
+            first_source TEXT,
+            items INTEGER DEFAULT 0,
+            first_seen TEXT,
+            last_seen TEXT
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_content_hashes_last_seen ON content_hashes(last_seen)"
+    )
+    # 来源与内容的关联：同一内容的所有镜像来源，以及每个来源提供该内容的次数和产出的资源数
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS source_content (
+            source_url TEXT,
+            hash TEXT,
+            items INTEGER DEFAULT 0,
+            hits INTEGER DEFAULT 0,
+            first_seen TEXT,
+            last_seen TEXT,
+            PRIMARY KEY (source_url, hash)
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_source_content_hash ON source_content(hash)"
+    )
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return blake2b(data, digest_size=16).hexdigest()
+
+
+class ContentIndex:
+    """最近处理过的内容摘要 -> [首个来源, 产出资源数, 时间戳]"""
+
+    def __init__(self, ttl_hours=CONTENT_DEDUP_TTL_HOURS, memory_size=CONTENT_DEDUP_MEMORY_SIZE):
+        self.ttl = ttl_hours * 3600
+        self.memory_size = memory_size
+        self.entries = OrderedDict()
+
+    def load(self, db_path, retention_days=CONTENT_RETENTION_DAYS):
+        """清理过期记录并加载 TTL 内的摘要，返回加载数量"""
+        now = datetime.now()
+        since = (now - timedelta(seconds=self.ttl)).strftime("%Y-%m-%d %H:%M:%S")
+        expired = (now - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            with conn:
+                ensure_schema(conn)
+                conn.execute("DELETE FROM content_hashes WHERE last_seen < ?", (expired,))
+                conn.execute("DELETE FROM source_content WHERE last_seen < ?", (expired,))
+            rows = conn.execute(
+                """
+                SELECT hash, first_source, items, last_seen FROM content_hashes
+                WHERE last_seen >= ?
+                ORDER BY last_seen DESC
+                LIMIT ?
+            """,
+                (since, self.memory_size),
+            ).fetchall()
+        finally:
+            conn.close()
+        for digest, first_source, items, last_seen in reversed(rows):
+            seen_at = datetime.strptime(last_seen, "%Y-%m-%d %H:%M:%S").timestamp()
+            self.entries[digest] = [first_source, items or 0, seen_at]
+        return len(rows)
+
+    def lookup(self, digest):
+        """TTL 内处理过时返回记录，否则返回 None"""
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+        if time.time() - entry[2] >= self.ttl:
+            del self.entries[digest]
+            return None
+        self.entries.move_to_end(digest)
+        return entry
+
+    def add(self, digest, source_url):
+        """登记开始处理的内容，提取完成后由调用方更新产出资源数"""
+        entry = [source_url, 0, time.time()]
+        self.entries[digest] = entry
+        self.entries.move_to_end(digest)
+        if len(self.entries) > self.memory_size:
+            self.entries.popitem(last=False)
+        return entry
+
+    def __len__(self):
+        return len(self.entries)
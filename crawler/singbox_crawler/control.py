@@ -0,0 +1,86 @@
+"""
+supervisor 与爬虫进程之间的控制文件
+Windows 上没有可用的 SIGUSR1 之类的信号，terminate() 会直接结束进程，
+因此 service_launcher 通过在 tmp/control 下创建 "<命令>.<pid>" 文件向爬虫发出请求，
+爬虫定期检查并在处理完后删除。文件名带 pid，进程重启后不会误读旧请求。
+"""
+import os
+
+PROJECT_ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+CONTROL_DIR = os.path.join(PROJECT_ROOT, "tmp", "control")
+
+# 停止调度新请求、写完已有数据后退出
+DRAIN = "drain"
+# 开启性能分析，文件内容为分析参数（见 profiling.parse_request）
+PROFILE = "profile"
+# CPU 节流，文件内容为运行比例（0~1），爬虫按比例在反应器中让出 CPU；文件存在期间一直有效
+THROTTLE = "throttle"
+
+
+def _path(command, pid=None):
+    return os.path.join(CONTROL_DIR, f"{command}.{pid or os.getpid()}")
+
+
+def request(command, pid, payload=None):
+    """由 supervisor 调用，向 pid 进程发出请求"""
+    os.makedirs(CONTROL_DIR, exist_ok=True)
+    tmp_path = _path(command, pid) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(payload or command)
+    # 原子替换，避免被控进程读到写了一半的文件
+    os.replace(tmp_path, _path(command, pid))
+
+
+def is_requested(command, pid=None):
+    return os.path.exists(_path(command, pid))
+
+
+def read(command, pid=None):
+    """读取本进程收到的请求但不删除（用于持续生效的设置），没有请求时返回 None"""
+    try:
+        with open(_path(command, pid), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def consume(command, pid=None):
+    """读取并删除本进程收到的请求，没有请求时返回 None"""
+    try:
+        with open(_path(command, pid), "r", encoding="utf-8") as f:
+            payload = f.read()
+    except FileNotFoundError:
+        return None
+    clear(command, pid)
+    return payload
+
+
+def clear(command, pid=None):
+    try:
+        os.remove(_path(command, pid))
+    except FileNotFoundError:
+        pass
+
+
+def write_pid(name, pid):
+    """记录某个角色（例如 crawler）当前的进程 ID，供命令行工具查找"""
+    os.makedirs(CONTROL_DIR, exist_ok=True)
+    with open(os.path.join(CONTROL_DIR, f"{name}.pid"), "w", encoding="utf-8") as f:
+        f.write(str(pid))
+
+
+def read_pid(name):
+    try:
+        with open(os.path.join(CONTROL_DIR, f"{name}.pid"), "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def clear_pid(name):
+    try:
+        os.remove(os.path.join(CONTROL_DIR, f"{name}.pid"))
+    except FileNotFoundError:
+        pass
@@ -7,6 +7,7 @@ from queue import Empty, Full, Queue
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from .config import config
+from .content_dedup import ensure_schema as ensure_content_schema
 
 
 class Database:
@@ -47,7 +48,9 @@ class Database:
                 # But for SQLite, let's just create a new connection if needed and not enforce strict
                 # "blocking" if max is reached because we don't want to deadlock single thread.
                 # However, to strictly follow "pool" logic:
-                conn = sqlite3.connect(self.db_path)
+                # The pool hands each connection to one caller at a time, so it may be
+                # reused from another thread (e.g. deferToThread in the crawl service).
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
 
             yield conn
         finally:
@@ -72,7 +75,10 @@ class Database:
                     success_count INTEGER DEFAULT 0,
                     fail_count INTEGER DEFAULT 0,
                     last_status_code INTEGER,
-                    last_checked TEXT
+                    last_checked TEXT,
+                    last_attempt_time TEXT,
+                    lease_owner TEXT,
+                    leased_until TEXT
                 )
             """
             )
@@ -125,6 +131,9 @@ class Database:
                 "fail_count": "INTEGER DEFAULT 0",
                 "last_status_code": "INTEGER",
                 "last_checked": "TEXT",
+                "last_attempt_time": "TEXT",
+                "lease_owner": "TEXT",
+                "leased_until": "TEXT",
             }
 
             for col_name, col_def in required_columns.items():
@@ -133,6 +142,10 @@ class Database:
                         f"Migrating database: adding column {col_name} to sources table"
                     )
                     conn.execute(f"ALTER TABLE sources ADD COLUMN {col_name} {col_def}")
+            # 续约 / 释放按 worker 查找自己的租约
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sources_lease_owner ON sources(lease_owner)"
+            )
 
             # 迁移 resources 表
             cursor = conn.execute("PRAGMA table_info(resources)")
@@ -179,6 +192,9 @@ class Database:
             """
             )
 
+            # 镜像来源的内容哈希索引
+            ensure_content_schema(conn)
+
             conn.commit()
 
     @retry(
@@ -207,21 +223,142 @@ class Database:
         stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=0.5, max=10)
     )
     def get_sources_to_crawl(self, interval_hours=6):
-        """获取活跃且超过间隔时间未爬取的源"""
+        """获取活跃且超过间隔时间未爬取的源（爬取失败的源同样等待一个间隔后再重试）"""
         time_threshold = (datetime.now() - timedelta(hours=interval_hours)).strftime(
             "%Y-%m-%d %H:%M:%S"
         )
         with self._get_conn() as conn:
+            # 其他 worker 租约未过期的源跳过，避免重复抓取
             cursor = conn.execute(
                 """
                 SELECT url FROM sources
                 WHERE status = 'active'
                 AND (last_crawl_time IS NULL OR last_crawl_time < ?)
+                AND (last_attempt_time IS NULL OR last_attempt_time < ?)
+                AND (leased_until IS NULL OR leased_until < ?)
             """,
-                (time_threshold,),
+                (time_threshold, time_threshold, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
             )
             return [row[0] for row in cursor.fetchall()]
 
+    # ---- 多 worker 租约 ----
+    # 多个爬虫进程（可以在共享数据库文件的不同主机上）通过租约分批领取到期的源：
+    # 领取时写入 lease_owner / leased_until，爬取期间定期续约，完成后释放；
+    # worker 崩溃后租约过期，源会被其他 worker 重新领取。
+
+    @retry(
+        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=0.5, max=10)
+    )
+    def claim_sources(self, owner, limit, interval_hours=6, lease_sec=600):
+        """原子地领取最多 limit 个到期且未被租用的源，返回 URL 列表"""
+        now = datetime.now()
+        time_threshold = (now - timedelta(hours=interval_hours)).strftime("%Y-%m-%d %H:%M:%S")
+        now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+        leased_until = (now + timedelta(seconds=lease_sec)).strftime("%Y-%m-%d %H:%M:%S")
+        with self._get_conn() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    """
+                    SELECT id, url FROM sources
+                    WHERE status = 'active'
+                    AND (last_crawl_time IS NULL OR last_crawl_time < ?)
+                    AND (last_attempt_time IS NULL OR last_attempt_time < ?)
+                    AND (leased_until IS NULL OR leased_until < ?)
+                    ORDER BY last_crawl_time IS NOT NULL, last_crawl_time
+                    LIMIT ?
+                """,
+                    (time_threshold, time_threshold, now_str, limit),
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE sources SET lease_owner = ?, leased_until = ? WHERE id = ?",
+                    [(owner, leased_until, row[0]) for row in rows],
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return [row[1] for row in rows]
+
+    def renew_source_leases(self, owner, lease_sec=600):
+        """心跳：延长 owner 持有的所有租约，返回续约数量"""
+        leased_until = (datetime.now() + timedelta(seconds=lease_sec)).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        with self._get_conn() as conn:
+            cursor = conn.execute(
+                "UPDATE sources SET leased_until = ? WHERE lease_owner = ?",
+                (leased_until, owner),
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    def release_source(self, url, owner):
+        with self._get_conn() as conn:
+            conn.execute(
+                """
+                UPDATE sources SET lease_owner = NULL, leased_until = NULL
+                WHERE url = ? AND lease_owner = ?
+            """,
+                (url, owner),
+            )
+            conn.commit()
+
+    def release_source_leases(self, owner):
+        """释放 owner 持有的所有租约（worker 正常退出时调用），返回释放数量"""
+        with self._get_conn() as conn:
+            cursor = conn.execute(
+                "UPDATE sources SET lease_owner = NULL, leased_until = NULL WHERE lease_owner = ?",
+                (owner,),
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    def seconds_until_next_due(self, interval_hours=6):
+        """
+        距离下一个活跃源到期还有多少秒，已有到期源时返回 0，没有活跃源时返回完整间隔
+        源的到期时间取最后一次成功爬取和最后一次尝试（包括失败）中较晚的一个，一直失败的源不会立即到期
+        """
+        with self._get_conn() as conn:
+            row = conn.execute(
+                """
+                SELECT COUNT(*),
+                       MIN(MAX(COALESCE(last_crawl_time, ''), COALESCE(last_attempt_time, '')))
+                FROM sources WHERE status = 'active'
+            """
+            ).fetchone()
+        count, oldest = row
+        if not count:
+            return interval_hours * 3600
+        if not oldest:
+            return 0
+        due_at = datetime.strptime(oldest, "%Y-%m-%d %H:%M:%S") + timedelta(
+            hours=interval_hours
+        )
+        return max(0, (due_at - datetime.now()).total_seconds())
+
+    @retry(
+        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=0.5, max=10)
+    )
+    def get_verified_proxies(self, limit, exclude_ids=()):
+        """取最新的已验证代理节点 (id, url, protocol)，订阅链接和 exclude_ids 中的节点除外"""
+        exclude_ids = list(exclude_ids)
+        placeholders = ",".join("?" * len(exclude_ids))
+        exclude_sql = f"AND id NOT IN ({placeholders})" if exclude_ids else ""
+        with self._get_conn() as conn:
+            cursor = conn.execute(
+                f"""
+                SELECT id, url, protocol FROM resources
+                WHERE status IN ('success', 'verified')
+                AND protocol NOT IN ('clash_sub', 'singbox_sub')
+                {exclude_sql}
+                ORDER BY id DESC
+                LIMIT ?
+            """,
+                (*exclude_ids, limit),
+            )
+            return cursor.fetchall()
+
     @retry(
         stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=0.5, max=10)
     )
@@ -234,6 +371,7 @@ class Database:
         stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=0.5, max=10)
     )
     def update_source_stats(self, url, is_success):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         with self._get_conn() as conn:
             if is_success:
                 conn.execute(
@@ -241,15 +379,17 @@ class Database:
                     UPDATE sources
                     SET success_count = success_count + 1,
                         last_crawl_time = ?,
+                        last_attempt_time = ?,
                         fail_count = 0
                     WHERE url = ?
                 """,
-                    (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url),
+                    (now, now, url),
                 )
             else:
+                # 记录尝试时间，失败的源在一个爬取间隔后才重新到期
                 conn.execute(
-                    "UPDATE sources SET fail_count = fail_count + 1 WHERE url = ?",
-                    (url,),
+                    "UPDATE sources SET fail_count = fail_count + 1, last_attempt_time = ? WHERE url = ?",
+                    (now, url),
                 )
             conn.commit()
 
@@ -0,0 +1,206 @@
+"""
+有界、按时间分代的 Bloom 过滤器去重
+Scrapy 默认的 RFPDupeFilter 在 JOBDIR 下把所有请求指纹写入 requests.seen 并全部读入内存，
+长期运行后文件和内存无限增长，而且已经爬过的来源永远不会再被请求。
+这里用多代 Bloom 过滤器代替：新指纹写入当前代，查询时检查所有代；
+当前代超过 generation_sec 或写满 capacity 时新开一代，只保留最近 generations 代。
+一个请求在 (generations - 1) × generation_sec 到 generations × generation_sec 之后会被遗忘，
+可以再次爬取；内存和启动加载时间不超过 generations 个过滤器的大小。
+"""
+import json
+import logging
+import math
+import os
+import struct
+import time
+
+from scrapy.dupefilters import BaseDupeFilter
+
+BLOOM_CAPACITY = 1_000_000  # 每代最多容纳的指纹数
+BLOOM_ERROR_RATE = 0.001  # 每代的误判率
+BLOOM_GENERATION_SEC = 2 * 3600
+BLOOM_GENERATIONS = 3
+
+_MAGIC = b"BLMDUP1\n"
+
+
+class BloomFilter:
+    """固定大小的 Bloom 过滤器，位数和哈希次数按容量和误判率计算"""
+
+    def __init__(self, capacity, error_rate, created_at=None, count=0, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+        self.created_at = created_at or time.time()
+        self.count = count
+
+    def _positions(self, key):
+        # 指纹本身是均匀分布的哈希值，直接拆成两个整数做双重哈希
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key):
+        bits = self.bits
+        for p in self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class RotatingBloomFilter:
+    def __init__(
+        self,
+        capacity=BLOOM_CAPACITY,
+        error_rate=BLOOM_ERROR_RATE,
+        generation_sec=BLOOM_GENERATION_SEC,
+        generations=BLOOM_GENERATIONS,
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.generation_sec = generation_sec
+        self.max_generations = generations
+        self.generations = []  # 从旧到新
+
+    def _current(self):
+        now = time.time()
+        # 丢弃整个窗口之外的旧代（服务停了很久之后重新启动的情况）
+        window = self.generation_sec * self.max_generations
+        while self.generations and now - self.generations[0].created_at >= window:
+            self.generations.pop(0)
+        current = self.generations[-1] if self.generations else None
+        if current is None or current.full or now - current.created_at >= self.generation_sec:
+            current = BloomFilter(self.capacity, self.error_rate, created_at=now)
+            self.generations.append(current)
+            del self.generations[: -self.max_generations]
+        return current
+
+    def __contains__(self, key):
+        return any(key in g for g in reversed(self.generations))
+
+    def add(self, key):
+        """加入指纹，返回之前是否已存在"""
+        current = self._current()
+        if key in self:
+            return True
+        current.add(key)
+        return False
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = json.dumps(
+            {
+                "capacity": self.capacity,
+                "error_rate": self.error_rate,
+                "generations": [[g.created_at, g.count] for g in self.generations],
+            }
+        ).encode("utf-8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for g in self.generations:
+                f.write(g.bits)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """读取保存的过滤器，参数（容量、误判率）变化时旧数据作废，返回是否加载成功"""
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                return False
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length))
+            if header["capacity"] != self.capacity or header["error_rate"] != self.error_rate:
+                return False
+            generations = []
+            for created_at, count in header["generations"]:
+                g = BloomFilter(self.capacity, self.error_rate, created_at, count)
+                data = f.read(len(g.bits))
+                if len(data) != len(g.bits):
+                    return False
+                g.bits = bytearray(data)
+                generations.append(g)
+        self.generations = generations[-self.max_generations :]
+        return True
+
+
+class BloomDupeFilter(BaseDupeFilter):
+    """
+    DUPEFILTER_CLASS = "singbox_crawler.dupefilter.BloomDupeFilter"
+    状态保存在 BLOOM_DUPEFILTER_PATH（默认 JOBDIR/requests.bloom），没有路径时只在内存中使用
+    """
+
+    def __init__(self, fingerprinter, path=None, debug=False, **filter_kwargs):
+        self.fingerprinter = fingerprinter
+        self.path = path
+        self.debug = debug
+        self.filter = RotatingBloomFilter(**filter_kwargs)
+        self.logger = logging.getLogger(__name__)
+        self.log_dupes = True
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        path = settings.get("BLOOM_DUPEFILTER_PATH")
+        jobdir = settings.get("JOBDIR")
+        if not path and jobdir:
+            path = os.path.join(jobdir, "requests.bloom")
+        return cls(
+            crawler.request_fingerprinter,
+            path=path,
+            debug=settings.getbool("DUPEFILTER_DEBUG"),
+            capacity=settings.getint("BLOOM_DUPEFILTER_CAPACITY", BLOOM_CAPACITY),
+            error_rate=settings.getfloat("BLOOM_DUPEFILTER_ERROR_RATE", BLOOM_ERROR_RATE),
+            generation_sec=settings.getfloat("BLOOM_DUPEFILTER_GENERATION_SEC", BLOOM_GENERATION_SEC),
+            generations=settings.getint("BLOOM_DUPEFILTER_GENERATIONS", BLOOM_GENERATIONS),
+        )
+
+    def open(self):
+        if not self.path:
+            return
+        # RFPDupeFilter 留下的无界指纹文件不再使用
+        legacy = os.path.join(os.path.dirname(self.path), "requests.seen")
+        if os.path.exists(legacy):
+            os.remove(legacy)
+            self.logger.info(f"Removed legacy fingerprint file {legacy}")
+        try:
+            if self.filter.load(self.path):
+                total = sum(g.count for g in self.filter.generations)
+                self.logger.info(
+                    f"Loaded {len(self.filter.generations)} bloom generations ({total} fingerprints) from {self.path}"
+                )
+            else:
+                self.logger.warning(f"Ignoring incompatible bloom filter {self.path}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            self.logger.warning(f"Failed to load bloom filter {self.path}: {e}")
+
+    def close(self, reason):
+        if self.path:
+            self.filter.save(self.path)
+
+    def request_seen(self, request):
+        return self.filter.add(self.fingerprinter.fingerprint(request))
+
+    def log(self, request, spider):
+        if self.debug:
+            self.logger.debug(f"Filtered duplicate request: {request}", extra={"spider": spider})
+        elif self.log_dupes:
+            self.logger.debug(
+                f"Filtered duplicate request: {request} - no more duplicates will be shown "
+                "(see DUPEFILTER_DEBUG to show all duplicates)",
+                extra={"spider": spider},
+            )
+            self.log_dupes = False
+        spider.crawler.stats.inc_value("dupefilter/filtered", spider=spider)
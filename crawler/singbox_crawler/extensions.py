@@ -0,0 +1,249 @@
+import logging
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from . import control, memory, metrics, profiling
+
+pages_fetched = metrics.counter(
+    "crawler_pages_fetched_total", "Responses received by the crawler", ["status"]
+)
+response_bytes = metrics.counter(
+    "crawler_response_bytes_total", "Response body bytes received by the crawler"
+)
+items_extracted = metrics.counter(
+    "crawler_items_extracted_total", "Resources extracted by the crawler", ["protocol"]
+)
+download_latency = metrics.histogram(
+    "crawler_download_latency_seconds", "Download latency of crawler requests"
+)
+
+# 同一进程（常驻服务模式）中的多个 crawler 共用一个告警器
+_alerter = None
+
+
+class MetricsExtension:
+    """
+    指标扩展：
+    1. 统计抓取的页面数、字节数和各协议提取的资源数。
+    2. 启动本地 /metrics 端点（Prometheus 文本格式）。
+    3. 下载延迟 P99 超过上限时触发告警钩子（日志，可选邮件）。
+    """
+
+    def __init__(self, port, p99_limit_sec, mailer=None, mail_to=None):
+        self.logger = logging.getLogger(__name__)
+        self.port = port
+        self.mailer = mailer
+        self.mail_to = mail_to or []
+
+        global _alerter
+        if _alerter is None:
+            _alerter = metrics.P99Alerter(p99_limit_sec)
+            _alerter.watch(download_latency)
+            if self.mailer and self.mail_to:
+                _alerter.add_hook(self._mail_alert)
+            _alerter.start()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        mailer = None
+        mail_to = settings.getlist("METRICS_ALERT_MAIL")
+        if mail_to:
+            from scrapy.mail import MailSender
+
+            mailer = MailSender.from_settings(settings)
+        ext = cls(
+            settings.getint("METRICS_PORT", 9410),
+            settings.getfloat("METRICS_P99_LIMIT_SEC", 2),
+            mailer,
+            mail_to,
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def spider_opened(self, spider):
+        try:
+            metrics.start_http_server(self.port)
+        except OSError as e:
+            self.logger.error(f"Failed to start metrics endpoint on port {self.port}: {e}")
+
+    def response_received(self, response, request, spider):
+        pages_fetched.labels(response.status).inc()
+        response_bytes.inc(len(response.body))
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            download_latency.observe(latency)
+
+    def item_scraped(self, item, response, spider):
+        items_extracted.labels(item.get("protocol") or "unknown").inc()
+
+    def _mail_alert(self, metric_name, labels, p99, limit):
+        # 告警钩子在 P99Alerter 线程中调用，MailSender 依赖反应器，需要交给反应器线程发送
+        from twisted.internet import reactor
+
+        subject = f"[singbox_crawler] P99 latency alert: {metric_name}"
+        body = f"{metric_name}{labels} p99={p99:.3f}s exceeds limit {limit}s"
+        reactor.callFromThread(
+            self.mailer.send, to=self.mail_to, subject=subject, body=body
+        )
+
+
+class MemoryDrainExtension:
+    """
+    内存诊断与排空扩展：
+    1. 内存（含子进程）超过跟踪阈值时才开始 tracemalloc 跟踪（跟踪会拖慢所有分配），
+       接近上限时把分配热点写入 tmp/memdiag_*.txt，写完后停止跟踪。
+    2. 内存达到排空阈值或 supervisor 请求排空时，停止调度新请求，
+       等待进行中的请求和管道处理完毕后正常关闭爬虫。
+    """
+
+    def __init__(self, crawler, trace_mb, snapshot_mb, drain_mb, check_interval, frames):
+        self.logger = logging.getLogger(__name__)
+        self.crawler = crawler
+        self.trace_mb = trace_mb
+        self.snapshot_mb = snapshot_mb
+        self.drain_mb = drain_mb
+        self.check_interval = check_interval
+        self.frames = frames
+        self.snapshot_path = None
+        self.draining = False
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("MEMDIAG_ENABLED"):
+            raise NotConfigured
+        limit_mb = settings.getint("MEMDIAG_LIMIT_MB")
+        ext = cls(
+            crawler,
+            trace_mb=limit_mb * settings.getfloat("MEMDIAG_TRACE_RATIO", 0.7),
+            snapshot_mb=limit_mb * settings.getfloat("MEMDIAG_SNAPSHOT_RATIO", 0.9),
+            drain_mb=limit_mb * settings.getfloat("MEMDIAG_DRAIN_RATIO", 0.95),
+            check_interval=settings.getfloat("MEMDIAG_CHECK_INTERVAL", 5),
+            frames=settings.getint("MEMDIAG_TRACEMALLOC_FRAMES", 1),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        from twisted.internet import task
+
+        self.task = task.LoopingCall(self._check, spider)
+        self.task.start(self.check_interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        memory.stop_tracing()
+
+    def _snapshot(self, reason):
+        try:
+            self.snapshot_path = memory.write_snapshot(reason)
+            self.logger.warning(f"Memory snapshot written to {self.snapshot_path}")
+        except Exception as e:
+            self.logger.error(f"Failed to write memory snapshot: {e}")
+            self.snapshot_path = ""
+        memory.stop_tracing()
+
+    def _check(self, spider):
+        usage = memory.rss_mb()
+        if self.frames > 0 and usage >= self.trace_mb and self.snapshot_path is None:
+            # 只跟踪从跟踪阈值到快照阈值之间的增长（重复调用无副作用）
+            memory.start_tracing(self.frames)
+        if usage >= self.snapshot_mb and self.snapshot_path is None:
+            self._snapshot(f"rss {usage:.2f}MB reached {self.snapshot_mb:.0f}MB")
+
+        if self.draining:
+            return
+        requested = control.is_requested(control.DRAIN)
+        if requested or usage >= self.drain_mb:
+            self.draining = True
+            if self.snapshot_path is None:
+                self._snapshot(f"drain at rss {usage:.2f}MB")
+            self.logger.warning(
+                f"Draining spider ({'requested by supervisor' if requested else 'memory'}, "
+                f"rss {usage:.2f}MB): no new requests, finishing in-flight work"
+            )
+            self.crawler.engine.close_spider(spider, "memory_drain")
+
+
+class CpuPacingExtension:
+    """
+    CPU 节流（见 service_launcher.CpuGovernor）：supervisor 通过控制文件给出运行比例，
+    每个周期在反应器中睡眠 (1 - 比例) 的时间。睡眠发生在两次回调之间，
+    反应器线程中不会有未提交的 SQLite 事务，线程池中的写入照常完成，
+    不会像挂起整个进程那样冻结其他 worker 等待的写锁。
+    """
+
+    PERIOD_SEC = 0.5
+    READ_EVERY = 4  # 每几个周期读取一次控制文件
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.run_fraction = 1.0
+        self.task = None
+        self._cycle = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("CPU_PACING_ENABLED", True):
+            raise NotConfigured
+        ext = cls()
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        from twisted.internet import task
+
+        self.task = task.LoopingCall(self._pace)
+        self.task.start(self.PERIOD_SEC, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+
+    def _read(self):
+        payload = control.read(control.THROTTLE)
+        try:
+            fraction = min(1.0, max(0.0, float(payload))) if payload else 1.0
+        except ValueError:
+            fraction = 1.0
+        if fraction != self.run_fraction:
+            self.logger.info(f"CPU pacing: running {fraction:.0%} of the time")
+        self.run_fraction = fraction
+
+    def _pace(self):
+        if self._cycle % self.READ_EVERY == 0:
+            self._read()
+        self._cycle += 1
+        if self.run_fraction < 1.0:
+            time.sleep(self.PERIOD_SEC * (1 - self.run_fraction))
+
+
+class ProfilingExtension:
+    """启动时按设置开启性能分析，并监听控制文件 / SIGUSR2 以便运行中开启"""
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        profiling.install(
+            stages=settings.get("PROFILE_STAGES") or "",
+            mode=settings.get("PROFILE_MODE"),
+            duration=settings.getfloat("PROFILE_DURATION_SEC", 60),
+        )
+        ext = cls()
+        crawler.signals.connect(ext.engine_stopped, signal=signals.engine_stopped)
+        return ext
+
+    def engine_stopped(self):
+        # 爬虫结束时写出尚未完成的分析结果
+        profiling.stop()
@@ -0,0 +1,491 @@
+"""
+基于 SQLite 的爬取前沿（frontier）调度器
+代替 Scrapy 在 JOBDIR 下用 pickle 保存的磁盘队列：待爬请求和 sources 表放在同一个数据库里，
+重启时不需要反序列化整个队列，也不会重放和 sources 状态不一致的旧请求。
+- frontier 表按 (domain, priority, id) 建索引，保存请求的 URL、方法、头、请求体和可 JSON 化的 meta；
+- frontier_domains 表记录每个域名下一次可以取请求的时间（next_at）和待爬数量，
+  取请求时按 next_at 轮换域名，每个域名取完后推后 domain_delay 秒，保证礼貌和公平；
+- 取请求在 BEGIN IMMEDIATE 事务中批量完成，多个爬虫进程可以共享同一个 frontier；
+- 入队的请求先放在内存缓冲中，由线程池按批写入，反应器线程不等待其他进程的写锁；
+  写入失败（例如写锁等待超时）的请求留在缓冲中，下一次再写；
+- 每个进程只打开一个连接，待爬数量缓存在内存中，引擎空转时的轮询和 has_pending_requests 不访问数据库；
+- 同一请求指纹在一个分区中只保留一份（dont_filter 的请求除外）；
+- 请求按 scope（FRONTIER_SCOPE）分区，多 worker 模式下每个 worker 只取出自己入队的请求，
+  请求对应的来源租约总由领取它的 worker 释放，空闲判断也不受其他 worker 的待爬请求影响。
+已经取出但还没下载完的请求只在本进程内存中，进程崩溃时会丢失，由 sources 的定期重爬补上。
+"""
+import json
+import logging
+import math
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from scrapy.utils.misc import load_object
+from scrapy.utils.request import request_from_dict
+from twisted.internet import defer, task, threads
+from twisted.python.failure import Failure
+
+# 同一分区内同一域名两次取请求的最小间隔（秒），共享分区的多个进程之间生效；0 表示只按域名轮换（进程内的礼貌由 DOWNLOAD_DELAY 保证）
+FRONTIER_DOMAIN_DELAY = 0
+FRONTIER_BATCH = 8  # 每次事务最多取出的请求数
+FRONTIER_COUNT_REFRESH = 5  # 待爬数量缓存的有效时间（秒）
+FRONTIER_BUSY_TIMEOUT = 5  # 线程池中写入时等待其他进程释放写锁的时间（秒）
+FRONTIER_POP_TIMEOUT = 0.1  # 反应器线程中取请求时等待写锁的时间（秒），超时后下一次调度再取
+FRONTIER_FLUSH_INTERVAL = 0.5  # 入队缓冲写入 frontier 的间隔（秒）
+FRONTIER_FLUSH_SIZE = 500  # 入队缓冲达到这个数量时立即写入
+
+
+FRONTIER_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fingerprint TEXT,
+        scope TEXT DEFAULT '',
+        domain TEXT,
+        url TEXT,
+        priority INTEGER DEFAULT 0,
+        depth INTEGER DEFAULT 0,
+        request TEXT,
+        body BLOB,
+        created_at REAL,
+        UNIQUE (scope, fingerprint)
+    )
+"""
+FRONTIER_COLUMNS = "id, fingerprint, scope, domain, url, priority, depth, request, body, created_at"
+
+
+def ensure_schema(conn):
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'frontier'").fetchone()
+    if row and "UNIQUE (scope, fingerprint)" not in row[0]:
+        # 旧版本的指纹在整个表内唯一：一个 worker 入队过的请求，其他 worker 再入队时会被忽略，
+        # 之后只有原来的 worker 能取出。SQLite 不能修改约束，按 (scope, fingerprint) 唯一重建表
+        columns = {r[1] for r in conn.execute("PRAGMA table_info(frontier)")}
+        if "scope" not in columns:
+            conn.execute("ALTER TABLE frontier ADD COLUMN scope TEXT DEFAULT ''")
+        conn.execute(FRONTIER_TABLE_SQL.format(name="frontier_rebuild"))
+        conn.execute(
+            f"INSERT INTO frontier_rebuild ({FRONTIER_COLUMNS}) SELECT {FRONTIER_COLUMNS} FROM frontier"
+        )
+        # 旧表的索引随旧表一起删除，下面按新表重新创建
+        conn.execute("DROP TABLE frontier")
+        conn.execute("ALTER TABLE frontier_rebuild RENAME TO frontier")
+    conn.execute(FRONTIER_TABLE_SQL.format(name="frontier"))
+    conn.execute("DROP INDEX IF EXISTS idx_frontier_domain")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_frontier_scope_domain ON frontier(scope, domain, priority DESC, id)"
+    )
+    # 旧版本的 frontier_domains 只按域名计数，它只是 frontier 的汇总，按分区重建
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(frontier_domains)")}
+    rebuild = bool(columns) and "scope" not in columns
+    if rebuild:
+        conn.execute("DROP TABLE frontier_domains")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS frontier_domains (
+            scope TEXT DEFAULT '',
+            domain TEXT,
+            next_at REAL DEFAULT 0,
+            pending INTEGER DEFAULT 0,
+            PRIMARY KEY (scope, domain)
+        )
+    """
+    )
+    # 只索引还有待爬请求的域名，取请求时不需要扫描已经爬空的域名
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_frontier_domains_due ON frontier_domains(scope, next_at) WHERE pending > 0"
+    )
+    if rebuild:
+        conn.execute(
+            """
+            INSERT INTO frontier_domains (scope, domain, pending)
+            SELECT scope, domain, COUNT(*) FROM frontier GROUP BY scope, domain
+        """
+        )
+
+
+def _jsonable_meta(meta):
+    """只保留可以 JSON 化的 meta 值（下载器中间件放入的对象在重新调度时会重新生成）"""
+    result = {}
+    for key, value in meta.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        result[key] = value
+    return result
+
+
+def encode_request(request, spider):
+    """把请求转换为 (JSON 文本, 请求体)，不使用 pickle"""
+    d = request.to_dict(spider=spider)
+    body = d.pop("body")
+    d["headers"] = {
+        k.decode("latin-1"): [v.decode("latin-1") for v in values]
+        for k, values in d["headers"].items()
+    }
+    d["meta"] = _jsonable_meta(d.get("meta") or {})
+    if isinstance(d.get("cookies"), (dict, list)):
+        d["cookies"] = json.loads(json.dumps(d["cookies"], default=str))
+    return json.dumps(d, ensure_ascii=False), body
+
+
+def decode_request(text, body, spider):
+    d = json.loads(text)
+    d["body"] = body or b""
+    d["headers"] = {
+        k.encode("latin-1"): [v.encode("latin-1") for v in values]
+        for k, values in d["headers"].items()
+    }
+    return request_from_dict(d, spider=spider)
+
+
+class Frontier:
+    """
+    frontier 表中一个分区（scope）的读写，多个进程可以同时使用同一个 frontier
+    pop / pending 使用创建线程中的持久连接；push 使用单独的连接，可以在线程池中调用（同一时间只能有一个线程调用）
+    待爬数量缓存在内存中，由本进程的入队 / 出队更新，每 count_refresh 秒从数据库重新统计一次（其他进程的变化）；
+    缓存为 0 或所有域名都还在 domain_delay 内时，取请求不开启事务
+    """
+
+    def __init__(
+        self, db_path, domain_delay=FRONTIER_DOMAIN_DELAY, count_refresh=FRONTIER_COUNT_REFRESH, scope=""
+    ):
+        self.db_path = db_path
+        self.scope = scope
+        self.domain_delay = domain_delay
+        self.count_refresh = count_refresh
+        self.logger = logging.getLogger(__name__)
+        self.conn = self._connect()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            ensure_schema(self.conn)
+        # 建表之后，反应器线程中的连接只短暂等待写锁
+        self.conn.execute(f"PRAGMA busy_timeout = {int(FRONTIER_POP_TIMEOUT * 1000)}")
+        self._push_conn = None
+        self._lock = threading.Lock()  # 保护待爬数量缓存（push 可能在其他线程中更新）
+        self._pending = 0
+        self._counted_at = -math.inf
+        self._next_due = 0  # 没有到期域名时，最早的域名到期时间
+
+    def _connect(self, **kwargs):
+        conn = sqlite3.connect(self.db_path, timeout=FRONTIER_BUSY_TIMEOUT, isolation_level=None, **kwargs)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 模式下 NORMAL 不会损坏数据库，每次入队 / 出队不需要等待 fsync
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def close(self):
+        if self._push_conn is not None:
+            self._push_conn.close()
+        self.conn.close()
+
+    def pending(self):
+        """待爬请求数（缓存值，最多 count_refresh 秒前统计）"""
+        now = time.monotonic()
+        if now - self._counted_at >= self.count_refresh:
+            pending = self.conn.execute(
+                "SELECT COALESCE(SUM(pending), 0) FROM frontier_domains WHERE scope = ? AND pending > 0",
+                (self.scope,),
+            ).fetchone()[0]
+            with self._lock:
+                self._pending = pending
+                self._counted_at = now
+        return self._pending
+
+    def push(self, rows):
+        """
+        rows: [(fingerprint 或 None, domain, url, priority, depth, request_json, body)]
+        返回实际加入的数量（指纹已在本分区中的请求被忽略）
+        """
+        if not rows:
+            return 0
+        now = time.time()
+        if self._push_conn is None:
+            self._push_conn = self._connect(check_same_thread=False)
+        conn = self._push_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            added = {}
+            for fingerprint, domain, url, priority, depth, request, body in rows:
+                cursor = conn.execute(
+                    """
+                    INSERT OR IGNORE INTO frontier
+                    (fingerprint, scope, domain, url, priority, depth, request, body, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                    (fingerprint, self.scope, domain, url, priority, depth, request, body, now),
+                )
+                if cursor.rowcount:
+                    added[domain] = added.get(domain, 0) + 1
+            conn.executemany(
+                """
+                INSERT INTO frontier_domains (scope, domain, pending) VALUES (?, ?, ?)
+                ON CONFLICT(scope, domain) DO UPDATE SET pending = pending + excluded.pending
+            """,
+                [(self.scope, domain, count) for domain, count in added.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        count = sum(added.values())
+        if count:
+            with self._lock:
+                self._pending += count
+                self._next_due = 0
+        return count
+
+    def pop(self, limit=FRONTIER_BATCH):
+        """
+        从到期的域名中取出最多 limit 个请求，返回 [(request_json, body)]
+        domain_delay 为 0 时每个域名可以取多个请求，否则每个域名取一个优先级最高的请求，
+        取出的请求从 frontier 删除，域名的 next_at 推后 domain_delay 秒
+        """
+        now = time.time()
+        if not self.pending() or now < self._next_due:
+            return []
+        conn = self.conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            # 其他进程长时间持有写锁时不阻塞反应器，下一次调度时再取
+            self.logger.debug(f"Frontier busy, skipping pop: {e}")
+            return []
+        empty = False
+        try:
+            domains = conn.execute(
+                """
+                SELECT domain FROM frontier_domains
+                WHERE scope = ? AND pending > 0 AND next_at <= ?
+                ORDER BY next_at
+                LIMIT ?
+            """,
+                (self.scope, now, limit),
+            ).fetchall()
+            per_domain = 1 if self.domain_delay else max(1, limit // max(1, len(domains)))
+            results = []
+            for (domain,) in domains:
+                rows = conn.execute(
+                    """
+                    SELECT id, request, body FROM frontier
+                    WHERE scope = ? AND domain = ?
+                    ORDER BY priority DESC, id
+                    LIMIT ?
+                """,
+                    (self.scope, domain, per_domain),
+                ).fetchall()
+                if not rows:
+                    # 计数与实际不一致（例如手工删除过请求），修正后跳过
+                    conn.execute(
+                        "UPDATE frontier_domains SET pending = 0 WHERE scope = ? AND domain = ?",
+                        (self.scope, domain),
+                    )
+                    continue
+                conn.executemany("DELETE FROM frontier WHERE id = ?", [(row[0],) for row in rows])
+                conn.execute(
+                    """
+                    UPDATE frontier_domains SET pending = MAX(pending - ?, 0), next_at = ?
+                    WHERE scope = ? AND domain = ?
+                """,
+                    (len(rows), now + self.domain_delay, self.scope, domain),
+                )
+                results.extend((row[1], row[2]) for row in rows)
+            if not domains:
+                # 所有域名都在间隔内：记录最早的到期时间，之前不再开启事务；没有待爬域名时数量归零
+                next_at = conn.execute(
+                    "SELECT MIN(next_at) FROM frontier_domains WHERE scope = ? AND pending > 0",
+                    (self.scope,),
+                ).fetchone()[0]
+                if next_at is None:
+                    empty = True
+                else:
+                    self._next_due = next_at
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            if empty:
+                self._pending = 0
+                self._counted_at = time.monotonic()
+            else:
+                self._pending = max(0, self._pending - len(results))
+        return results
+
+    def __len__(self):
+        return self.pending()
+
+
+class FrontierScheduler:
+    """
+    SCHEDULER = "singbox_crawler.frontier.FrontierScheduler"
+    去重仍由 DUPEFILTER_CLASS 负责，frontier 默认和爬虫数据库放在同一个文件（FRONTIER_DB_PATH 可覆盖）
+    入队的请求每 flush_interval 秒（或缓冲达到 flush_size 时）在线程池中写入 frontier，同一时间只有一次写入
+    """
+
+    def __init__(
+        self,
+        frontier,
+        dupefilter,
+        stats=None,
+        fingerprinter=None,
+        batch=FRONTIER_BATCH,
+        jobdir=None,
+        flush_interval=FRONTIER_FLUSH_INTERVAL,
+        flush_size=FRONTIER_FLUSH_SIZE,
+    ):
+        self.frontier = frontier
+        self.df = dupefilter
+        self.stats = stats
+        self.fingerprinter = fingerprinter
+        self.batch = batch
+        self.jobdir = jobdir
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.buffer = []  # 已经从 frontier 取出、还没交给引擎的请求
+        self.pushing = []  # 已经入队、还没写入 frontier 的行
+        self.flushing = None  # 正在线程池中进行的写入
+        self.flush_task = None
+        self.spider = None
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from .database import Database
+
+        settings = crawler.settings
+        dupefilter_cls = load_object(settings["DUPEFILTER_CLASS"])
+        if hasattr(dupefilter_cls, "from_crawler"):
+            dupefilter = dupefilter_cls.from_crawler(crawler)
+        else:
+            dupefilter = dupefilter_cls.from_settings(settings)
+        db_path = settings.get("FRONTIER_DB_PATH") or Database().db_path
+        return cls(
+            Frontier(
+                db_path,
+                domain_delay=settings.getfloat("FRONTIER_DOMAIN_DELAY", FRONTIER_DOMAIN_DELAY),
+                scope=settings.get("FRONTIER_SCOPE") or "",
+            ),
+            dupefilter,
+            stats=crawler.stats,
+            fingerprinter=crawler.request_fingerprinter,
+            batch=settings.getint("FRONTIER_BATCH", FRONTIER_BATCH),
+            jobdir=settings.get("JOBDIR"),
+            flush_interval=settings.getfloat("FRONTIER_FLUSH_INTERVAL", FRONTIER_FLUSH_INTERVAL),
+            flush_size=settings.getint("FRONTIER_FLUSH_SIZE", FRONTIER_FLUSH_SIZE),
+        )
+
+    def open(self, spider):
+        self.spider = spider
+        if self.jobdir:
+            # Scrapy 磁盘队列留下的 pickle 文件不再使用，避免和 frontier 不一致
+            legacy = os.path.join(self.jobdir, "requests.queue")
+            if os.path.isdir(legacy):
+                shutil.rmtree(legacy, ignore_errors=True)
+                self.logger.info(f"Removed legacy disk queue {legacy}")
+        pending = len(self.frontier)
+        if pending:
+            self.logger.info(f"Resuming crawl ({pending} requests in frontier)")
+        self.flush_task = task.LoopingCall(self.flush)
+        self.flush_task.start(self.flush_interval, now=False)
+        return self.df.open()
+
+    def close(self, reason):
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        # 等正在进行的写入结束（失败的行会放回缓冲）后，把缓冲和已经取出但没有交给引擎的请求一起写回 frontier
+        d = self.flushing or defer.succeed(None)
+        d.addBoth(lambda _: threads.deferToThread(self._close_frontier, self._drain()))
+        d.addErrback(lambda failure: self.logger.error(f"Failed to save frontier on close: {failure.value}"))
+        d.addBoth(lambda _: self.df.close(reason))
+        return d
+
+    def _drain(self):
+        rows = self.pushing + [self._row(request) for request in self.buffer]
+        self.pushing = []
+        self.buffer.clear()
+        return rows
+
+    def _close_frontier(self, rows):
+        try:
+            self.frontier.push(rows)
+        finally:
+            self.frontier.close()
+
+    def flush(self):
+        """把入队缓冲交给线程池写入 frontier，上一次写入还没结束时不做任何事"""
+        if self.flushing is not None or not self.pushing:
+            return
+        rows, self.pushing = self.pushing, []
+        self.flushing = threads.deferToThread(self.frontier.push, rows)
+        self.flushing.addBoth(self._flushed, rows)
+
+    def _flushed(self, result, rows):
+        self.flushing = None
+        if isinstance(result, Failure):
+            if result.check(sqlite3.OperationalError):
+                # 写锁等待超时等：请求留在内存中，下一次再写
+                self.logger.warning(f"Frontier busy, keeping {len(rows)} requests in memory: {result.value}")
+                self.pushing[:0] = rows
+            else:
+                self.logger.error(f"Failed to write {len(rows)} requests to frontier: {result.value}")
+        return None
+
+    def _row(self, request):
+        text, body = encode_request(request, self.spider)
+        fingerprint = None
+        if not request.dont_filter and self.fingerprinter is not None:
+            fingerprint = self.fingerprinter.fingerprint(request).hex()
+        return (
+            fingerprint,
+            urlparse(request.url).hostname or "",
+            request.url,
+            request.priority,
+            request.meta.get("depth", 0),
+            text,
+            body,
+        )
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        try:
+            row = self._row(request)
+        except (TypeError, ValueError) as e:
+            # 回调不是 spider 的方法等情况无法序列化
+            self.logger.warning(f"Unable to serialize request {request}: {e}")
+            return False
+        self.pushing.append(row)
+        if len(self.pushing) >= self.flush_size:
+            self.flush()
+        if self.stats:
+            self.stats.inc_value("scheduler/enqueued/frontier", spider=self.spider)
+            self.stats.inc_value("scheduler/enqueued", spider=self.spider)
+        return True
+
+    def next_request(self):
+        if not self.buffer and self.pushing and not self.frontier.pending():
+            # frontier 已经取空、新请求还在缓冲中：不等下一次定时写入
+            self.flush()
+        if not self.buffer:
+            self.buffer = [
+                decode_request(text, body, self.spider)
+                for text, body in self.frontier.pop(self.batch)
+            ]
+            self.buffer.reverse()
+        if not self.buffer:
+            return None
+        if self.stats:
+            self.stats.inc_value("scheduler/dequeued/frontier", spider=self.spider)
+            self.stats.inc_value("scheduler/dequeued", spider=self.spider)
+        return self.buffer.pop()
+
+    def has_pending_requests(self):
+        return bool(self.buffer or self.pushing or self.flushing) or self.frontier.pending() > 0
+
+    def __len__(self):
+        return len(self.buffer) + len(self.pushing) + self.frontier.pending()
@@ -0,0 +1,291 @@
+"""
+HTTP 录制 / 回放存档
+record 模式下把每个下载到的响应（URL、状态码、响应头、压缩后的响应体、下载耗时）写入 SQLite；
+replay 模式下由下载处理器直接从存档返回响应，可配置模拟延迟，不访问网络。
+用于在固定语料上重复测量提取、管道和数据库的端到端吞吐，并在不同代码版本之间比较。
+
+用法（在 crawler 目录下）：
+    scrapy crawl universal -s HTTP_ARCHIVE_MODE=record
+    scrapy crawl universal -s HTTP_ARCHIVE_MODE=replay -s HTTP_ARCHIVE_LATENCY_MS=50
+    python -m singbox_crawler.http_archive            # 查看存档统计
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_ARCHIVE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "tmp",
+    "http_archive.db",
+)
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+# 每写入多少个响应提交一次
+COMMIT_EVERY = 50
+
+
+def request_key(method, url, body=b""):
+    """请求的存档键：方法 + URL + 请求体摘要"""
+    digest = hashlib.sha1()
+    digest.update(method.upper().encode())
+    digest.update(b" ")
+    digest.update(url.encode("utf-8"))
+    if body:
+        digest.update(b" ")
+        digest.update(hashlib.sha1(body).digest())
+    return digest.hexdigest()
+
+
+def compress(body):
+    """优先使用 zstd，没有安装 zstandard 时使用 zlib，返回 (codec, data)"""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=6).compress(body)
+    return "zlib", zlib.compress(body, 6)
+
+
+def decompress(codec, data):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("archive entry is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    return data
+
+
+class HttpArchive:
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                request_key TEXT PRIMARY KEY,
+                method TEXT,
+                url TEXT,
+                status INTEGER,
+                headers TEXT,
+                body BLOB,
+                codec TEXT,
+                body_size INTEGER,
+                latency REAL,
+                recorded_at TEXT
+            )
+        """
+        )
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+
+    def put(self, method, url, status, headers, body, latency=None, request_body=b""):
+        """headers 为 {名称: [值, ...]}（str）"""
+        codec, data = compress(body)
+        with self._lock:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO responses
+                (request_key, method, url, status, headers, body, codec, body_size, latency, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    request_key(method, url, request_body),
+                    method,
+                    url,
+                    status,
+                    json.dumps(headers),
+                    data,
+                    codec,
+                    len(body),
+                    latency,
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                ),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_EVERY:
+                self.conn.commit()
+                self._uncommitted = 0
+
+    def get(self, method, url, request_body=b""):
+        """返回 dict(url, status, headers, body, latency)，不存在时返回 None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT url, status, headers, body, codec, latency FROM responses WHERE request_key = ?",
+                (request_key(method, url, request_body),),
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "url": row[0],
+            "status": row[1],
+            "headers": json.loads(row[2]),
+            "body": decompress(row[4], row[3]),
+            "latency": row[5],
+        }
+
+    def urls(self):
+        """存档中的所有 GET URL（用于在回放前向数据库写入同样的源）"""
+        with self._lock:
+            return [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT url FROM responses WHERE method = 'GET' ORDER BY recorded_at"
+                )
+            ]
+
+    def stats(self):
+        with self._lock:
+            count, raw, stored = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(body_size), 0), COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+            ).fetchone()
+        return {"responses": count, "body_bytes": raw, "stored_bytes": stored}
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class ArchiveDownloadHandler:
+    """
+    http/https 下载处理器：
+    - 未启用存档时完全委托给 Scrapy 默认的 HTTP11DownloadHandler；
+    - record 模式下委托下载，并把原始响应（解压缩中间件之前）写入存档；
+    - replay 模式下从存档构造响应，按设置加入模拟延迟，存档中没有的请求被忽略。
+    """
+
+    lazy = False
+
+    def __init__(self, crawler):
+        from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+
+        settings = crawler.settings
+        self.logger = logging.getLogger(__name__)
+        self.mode = (settings.get("HTTP_ARCHIVE_MODE") or "").lower()
+        self.latency_ms = settings.getfloat("HTTP_ARCHIVE_LATENCY_MS", 0)
+        self.jitter_ms = settings.getfloat("HTTP_ARCHIVE_LATENCY_JITTER_MS", 0)
+        self.latency_scale = settings.getfloat("HTTP_ARCHIVE_LATENCY_SCALE", 0)
+        self.random = random.Random(settings.getint("HTTP_ARCHIVE_SEED", 0))
+        self.archive = None
+        self.delegate = None
+        if self.mode in (MODE_RECORD, MODE_REPLAY):
+            self.archive = HttpArchive(
+                settings.get("HTTP_ARCHIVE_PATH") or DEFAULT_ARCHIVE_PATH
+            )
+            self.logger.info(f"HTTP archive {self.mode} mode: {self.archive.path}")
+        if self.mode != MODE_REPLAY:
+            self.delegate = HTTP11DownloadHandler.from_crawler(crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def download_request(self, request, spider):
+        if self.mode == MODE_REPLAY:
+            return self._replay(request)
+        d = self.delegate.download_request(request, spider)
+        if self.mode == MODE_RECORD:
+            d.addCallback(self._record, request)
+        return d
+
+    def _record(self, response, request):
+        headers = {
+            k.decode("latin-1"): [v.decode("latin-1") for v in values]
+            for k, values in response.headers.items()
+        }
+        try:
+            self.archive.put(
+                request.method,
+                request.url,
+                response.status,
+                headers,
+                response.body,
+                latency=request.meta.get("download_latency"),
+                request_body=request.body,
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to archive {request.url}: {e}")
+        return response
+
+    def _delay(self, recorded_latency):
+        delay = self.latency_ms / 1000
+        if self.jitter_ms:
+            delay += self.random.uniform(0, self.jitter_ms / 1000)
+        if self.latency_scale and recorded_latency:
+            delay += recorded_latency * self.latency_scale
+        return delay
+
+    def _replay(self, request):
+        from scrapy.exceptions import IgnoreRequest
+        from scrapy.http import Headers
+        from scrapy.responsetypes import responsetypes
+        from twisted.internet import defer, reactor, task
+
+        entry = self.archive.get(request.method, request.url, request.body)
+        if entry is None:
+            return defer.fail(IgnoreRequest(f"Not in HTTP archive: {request.url}"))
+
+        headers = Headers(entry["headers"])
+        respcls = responsetypes.from_args(
+            headers=headers, url=request.url, body=entry["body"]
+        )
+        response = respcls(
+            url=request.url,
+            status=entry["status"],
+            headers=headers,
+            body=entry["body"],
+            request=request,
+            flags=["replayed"],
+        )
+        delay = self._delay(entry["latency"])
+        request.meta["download_latency"] = delay
+        if delay <= 0:
+            return defer.succeed(response)
+        return task.deferLater(reactor, delay, lambda: response)
+
+    def close(self):
+        if self.archive:
+            self.archive.close()
+        if self.delegate:
+            return self.delegate.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="HTTP 录制存档统计")
+    parser.add_argument("--path", default=DEFAULT_ARCHIVE_PATH)
+    parser.add_argument("--urls", action="store_true", help="列出存档中的 URL")
+    args = parser.parse_args()
+
+    archive = HttpArchive(args.path)
+    try:
+        stats = archive.stats()
+        ratio = stats["stored_bytes"] / stats["body_bytes"] if stats["body_bytes"] else 0
+        print(
+            f"{args.path}: {stats['responses']} 个响应, 原始 {stats['body_bytes']} 字节, "
+            f"压缩后 {stats['stored_bytes']} 字节 ({ratio:.1%})"
+        )
+        if args.urls:
+            for url in archive.urls():
+                print(url)
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+HTML 页面中的新来源发现
+- 直接用 lxml 解析响应并用预编译的 XPath 取 <a href>，不经过 CSS 选择器转换；
+- URL 规范化：协议和主机小写、去掉默认端口、片段和跟踪参数（utm_* 等）、路径末尾的斜杠，
+  同一页面的不同写法只入库一次；
+- 域名关键字和静态资源后缀各合并为一个预编译的正则；
+- 有界的 LRU 集合记录最近见过的链接，重复链接不再交给数据库。
+"""
+import re
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from lxml import etree, html
+
+from .scanning import response_encoding
+
+# 链接中包含这些关键字时作为候选来源
+DOMAIN_HINTS = ("github.com", "t.me", "blogspot", "v2ray", "free")
+# 路径以这些后缀结尾的静态资源不作为来源
+SKIP_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".css", ".js", ".woff", ".woff2")
+# 去掉的跟踪参数（utm_ 开头的参数全部去掉）
+TRACKING_PARAMS = frozenset(
+    {"fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl", "ref_src", "spm"}
+)
+LINK_SEEN_SIZE = 100_000  # 内存中记录的最近链接数
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_HREFS = etree.XPath("//a/@href")
+_BASE_HREF = etree.XPath("//base/@href")
+
+
+def normalize_url(url, base=None):
+    """返回规范化的 http(s) 绝对 URL（相对链接按 base 解析），无法解析或不是 http(s) 时返回 None"""
+    try:
+        parts = urlsplit(urljoin(base, url.strip()) if base else url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS or not parts.hostname:
+        return None
+    netloc = parts.hostname.lower().rstrip(".")
+    if port and port != _DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    path = parts.path.rstrip("/") or "/"
+    query = parts.query
+    if query:
+        params = parse_qsl(query, keep_blank_values=True)
+        kept = [
+            (k, v)
+            for k, v in params
+            if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+        ]
+        # 没有跟踪参数时保留原始写法，避免重新编码改变 URL
+        if len(kept) != len(params):
+            query = urlencode(kept)
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+class LinkMatcher:
+    def __init__(self, hints=DOMAIN_HINTS, skip_suffixes=SKIP_SUFFIXES):
+        self.hints = re.compile("|".join(re.escape(h) for h in hints), re.IGNORECASE)
+        self.skip = re.compile(
+            "(?:" + "|".join(re.escape(s) for s in skip_suffixes) + ")$", re.IGNORECASE
+        )
+
+    def __call__(self, url):
+        """url 为已规范化的 URL：关键字在整个 URL 中查找，后缀只检查路径"""
+        if not self.hints.search(url):
+            return False
+        return not self.skip.search(urlsplit(url).path)
+
+
+class SeenSet:
+    """最多保存 maxsize 个元素的 LRU 集合"""
+
+    def __init__(self, maxsize=LINK_SEEN_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def add(self, key):
+        """加入元素，返回之前是否已存在"""
+        if key in self._items:
+            self._items.move_to_end(key)
+            return True
+        self._items[key] = None
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return False
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class LinkDiscovery:
+    def __init__(self, matcher=None, seen_size=LINK_SEEN_SIZE):
+        self.matcher = matcher or LinkMatcher()
+        self.seen = SeenSet(seen_size)
+
+    def extract(self, body, url, encoding=None):
+        """解析 HTML，返回规范化后的绝对链接（按页面顺序，页面内去重）"""
+        if not body:
+            return []
+        parser = html.HTMLParser(encoding=encoding)
+        try:
+            root = html.document_fromstring(body, parser=parser)
+        except (etree.ParserError, ValueError):
+            return []
+        base = _BASE_HREF(root)
+        base_url = url
+        if base:
+            try:
+                base_url = urljoin(url, base[0].strip())
+            except ValueError:
+                pass
+        links = {}
+        # 同一页面中重复的 href 只规范化一次
+        for href in dict.fromkeys(_HREFS(root)):
+            normalized = normalize_url(href, base_url)
+            if normalized:
+                links[normalized] = None
+        return list(links)
+
+    def discover(self, response):
+        """返回页面中最近没有见过的候选来源"""
+        new = []
+        # 只使用声明的编码，避免 Scrapy 为推断编码解码整个响应体
+        for link in self.extract(response.body, response.url, response_encoding(response)):
+            if self.matcher(link) and not self.seen.add(link):
+                new.append(link)
+        return new
@@ -0,0 +1,93 @@
+"""
+内存统计与诊断
+rss_mb 统计进程及其所有子进程的常驻内存；write_snapshot 把 tracemalloc 的分配热点
+（以及相对基线的增长、可选的 objgraph 对象类型统计）写入 tmp/，用于定位内存泄漏。
+"""
+import os
+import tracemalloc
+from datetime import datetime
+
+import psutil
+
+from .control import PROJECT_ROOT
+
+SNAPSHOT_DIR = os.path.join(PROJECT_ROOT, "tmp")
+
+_baseline = None
+
+
+def rss_mb(pid=None):
+    """进程及其所有子进程的常驻内存（MB）"""
+    try:
+        proc = psutil.Process(pid or os.getpid())
+        total = proc.memory_info().rss
+        for child in proc.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total / 1024 / 1024
+    except psutil.NoSuchProcess:
+        return 0
+
+
+def start_tracing(frames=1):
+    """开始跟踪内存分配并记录基线快照（重复调用无副作用）"""
+    global _baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    if _baseline is None:
+        _baseline = tracemalloc.take_snapshot()
+
+
+def stop_tracing():
+    """停止跟踪并释放跟踪数据和基线快照"""
+    global _baseline
+    _baseline = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def write_snapshot(reason, top=30, directory=SNAPSHOT_DIR):
+    """写入分配热点报告，返回文件路径"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory,
+        f"memdiag_{os.getpid()}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+    )
+    lines = [
+        f"reason: {reason}",
+        f"time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"rss_mb (including children): {rss_mb():.2f}",
+    ]
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(
+            f"traced_mb: {current / 1024 / 1024:.2f} (peak {peak / 1024 / 1024:.2f})"
+        )
+        lines.append(f"\n== Top {top} allocations by line ==")
+        lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:top])
+        if _baseline is not None:
+            lines.append(f"\n== Top {top} growth since tracing started ==")
+            lines.extend(
+                str(stat) for stat in snapshot.compare_to(_baseline, "lineno")[:top]
+            )
+    else:
+        lines.append("tracemalloc is not tracing")
+
+    try:
+        import objgraph
+
+        lines.append("\n== Most common object types ==")
+        lines.extend(
+            f"{name}: {count}" for name, count in objgraph.most_common_types(limit=top)
+        )
+    except ImportError:
+        pass
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
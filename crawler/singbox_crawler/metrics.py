@@ -0,0 +1,391 @@
+"""
+进程内指标
+提供 Counter / Gauge / Histogram 和 Prometheus 文本格式的 HTTP 导出端点，
+以及基于直方图 P99 的告警钩子。爬虫、测试器和流水线都可以使用，不依赖 config。
+"""
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# 默认的延迟分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        # 没有标签的指标直接在自身上调用 inc / observe
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, values), child.value
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """采集时调用 function 获取当前值（例如队列深度）"""
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception as e:
+                logger.debug(f"Gauge callback failed: {e}")
+                return math.nan
+        return self.value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, values), child.get()
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    return
+            self.counts[-1] += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        """各分桶（非累计）计数的副本"""
+        with self._lock:
+            return list(self.counts)
+
+    def quantile(self, q):
+        """按分桶线性插值估算分位数，没有数据时返回 None"""
+        return bucket_quantile(self.buckets, self.snapshot(), q)
+
+
+def bucket_quantile(buckets, counts, q):
+    """由各分桶计数（最后一个为 +Inf 分桶）按线性插值估算分位数，没有数据时返回 None"""
+    total = sum(counts)
+    if total == 0:
+        return None
+    rank = q * total
+    seen = 0
+    lower = 0.0
+    for i, bound in enumerate(buckets):
+        if seen + counts[i] >= rank:
+            fraction = (rank - seen) / counts[i] if counts[i] else 0
+            return lower + (bound - lower) * fraction
+        seen += counts[i]
+        lower = bound
+    # 落在最后一个 +Inf 分桶时只能返回最大的有限边界
+    return buckets[-1]
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def children(self):
+        return list(self._children.items())
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(self.labelnames, values, ("le", _format_value(bound))),
+                    cumulative,
+                )
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, child.count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    """获取或创建 Counter（模块重复导入或多个组件共用同一指标时使用）"""
+    return REGISTRY.get(name) or Counter(name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.get(name) or Gauge(name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.get(name) or Histogram(name, documentation, labelnames, buckets)
+
+
+# ---- HTTP 导出端点 ----
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """在后台线程启动 /metrics 端点，同一进程只启动一次，返回实际监听端口"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(
+                target=_server.serve_forever, name="MetricsServer", daemon=True
+            ).start()
+            logger.info(f"Metrics endpoint listening on http://{host}:{_server.server_address[1]}/metrics")
+        return _server.server_address[1]
+
+
+# ---- P99 告警 ----
+
+p99_alerts = counter(
+    "p99_alerts_total", "Number of p99 latency limit violations", ["metric"]
+)
+
+
+def log_alert(metric_name, labels, p99, limit):
+    logger.warning(
+        f"P99 latency alert: {metric_name}{labels} p99={p99:.3f}s exceeds limit {limit}s"
+    )
+
+
+class P99Alerter:
+    """
+    定期检查直方图的 P99，超过上限时调用告警钩子（同一序列有冷却时间）
+    P99 按上次检查以来新增的样本计算，而不是进程启动以来的累计分布；
+    新增样本不足 min_samples 时继续累积到下一次检查。
+    """
+
+    def __init__(self, limit_sec, interval_sec=30, cooldown_sec=600, min_samples=20):
+        self.limit_sec = limit_sec
+        self.interval_sec = interval_sec
+        self.cooldown_sec = cooldown_sec
+        self.min_samples = min_samples
+        self.hooks = [log_alert]
+        self._watched = []
+        self._last_alert = {}
+        self._baseline = {}  # (指标名, 标签值) -> 窗口开始时的分桶计数
+        self._thread = None
+        self._stop = threading.Event()
+
+    def watch(self, histogram):
+        if histogram not in self._watched:
+            self._watched.append(histogram)
+
+    def add_hook(self, hook):
+        """hook(metric_name, labels, p99, limit)"""
+        self.hooks.append(hook)
+
+    def check(self):
+        now = time.monotonic()
+        for hist in self._watched:
+            for values, child in hist.children():
+                key = (hist.name, values)
+                counts = child.snapshot()
+                baseline = self._baseline.get(key) or [0] * len(counts)
+                window = [c - b for c, b in zip(counts, baseline)]
+                if sum(window) < self.min_samples:
+                    continue
+                self._baseline[key] = counts
+                p99 = bucket_quantile(child.buckets, window, 0.99)
+                if p99 is None or p99 <= self.limit_sec:
+                    continue
+                if now - self._last_alert.get(key, -math.inf) < self.cooldown_sec:
+                    continue
+                self._last_alert[key] = now
+                labels = _format_labels(hist.labelnames, values)
+                p99_alerts.labels(hist.name).inc()
+                for hook in self.hooks:
+                    try:
+                        hook(hist.name, labels, p99, self.limit_sec)
+                    except Exception as e:
+                        logger.error(f"P99 alert hook failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="P99Alerter", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval_sec):
+            self.check()
+
+    def stop(self):
+        self._stop.set()
@@ -1,70 +1,250 @@
 import logging
+from urllib.parse import urlparse
 
+from scrapy import signals
 from scrapy.exceptions import NotConfigured
+from twisted.internet import task, threads
+
+from .database import Database
+from .proxy_pool import SINGBOX_BINARY, ProxyPool
+from .routing import DIRECT, DomainTrie, RoutingTable
+
+# 响应码表示该路径被目标站点拒绝或不可用，计为该路径失败
+ROUTE_FAILURE_STATUSES = {403, 407, 429, 502, 503, 504}
 
 
 class SmartProxyMiddleware:
     """
     智能代理中间件：
-    1. 自动识别请求是否需要代理（基于域名）。
-    2. 如果代理请求失败，自动切换到直连模式。
-    3. 如果直连请求失败，自动尝试挂载代理模式。
+    1. 按可注册域名学习每条路径（直连 / 每个代理）的成功率和延迟，每个请求选择最优路径。
+    2. 偶尔探索其他路径，长时间未使用的路径会被重新尝试。
+    3. 某条路径连接失败时切换到下一条尚未尝试的路径，而不是固定在代理和直连之间来回切换。
+    4. 学习到的延迟用于缩短该路径的下载超时，避免在明显不可用的路径上等满超时。
     """
 
-    def __init__(self, proxy_url):
-        self.proxy_url = proxy_url
-        self.blocked_domains = [
-            "github.com",
-            "t.me",
-            "google.com",
-            "raw.githubusercontent.com",
-            "githubusercontent.com",
-        ]
+    # 已知需要代理的域名（作为先验，会被学习结果覆盖）
+    blocked_domains = [
+        "github.com",
+        "t.me",
+        "google.com",
+        "githubusercontent.com",
+    ]
+
+    def __init__(
+        self,
+        proxies,
+        state_path=None,
+        explore_rate=None,
+        max_domains=None,
+        download_timeout=180,
+        timeout_factor=4.0,
+        min_timeout=5,
+    ):
+        # proxies: {路径名称: 代理地址}
+        self.proxies = proxies
+        kwargs = {} if explore_rate is None else {"explore_rate": explore_rate}
+        if max_domains is not None:
+            kwargs["max_domains"] = max_domains
+        self.table = RoutingTable(
+            [DIRECT] + list(proxies),
+            prefer_proxy=self.blocked_domains,
+            state_path=state_path,
+            **kwargs,
+        )
+        self.download_timeout = download_timeout
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
         self.logger = logging.getLogger(__name__)
 
     @classmethod
     def from_crawler(cls, crawler):
-        proxy_url = crawler.settings.get("PROXY_URL")
-        if not proxy_url:
+        settings = crawler.settings
+        proxies = dict(settings.getdict("PROXY_URLS"))
+        proxy_url = settings.get("PROXY_URL")
+        if proxy_url and proxy_url not in proxies.values():
+            proxies.setdefault("proxy", proxy_url)
+        if not proxies:
             raise NotConfigured
-        return cls(proxy_url)
+        mw = cls(
+            proxies,
+            state_path=settings.get("ROUTING_STATE_PATH"),
+            explore_rate=settings.getfloat("ROUTING_EXPLORE_RATE", 0.05),
+            max_domains=settings.getint("ROUTING_MAX_DOMAINS", 20000),
+            download_timeout=settings.getfloat("DOWNLOAD_TIMEOUT", 180),
+            timeout_factor=settings.getfloat("ROUTING_TIMEOUT_FACTOR", 4.0),
+        )
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
 
-    def process_request(self, request, spider):
-        # 如果已经标记了重试模式，则跳过初始判断
-        if "proxy_tried" in request.meta:
-            return
+    def spider_closed(self, spider):
+        if self.table.state_path:
+            self.table.save()
+
+    @staticmethod
+    def _host(request):
+        return urlparse(request.url).hostname or ""
 
-        # 初始策略：特定域名走代理
-        if any(domain in request.url for domain in self.blocked_domains):
-            request.meta["proxy"] = self.proxy_url
+    def _apply(self, request, path):
+        request.meta["route_path"] = path
+        if path == DIRECT:
+            request.meta.pop("proxy", None)
+            request.meta["using_proxy"] = False
+        else:
+            request.meta["proxy"] = self.proxies[path]
             request.meta["using_proxy"] = True
+
+        # 已知延迟的路径使用更短的超时（DownloadTimeoutMiddleware 只在未设置时填入默认值）
+        # 上一条路径设置的超时或默认超时都可以重新计算，请求自己指定的超时保持不变
+        if request.meta.get("route_timeout_set") or request.meta.get("download_timeout") == self.download_timeout:
+            request.meta.pop("download_timeout", None)
+        latency = self.table.expected_latency(self._host(request), path)
+        if latency is not None and "download_timeout" not in request.meta:
+            request.meta["download_timeout"] = min(
+                self.download_timeout, max(self.min_timeout, latency * self.timeout_factor)
+            )
+            request.meta["route_timeout_set"] = True
         else:
-            request.meta["using_proxy"] = False
+            request.meta.pop("route_timeout_set", None)
+
+    def process_request(self, request, spider):
+        # 已经选好路径（切换路径后重新调度的请求）或由代理池负责的请求不再选择
+        if "route_path" in request.meta or "proxy_pool_endpoint" in request.meta:
+            return
+        path = self.table.choose(self._host(request))
+        request.meta["route_tried"] = [path]
+        self._apply(request, path)
+
+    def process_response(self, request, response, spider):
+        path = request.meta.get("route_path")
+        if path:
+            ok = response.status not in ROUTE_FAILURE_STATUSES
+            self.table.record(
+                self._host(request), path, ok, request.meta.get("download_latency")
+            )
+        return response
 
     def process_exception(self, request, exception, spider):
         """
-        当发生网络连接错误时触发逻辑切换
+        当发生网络连接错误时记录该路径失败，并切换到下一条尚未尝试的路径
         """
-        if request.meta.get("proxy_tried"):
-            # 如果已经尝试过切换模式仍然失败，则彻底放弃，交给重试机制或记录失败
+        path = request.meta.get("route_path")
+        if not path:
             return None
+        host = self._host(request)
+        self.table.record(host, path, False)
 
-        request.meta["proxy_tried"] = True
-
-        if request.meta.get("using_proxy"):
-            self.logger.warning(
-                f"Proxy unstable for {request.url}, switching to DIRECT..."
-            )
-            if "proxy" in request.meta:
-                del request.meta["proxy"]
-            request.meta["using_proxy"] = False
-        else:
-            self.logger.warning(
-                f"Direct connection failed for {request.url}, switching to PROXY..."
-            )
-            request.meta["proxy"] = self.proxy_url
-            request.meta["using_proxy"] = True
+        tried = request.meta.get("route_tried", [path])
+        next_path = self.table.choose(host, exclude=tried)
+        if next_path is None:
+            # 所有路径都尝试过，交给重试机制或记录失败
+            return None
 
+        self.logger.warning(
+            f"{path} failed for {request.url} ({exception.__class__.__name__}), switching to {next_path}..."
+        )
+        retry = request.copy()
+        retry.meta["route_tried"] = tried + [next_path]
+        self._apply(retry, next_path)
         # 返回 request 对象表示立即重新调度该请求
-        request.dont_filter = True
-        return request
+        retry.dont_filter = True
+        return retry
+
+
+class ProxyPoolMiddleware:
+    """
+    代理池中间件：对限速严重的域名（GitHub 搜索、搜索引擎结果页等），
+    在由已验证节点组成的本地代理池中按域名轮换出口，失败的端点计数并最终被剔除，
+    代理池不足时在后台线程从数据库补充。其他域名以及代理池为空时交给 SmartProxyMiddleware。
+    """
+
+    def __init__(self, pool, domains, max_retries=2, refill_interval=60):
+        self.pool = pool
+        self.domains = DomainTrie({domain: True for domain in domains})
+        self.max_retries = max_retries
+        self.refill_interval = refill_interval
+        self.refill_task = None
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PROXY_POOL_ENABLED"):
+            raise NotConfigured
+        pool = ProxyPool(
+            Database().get_verified_proxies,
+            singbox_binary=settings.get("PROXY_POOL_SINGBOX_BINARY") or SINGBOX_BINARY,
+            size=settings.getint("PROXY_POOL_SIZE", 20),
+            max_failures=settings.getint("PROXY_POOL_MAX_FAILURES", 3),
+        )
+        mw = cls(
+            pool,
+            settings.getlist("PROXY_POOL_DOMAINS"),
+            max_retries=settings.getint("PROXY_POOL_MAX_RETRIES", 2),
+            refill_interval=settings.getfloat("PROXY_POOL_REFILL_INTERVAL", 60),
+        )
+        crawler.signals.connect(mw.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def spider_opened(self, spider):
+        self.refill_task = task.LoopingCall(self._refill)
+        self.refill_task.start(self.refill_interval, now=True)
+
+    def spider_closed(self, spider):
+        if self.refill_task and self.refill_task.running:
+            self.refill_task.stop()
+        # 关闭时需要等待进行中的补充和 sing-box 进程退出，放到线程中执行
+        return threads.deferToThread(self.pool.close)
+
+    def _refill(self):
+        # 启动 sing-box 需要等待端口就绪，放到线程中执行，不阻塞 reactor
+        if len(self.pool) == 0 or self.pool.needs_refill():
+            d = threads.deferToThread(self.pool.refill)
+            d.addErrback(lambda f: self.logger.error(f"Proxy pool refill failed: {f.value}"))
+
+    def process_request(self, request, spider):
+        if "proxy_pool_endpoint" in request.meta:
+            return
+        host = urlparse(request.url).hostname or ""
+        if not self.domains.lookup(host, False)[1]:
+            return
+        endpoint = self.pool.pick(host, exclude=request.meta.get("proxy_pool_tried", ()))
+        if endpoint is None:
+            return
+        request.meta["proxy_pool_endpoint"] = endpoint.name
+        request.meta["proxy_pool_tried"] = request.meta.get("proxy_pool_tried", []) + [endpoint.name]
+        request.meta["proxy"] = endpoint.proxy_url
+        request.meta["using_proxy"] = True
+
+    def process_response(self, request, response, spider):
+        name = request.meta.get("proxy_pool_endpoint")
+        if not name:
+            return response
+        if response.status in ROUTE_FAILURE_STATUSES:
+            self._failed(name)
+            return self._retry(request) or response
+        self.pool.report(name, True)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        name = request.meta.get("proxy_pool_endpoint")
+        if not name:
+            return None
+        self._failed(name)
+        return self._retry(request)
+
+    def _failed(self, name):
+        self.pool.report(name, False)
+        if self.pool.needs_refill():
+            self._refill()
+
+    def _retry(self, request):
+        """换一个端点重新调度，超过重试次数时返回 None"""
+        tried = request.meta.get("proxy_pool_tried", [])
+        if len(tried) > self.max_retries:
+            return None
+        retry = request.copy()
+        retry.meta.pop("proxy_pool_endpoint", None)
+        retry.meta.pop("proxy", None)
+        retry.dont_filter = True
+        return retry
@@ -0,0 +1,207 @@
+"""
+把分享链接（ss://、vmess:// 等）转换为 sing-box 出站配置
+测速工具和代理池都需要真正可用的出站，而不是把整条链接塞进 server 字段
+"""
+import base64
+import json
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+def _b64decode(data):
+    """兼容 URL 安全字符和缺失填充的 base64 解码"""
+    data = data.strip().replace("-", "+").replace("_", "/")
+    data += "=" * (-len(data) % 4)
+    return base64.b64decode(data).decode("utf-8", errors="ignore")
+
+
+def _query(parts):
+    return {k: v[0] for k, v in parse_qs(parts.query).items()}
+
+
+def _tls(params, default_enabled=False):
+    """根据链接参数生成 tls 配置"""
+    security = params.get("security", "tls" if default_enabled else "")
+    if security not in ("tls", "reality", "xtls"):
+        return None
+    tls = {
+        "enabled": True,
+        "server_name": params.get("sni") or params.get("peer") or params.get("host", ""),
+        "insecure": params.get("allowInsecure", params.get("insecure", "0")) in ("1", "true"),
+    }
+    if params.get("alpn"):
+        tls["alpn"] = params["alpn"].split(",")
+    if params.get("fp"):
+        tls["utls"] = {"enabled": True, "fingerprint": params["fp"]}
+    if security == "reality":
+        tls["reality"] = {
+            "enabled": True,
+            "public_key": params.get("pbk", ""),
+            "short_id": params.get("sid", ""),
+        }
+    return tls
+
+
+def _transport(params):
+    """根据链接参数生成传输层配置"""
+    network = params.get("type") or params.get("net") or "tcp"
+    if network == "ws":
+        transport = {"type": "ws", "path": params.get("path", "/")}
+        if params.get("host"):
+            transport["headers"] = {"Host": params["host"]}
+        return transport
+    if network == "grpc":
+        return {
+            "type": "grpc",
+            "service_name": params.get("serviceName") or params.get("path", ""),
+        }
+    if network in ("h2", "http"):
+        transport = {"type": "http", "path": params.get("path", "/")}
+        if params.get("host"):
+            transport["host"] = params["host"].split(",")
+        return transport
+    return None
+
+
+def _with_options(outbound, tls=None, transport=None):
+    if tls:
+        outbound["tls"] = tls
+    if transport:
+        outbound["transport"] = transport
+    return outbound
+
+
+def _parse_ss(url, tag):
+    body = url[len("ss://") :].split("#", 1)[0]
+    if "@" in body:
+        # SIP002: ss://base64(method:password)@server:port 或明文 method:password@server:port
+        userinfo, _, hostport = body.rpartition("@")
+        userinfo = unquote(userinfo)
+        if ":" not in userinfo:
+            userinfo = _b64decode(userinfo)
+    else:
+        # 旧格式：ss://base64(method:password@server:port)
+        decoded = _b64decode(body.split("?", 1)[0])
+        userinfo, _, hostport = decoded.rpartition("@")
+    method, _, password = userinfo.partition(":")
+    hostport = hostport.split("?", 1)[0].split("/", 1)[0]
+    server, _, port = hostport.rpartition(":")
+    return {
+        "type": "shadowsocks",
+        "tag": tag,
+        "server": server.strip("[]"),
+        "server_port": int(port),
+        "method": method,
+        "password": password,
+    }
+
+
+def _parse_vmess(url, tag):
+    config = json.loads(_b64decode(url[len("vmess://") :]))
+    params = {k: str(v) for k, v in config.items()}
+    if params.get("tls") == "tls":
+        params["security"] = "tls"
+    return _with_options(
+        {
+            "type": "vmess",
+            "tag": tag,
+            "server": params["add"],
+            "server_port": int(params["port"]),
+            "uuid": params["id"],
+            "alter_id": int(params.get("aid") or 0),
+            "security": params.get("scy") or "auto",
+        },
+        _tls(params),
+        _transport(params),
+    )
+
+
+def _parse_userinfo_url(url):
+    parts = urlsplit(url)
+    return parts, _query(parts), unquote(parts.username or "")
+
+
+def _parse_vless(url, tag):
+    parts, params, uuid = _parse_userinfo_url(url)
+    outbound = {
+        "type": "vless",
+        "tag": tag,
+        "server": parts.hostname,
+        "server_port": parts.port,
+        "uuid": uuid,
+    }
+    if params.get("flow"):
+        outbound["flow"] = params["flow"]
+    return _with_options(outbound, _tls(params), _transport(params))
+
+
+def _parse_trojan(url, tag):
+    parts, params, password = _parse_userinfo_url(url)
+    return _with_options(
+        {
+            "type": "trojan",
+            "tag": tag,
+            "server": parts.hostname,
+            "server_port": parts.port,
+            "password": password,
+        },
+        _tls(params, default_enabled=True),
+        _transport(params),
+    )
+
+
+def _parse_hysteria2(url, tag):
+    parts, params, password = _parse_userinfo_url(url)
+    outbound = {
+        "type": "hysteria2",
+        "tag": tag,
+        "server": parts.hostname,
+        "server_port": parts.port,
+        "password": password,
+        "tls": _tls(params, default_enabled=True),
+    }
+    if params.get("obfs"):
+        outbound["obfs"] = {
+            "type": params["obfs"],
+            "password": params.get("obfs-password", ""),
+        }
+    return outbound
+
+
+def _parse_tuic(url, tag):
+    parts, params, uuid = _parse_userinfo_url(url)
+    return {
+        "type": "tuic",
+        "tag": tag,
+        "server": parts.hostname,
+        "server_port": parts.port,
+        "uuid": uuid,
+        "password": unquote(parts.password or ""),
+        "congestion_control": params.get("congestion_control", "cubic"),
+        "tls": _tls(params, default_enabled=True),
+    }
+
+
+PARSERS = {
+    "ss": _parse_ss,
+    "vmess": _parse_vmess,
+    "vless": _parse_vless,
+    "trojan": _parse_trojan,
+    "hysteria2": _parse_hysteria2,
+    "hy2": _parse_hysteria2,
+    "tuic": _parse_tuic,
+}
+
+
+def build_outbound(url, protocol=None, tag="proxy-out"):
+    """把分享链接转换为 sing-box 出站配置，不支持或解析失败时返回 None"""
+    protocol = protocol or url.split("://", 1)[0].lower()
+    parser = PARSERS.get(protocol)
+    if not parser:
+        return None
+    try:
+        outbound = parser(url.strip(), tag)
+    except (ValueError, KeyError, TypeError, UnicodeError, json.JSONDecodeError):
+        return None
+    if not outbound.get("server") or not outbound.get("server_port"):
+        return None
+    return outbound
@@ -1,13 +1,19 @@
 from datetime import datetime
 
+from . import metrics, profiling
 from .database import Database
 from .models import ResourceItem
 
+db_flush_latency = metrics.histogram(
+    "db_flush_seconds", "Latency of database writes", ["writer"]
+)
+
 
 class SingboxCrawlerPipeline:
     def __init__(self):
         self.db = Database()
 
+    @profiling.profiled("pipeline")
     def process_item(self, item, spider):
         # 使用pydantic模型验证数据
         try:
@@ -20,10 +26,15 @@ class SingboxCrawlerPipeline:
 
         # 存储资源，并关联来源 URL
         source_url = item.get("source")
-        success = self.db.save_resource(dict(item), source_url)
+        with db_flush_latency.labels("crawler_items").time(), profiling.stage("db"):
+            success = self.db.save_resource(dict(item), source_url)
 
-        # 只要找到了资源，就说明这个源是有效的
+        # 只要找到了资源，就说明这个源是有效的；同一来源的多次更新由爬虫的写入线程合并
         if success:
-            self.db.update_source_stats(source_url, is_success=True)
+            sources = getattr(spider, "sources", None)
+            if sources is not None:
+                sources.update_stats(source_url, is_success=True)
+            else:
+                self.db.update_source_stats(source_url, is_success=True)
 
         return item
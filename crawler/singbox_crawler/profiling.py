@@ -0,0 +1,332 @@
+"""
+按阶段开关的运行时性能分析
+代码中的各阶段（spider parse、pipeline、数据库写入、geo 解析、测试线程）用 stage() / profiled() 标记，
+未开启分析时标记只有一次布尔判断。开启后：
+- sample 模式：后台线程定期采样正处于被分析阶段的线程的调用栈，输出 collapsed stack 文件
+  （每行 "帧;帧;帧 次数"，可直接用 flamegraph.pl / speedscope 生成火焰图）；
+- cprofile 模式：在阶段内启用 cProfile，输出 .pstats 文件。
+文件写入 tmp/profiles/，只保留最近 PROFILE_KEEP_FILES 个。
+
+开启方式：
+- 环境变量 MONITORING_PROFILE_STAGES=parse,db（MONITORING_PROFILE_MODE=sample|cprofile，
+  MONITORING_PROFILE_DURATION_SEC=60）启动时开启；
+- 控制文件 tmp/control/profile.<pid>（service_launcher.py --profile 写入）；
+- POSIX 上向进程发送 SIGUSR2 切换开关。
+不依赖 config，爬虫、测试器和流水线都可以使用。
+"""
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from . import control
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.path.join(control.PROJECT_ROOT, "tmp", "profiles")
+PROFILE_KEEP_FILES = 20
+SAMPLE_INTERVAL_SEC = 0.005  # 采样间隔（200Hz）
+MAX_STACK_DEPTH = 64
+DEFAULT_DURATION_SEC = 60
+CONTROL_POLL_SEC = 2
+
+STAGES = ("parse", "pipeline", "db", "geo", "test")
+MODE_SAMPLE = "sample"
+MODE_CPROFILE = "cprofile"
+
+# 运行状态：stages 为空表示未开启
+_enabled_stages = frozenset()
+_mode = MODE_SAMPLE
+_active = {}  # 线程 ID -> 当前所在阶段列表（由线程自己维护）
+_samples = {}  # 阶段 -> Counter(调用栈)
+_profiles = {}  # (阶段, 线程 ID) -> [cProfile.Profile, 是否正在使用]
+_lock = threading.Lock()
+_sampler = None
+_stop_timer = None
+_started_at = None
+
+
+def is_enabled(stage):
+    return stage in _enabled_stages
+
+
+@contextmanager
+def stage(name):
+    """标记一段代码属于某个阶段"""
+    if name not in _enabled_stages:
+        yield
+        return
+    tid = threading.get_ident()
+    if _mode == MODE_CPROFILE:
+        with _cprofile(name, tid):
+            yield
+        return
+    stages = _active.setdefault(tid, [])
+    stages.append(name)
+    try:
+        yield
+    finally:
+        stages.pop()
+        if not stages:
+            _active.pop(tid, None)
+
+
+@contextmanager
+def _cprofile(name, tid):
+    # 同一线程同时只能启用一个 cProfile，嵌套的阶段计入外层
+    if any(key[1] == tid and entry[1] for key, entry in list(_profiles.items())):
+        yield
+        return
+    with _lock:
+        entry = _profiles.setdefault((name, tid), [cProfile.Profile(), False])
+        entry[1] = True
+    entry[0].enable()
+    try:
+        yield
+    finally:
+        entry[0].disable()
+        entry[1] = False
+
+
+def profiled(name):
+    """函数装饰器版本的 stage()"""
+
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            if name not in _enabled_stages:
+                return func(*args, **kwargs)
+            with stage(name):
+                return func(*args, **kwargs)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    return decorator
+
+
+def profiled_iter(name, iterable):
+    """逐步迭代生成器时标记阶段（Scrapy 回调是生成器，每次 next() 之间会切到其他请求）"""
+    iterator = iter(iterable)
+    while True:
+        if name in _enabled_stages:
+            with stage(name):
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+        else:
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+        yield value
+
+
+# ---- 采样 ----
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval=SAMPLE_INTERVAL_SEC):
+        super().__init__(name="ProfileSampler", daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            try:
+                active = {tid: list(stages) for tid, stages in list(_active.items())}
+            except RuntimeError:
+                continue
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for tid, stages in active.items():
+                frame = frames.get(tid)
+                if frame is None or tid == own:
+                    continue
+                stack = _collapse(frame)
+                for name in set(stages):
+                    _samples.setdefault(name, Counter())[stack] += 1
+
+
+# ---- 开关 ----
+
+
+def start(stages, mode=MODE_SAMPLE, duration=DEFAULT_DURATION_SEC):
+    """开启指定阶段的分析，duration 秒后自动停止并写文件（None 表示直到 stop()）"""
+    global _enabled_stages, _mode, _sampler, _stop_timer, _started_at
+    stages = [s.strip() for s in stages if s.strip()]
+    if "all" in stages:
+        stages = list(STAGES)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown profile stages: {', '.join(sorted(unknown))}")
+    if _enabled_stages:
+        stop()
+    _samples.clear()
+    _profiles.clear()
+    _mode = mode
+    _started_at = datetime.now()
+    if mode == MODE_SAMPLE:
+        _sampler = _Sampler()
+        _sampler.start()
+    _enabled_stages = frozenset(stages)
+    logger.info(f"Profiling started: stages={','.join(stages)} mode={mode} duration={duration}s")
+    if duration:
+        _stop_timer = threading.Timer(duration, stop)
+        _stop_timer.daemon = True
+        _stop_timer.start()
+
+
+def stop():
+    """停止分析并写出文件，返回文件路径列表"""
+    global _enabled_stages, _sampler, _stop_timer
+    if not _enabled_stages:
+        return []
+    stages = _enabled_stages
+    _enabled_stages = frozenset()
+    if _stop_timer is not None:
+        _stop_timer.cancel()
+        _stop_timer = None
+    if _sampler is not None:
+        _sampler.stop_event.set()
+        _sampler.join()
+        _sampler = None
+    paths = _write(stages)
+    _rotate()
+    for path in paths:
+        logger.info(f"Profile written to {path}")
+    return paths
+
+
+def toggle(stages=STAGES, mode=MODE_SAMPLE, duration=DEFAULT_DURATION_SEC):
+    if _enabled_stages:
+        return stop()
+    start(stages, mode, duration)
+    return []
+
+
+def _write(stages):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = _started_at.strftime("%Y%m%d_%H%M%S")
+    paths = []
+    for name in sorted(stages):
+        prefix = os.path.join(PROFILE_DIR, f"profile_{name}_{os.getpid()}_{stamp}")
+        if _mode == MODE_CPROFILE:
+            profiles = [
+                entry[0]
+                for (stage_name, _), entry in list(_profiles.items())
+                if stage_name == name and not entry[1]
+            ]
+            if not profiles:
+                continue
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            path = prefix + ".pstats"
+            stats.dump_stats(path)
+        else:
+            counts = _samples.get(name)
+            if not counts:
+                continue
+            path = prefix + ".collapsed"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+        paths.append(path)
+    return paths
+
+
+def _rotate(keep=PROFILE_KEEP_FILES):
+    try:
+        files = sorted(
+            (os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR)),
+            key=os.path.getmtime,
+        )
+    except FileNotFoundError:
+        return
+    for path in files[:-keep]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# ---- 触发方式 ----
+
+
+def parse_request(text):
+    """解析 "stages=parse,db mode=sample duration=60" 形式的请求"""
+    options = dict(part.split("=", 1) for part in text.split() if "=" in part)
+    return (
+        options.get("stages", "all").split(","),
+        options.get("mode", MODE_SAMPLE),
+        float(options.get("duration", DEFAULT_DURATION_SEC)),
+    )
+
+
+def format_request(stages, mode=MODE_SAMPLE, duration=DEFAULT_DURATION_SEC):
+    return f"stages={','.join(stages)} mode={mode} duration={duration}"
+
+
+_watcher = None
+
+
+def _watch_control():
+    while True:
+        time.sleep(CONTROL_POLL_SEC)
+        payload = control.consume(control.PROFILE)
+        if payload is None:
+            continue
+        try:
+            start(*parse_request(payload))
+        except Exception as e:
+            logger.error(f"Invalid profile request {payload!r}: {e}")
+
+
+def install(stages=None, mode=None, duration=None):
+    """
+    在进程启动时调用一次：按参数或环境变量开启分析，监听控制文件，
+    POSIX 上注册 SIGUSR2 切换开关
+    """
+    global _watcher
+    stages = stages if stages is not None else os.environ.get("MONITORING_PROFILE_STAGES", "")
+    mode = mode or os.environ.get("MONITORING_PROFILE_MODE", MODE_SAMPLE)
+    if duration is None:
+        duration = float(os.environ.get("MONITORING_PROFILE_DURATION_SEC", DEFAULT_DURATION_SEC))
+    if isinstance(stages, str):
+        stages = [s for s in stages.split(",") if s.strip()]
+
+    if _watcher is None:
+        _watcher = threading.Thread(target=_watch_control, name="ProfileControl", daemon=True)
+        _watcher.start()
+        if hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+            signal.signal(
+                signal.SIGUSR2,
+                lambda signum, frame: toggle(stages or STAGES, mode, duration),
+            )
+        if stages:
+            start(stages, mode, duration)
@@ -0,0 +1,311 @@
+"""
+由已验证节点组成的本地代理池
+从数据库取一批已验证的节点，用一个 sing-box 进程为每个节点开一个本地 mixed 入站（HTTP/SOCKS），
+按入站路由到对应出站。爬虫按域名在这些本地端点之间轮换，连续失败的端点被剔除，
+池子低于一定比例时再从数据库补充。每次补充启动一个新的 sing-box 实例，
+已有端点不受影响；某个实例的端点全部被剔除后在后台线程中结束该实例（不阻塞调用方）。
+剔除过的节点在 POOL_EXCLUDE_TTL 内不再使用，最多记录 POOL_EXCLUDE_MAX 个。
+不依赖 config 和 Scrapy，节点来源由调用方传入。
+"""
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from . import control
+from .outbounds import build_outbound
+from .routing import registrable_domain
+
+SINGBOX_BINARY = os.path.join(control.PROJECT_ROOT, "singbox_test", "sing-box")
+if platform.system() == "Windows":
+    SINGBOX_BINARY += ".exe"
+POOL_CONFIG_DIR = os.path.join(control.PROJECT_ROOT, "tmp", "proxy_pool")
+
+POOL_SIZE = 20
+POOL_MAX_FAILURES = 3  # 连续失败多少次后剔除端点
+POOL_REFILL_RATIO = 0.5  # 可用端点低于 size × 该比例时补充
+SINGBOX_START_TIMEOUT = 5.0
+POOL_EXCLUDE_TTL = 3600  # 剔除的节点多少秒内不再使用
+POOL_EXCLUDE_MAX = 500  # 最多记录的剔除节点数（查询时展开为 NOT IN 参数，需低于 SQLite 的参数上限）
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_ports(process, ports, timeout):
+    """等待所有端口可连接；进程提前退出（配置无效）时立即返回 False"""
+    deadline = time.monotonic() + timeout
+    pending = list(ports)
+    while pending and time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("127.0.0.1", pending[0]), timeout=0.5):
+                pending.pop(0)
+        except OSError:
+            time.sleep(0.1)
+    return not pending
+
+
+class Endpoint:
+    __slots__ = ("name", "resource_id", "port", "instance", "failures", "successes")
+
+    def __init__(self, name, resource_id, port, instance):
+        self.name = name
+        self.resource_id = resource_id
+        self.port = port
+        self.instance = instance
+        self.failures = 0
+        self.successes = 0
+
+    @property
+    def proxy_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+class SingboxInstance:
+    """一个 sing-box 进程，nodes 为 [(端点名, 出站配置)]，每个节点一个入站"""
+
+    def __init__(self, binary, nodes, config_dir=POOL_CONFIG_DIR):
+        self.binary = binary
+        self.nodes = nodes
+        self.ports = {name: _free_port() for name, _ in nodes}
+        os.makedirs(config_dir, exist_ok=True)
+        self.config_path = os.path.join(
+            config_dir, f"pool_{os.getpid()}_{id(self)}.json"
+        )
+        self.process = None
+        self.live = set(self.ports)
+
+    def _config(self):
+        inbounds, outbounds, rules = [], [], []
+        for name, outbound in self.nodes:
+            inbounds.append(
+                {
+                    "type": "mixed",
+                    "tag": f"in-{name}",
+                    "listen": "127.0.0.1",
+                    "listen_port": self.ports[name],
+                }
+            )
+            outbounds.append(dict(outbound, tag=f"out-{name}"))
+            rules.append({"inbound": [f"in-{name}"], "outbound": f"out-{name}"})
+        outbounds.append({"type": "block", "tag": "block"})
+        return {
+            "log": {"level": "error"},
+            "inbounds": inbounds,
+            "outbounds": outbounds,
+            "route": {"rules": rules, "final": "block"},
+        }
+
+    def start(self):
+        with open(self.config_path, "w", encoding="utf-8") as f:
+            json.dump(self._config(), f)
+        self.process = subprocess.Popen(
+            [self.binary, "run", "-c", self.config_path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if _wait_for_ports(self.process, self.ports.values(), SINGBOX_START_TIMEOUT):
+            return True
+        self.stop()
+        return False
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+        try:
+            os.remove(self.config_path)
+        except FileNotFoundError:
+            pass
+
+
+class ProxyPool:
+    """
+    fetch_resources(limit, exclude_ids) -> [(id, url, protocol)]，通常是 Database.get_verified_proxies
+    """
+
+    def __init__(
+        self,
+        fetch_resources,
+        singbox_binary=SINGBOX_BINARY,
+        size=POOL_SIZE,
+        max_failures=POOL_MAX_FAILURES,
+        refill_ratio=POOL_REFILL_RATIO,
+        exclude_ttl=POOL_EXCLUDE_TTL,
+        exclude_max=POOL_EXCLUDE_MAX,
+    ):
+        self.fetch_resources = fetch_resources
+        self.singbox_binary = singbox_binary
+        self.size = size
+        self.max_failures = max_failures
+        self.refill_ratio = refill_ratio
+        self.exclude_ttl = exclude_ttl
+        self.exclude_max = exclude_max
+        self.endpoints = {}  # 端点名 -> Endpoint
+        self.instances = []
+        self.excluded_ids = OrderedDict()  # 最近剔除过或无法使用的节点 -> 剔除时间
+        self._cursors = {}  # 可注册域名 -> 轮换位置
+        self._lock = threading.Lock()
+        self._refilling = threading.Lock()
+        self._stoppers = []  # 正在结束实例的后台线程
+        self._closed = False
+        self.logger = logging.getLogger(__name__)
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def needs_refill(self):
+        return len(self.endpoints) < self.size * self.refill_ratio
+
+    def refill(self):
+        """补充到 size 个端点，返回新增数量；已有补充在进行时直接返回 0"""
+        if not os.path.exists(self.singbox_binary):
+            self.logger.warning(f"sing-box binary not found: {self.singbox_binary}")
+            return 0
+        if not self._refilling.acquire(blocking=False):
+            return 0
+        try:
+            missing = self.size - len(self.endpoints)
+            if missing <= 0 or self._closed:
+                return 0
+            with self._lock:
+                exclude = self._current_excluded() | {
+                    e.resource_id for e in self.endpoints.values()
+                }
+            nodes = []
+            for resource_id, url, protocol in self.fetch_resources(missing, exclude):
+                outbound = build_outbound(url, protocol)
+                if outbound is None:
+                    self._exclude(resource_id)
+                    continue
+                nodes.append((resource_id, outbound))
+            added = self._start_nodes(nodes)
+            self.logger.info(f"Proxy pool refilled: +{added}, {len(self.endpoints)} endpoints")
+            return added
+        finally:
+            self._refilling.release()
+
+    def _start_nodes(self, nodes):
+        """启动一个包含 nodes 的实例；某个出站配置让 sing-box 无法启动时二分排除"""
+        if not nodes:
+            return 0
+        named = [(f"node{resource_id}", outbound) for resource_id, outbound in nodes]
+        instance = SingboxInstance(self.singbox_binary, named)
+        if instance.start():
+            with self._lock:
+                if self._closed:
+                    # 启动期间池子已经关闭
+                    instance.stop()
+                    return 0
+                self.instances.append(instance)
+                for resource_id, _ in nodes:
+                    name = f"node{resource_id}"
+                    self.endpoints[name] = Endpoint(
+                        name, resource_id, instance.ports[name], instance
+                    )
+            return len(nodes)
+        if len(nodes) == 1:
+            self._exclude(nodes[0][0])
+            return 0
+        middle = len(nodes) // 2
+        return self._start_nodes(nodes[:middle]) + self._start_nodes(nodes[middle:])
+
+    def pick(self, host, exclude=()):
+        """按域名轮换选择端点，返回 Endpoint，池子为空时返回 None"""
+        with self._lock:
+            names = sorted(name for name in self.endpoints if name not in exclude)
+            if not names:
+                return None
+            domain = registrable_domain(host)
+            cursor = self._cursors.get(domain, 0)
+            self._cursors[domain] = cursor + 1
+            return self.endpoints[names[cursor % len(names)]]
+
+    def _exclude(self, resource_id):
+        with self._lock:
+            self._add_excluded(resource_id)
+
+    def _add_excluded(self, resource_id):
+        """记录剔除的节点，超过上限时丢弃最早的记录（调用方持有 _lock）"""
+        self.excluded_ids[resource_id] = time.monotonic()
+        self.excluded_ids.move_to_end(resource_id)
+        while len(self.excluded_ids) > self.exclude_max:
+            self.excluded_ids.popitem(last=False)
+
+    def _current_excluded(self):
+        """清理过期的剔除记录，返回仍然有效的节点 id（调用方持有 _lock）"""
+        expired = time.monotonic() - self.exclude_ttl
+        while self.excluded_ids:
+            resource_id, excluded_at = next(iter(self.excluded_ids.items()))
+            if excluded_at >= expired:
+                break
+            self.excluded_ids.popitem(last=False)
+        return set(self.excluded_ids)
+
+    def report(self, name, ok):
+        """记录端点的请求结果，连续失败达到上限时剔除"""
+        evicted = None
+        with self._lock:
+            endpoint = self.endpoints.get(name)
+            if endpoint is None:
+                return
+            if ok:
+                endpoint.failures = 0
+                endpoint.successes += 1
+                return
+            endpoint.failures += 1
+            if endpoint.failures < self.max_failures:
+                return
+            evicted = self._evict(endpoint)
+        if evicted:
+            self._stop_in_background(evicted)
+        self.logger.info(
+            f"Evicted proxy endpoint {name} after {endpoint.failures} failures, "
+            f"{len(self.endpoints)} left"
+        )
+
+    def _evict(self, endpoint):
+        """从池中移除端点（调用方持有 _lock），实例的端点全部被剔除时返回该实例，由调用方在锁外结束"""
+        del self.endpoints[endpoint.name]
+        self._add_excluded(endpoint.resource_id)
+        instance = endpoint.instance
+        instance.live.discard(endpoint.name)
+        if not instance.live:
+            self.instances.remove(instance)
+            return instance
+        return None
+
+    def _stop_in_background(self, instance):
+        # 结束进程最多等待 5 秒，不能在调用方（通常是反应器线程）中等待
+        stopper = threading.Thread(target=instance.stop, name="ProxyPoolStop", daemon=True)
+        stopper.start()
+        with self._lock:
+            self._stoppers = [t for t in self._stoppers if t.is_alive()]
+            self._stoppers.append(stopper)
+
+    def close(self):
+        """等待进行中的补充完成，然后结束所有实例（会阻塞，应在线程中调用）"""
+        self._closed = True
+        with self._refilling:
+            with self._lock:
+                instances, self.instances = self.instances, []
+                stoppers, self._stoppers = self._stoppers, []
+                self.endpoints.clear()
+            for instance in instances:
+                instance.stop()
+            for stopper in stoppers:
+                stopper.join()
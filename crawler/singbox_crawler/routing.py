@@ -0,0 +1,274 @@
+"""
+按域名学习的路由表
+为每个可注册域名（example.com）在每条出口路径（直连和每个配置的代理）上维护成功率和延迟的 EWMA，
+每个请求选择得分最高的路径，并以一定概率重新探索其他路径；状态保存到 JSON，重启后继续使用。
+表中最多保留 max_domains 个域名，超出时淘汰最久未使用的域名；定期保存在后台线程中进行，不阻塞调用方。
+域名匹配使用按标签倒序的后缀树，不做线性扫描。
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+DIRECT = "direct"
+
+# 多级公共后缀（只列出爬取目标中常见的），用于计算可注册域名
+MULTI_LABEL_SUFFIXES = [
+    "co.uk",
+    "com.cn",
+    "net.cn",
+    "org.cn",
+    "com.hk",
+    "com.tw",
+    "co.jp",
+    "com.au",
+    "com.br",
+    "github.io",
+    "blogspot.com",
+    "workers.dev",
+    "pages.dev",
+]
+
+ROUTING_EWMA_ALPHA = 0.2
+ROUTING_EXPLORE_RATE = 0.05  # 随机探索其他路径的概率
+ROUTING_STALE_SEC = 6 * 3600  # 路径超过该时间未使用时重新探索
+ROUTING_MIN_SAMPLES = 3  # 样本少于该数量时使用先验
+ROUTING_LATENCY_SCALE_SEC = 5.0  # 延迟对得分的影响尺度
+ROUTING_SAVE_EVERY = 50  # 每多少次更新保存一次状态
+ROUTING_MAX_DOMAINS = 20000  # 路由表最多保留的域名数
+
+
+class DomainTrie:
+    """按域名标签倒序组织的后缀树，lookup 返回最长匹配后缀对应的值"""
+
+    _VALUE = object()
+
+    def __init__(self, entries=None):
+        self.root = {}
+        for suffix, value in (entries or {}).items():
+            self.insert(suffix, value)
+
+    def insert(self, suffix, value=True):
+        node = self.root
+        for label in reversed(suffix.lower().strip(".").split(".")):
+            node = node.setdefault(label, {})
+        node[self._VALUE] = value
+
+    def lookup(self, host, default=None):
+        """返回 (匹配的后缀, 值)，没有匹配时返回 (None, default)"""
+        labels = host.lower().strip(".").split(".")
+        node = self.root
+        match = (None, default)
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label)
+            if node is None:
+                break
+            if self._VALUE in node:
+                match = (".".join(labels[-depth:]), node[self._VALUE])
+        return match
+
+
+_public_suffixes = DomainTrie({suffix: True for suffix in MULTI_LABEL_SUFFIXES})
+
+
+def registrable_domain(host):
+    """example.com / example.co.uk；IP 地址和单标签主机原样返回"""
+    host = (host or "").lower().strip(".")
+    labels = host.split(".")
+    if len(labels) <= 2 or labels[-1].isdigit():
+        return host
+    suffix, _ = _public_suffixes.lookup(host)
+    suffix_len = len(suffix.split(".")) if suffix else 1
+    return ".".join(labels[-(suffix_len + 1):])
+
+
+class PathStats:
+    __slots__ = ("success", "latency", "samples", "last_used")
+
+    def __init__(self, success, latency=None, samples=0, last_used=0.0):
+        self.success = success
+        self.latency = latency
+        self.samples = samples
+        self.last_used = last_used
+
+    def update(self, ok, latency, alpha):
+        self.success = alpha * (1.0 if ok else 0.0) + (1 - alpha) * self.success
+        if ok and latency is not None:
+            self.latency = (
+                latency
+                if self.latency is None
+                else alpha * latency + (1 - alpha) * self.latency
+            )
+        self.samples += 1
+        self.last_used = time.time()
+
+    def to_list(self):
+        return [round(self.success, 4), self.latency and round(self.latency, 3), self.samples, int(self.last_used)]
+
+    @classmethod
+    def from_list(cls, data):
+        return cls(*data)
+
+
+class RoutingTable:
+    """
+    paths: 路径名称列表（包括 DIRECT）
+    prefer_proxy: 已知需要代理的域名后缀，作为这些域名的先验
+    """
+
+    def __init__(
+        self,
+        paths,
+        prefer_proxy=(),
+        state_path=None,
+        alpha=ROUTING_EWMA_ALPHA,
+        explore_rate=ROUTING_EXPLORE_RATE,
+        stale_sec=ROUTING_STALE_SEC,
+        max_domains=ROUTING_MAX_DOMAINS,
+        seed=None,
+    ):
+        self.paths = list(paths)
+        self.prefer_proxy = DomainTrie({suffix: True for suffix in prefer_proxy})
+        self.state_path = state_path
+        self.alpha = alpha
+        self.explore_rate = explore_rate
+        self.stale_sec = stale_sec
+        self.max_domains = max_domains
+        self.random = random.Random(seed)
+        self.domains = OrderedDict()  # 可注册域名 -> {路径: PathStats}，按最近使用排序
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 同一时间只有一次写文件
+        self._saver = None  # 正在进行的后台保存线程
+        self._dirty = 0
+        if state_path:
+            self.load()
+
+    def _prior(self, host, path):
+        needs_proxy = self.prefer_proxy.lookup(host, False)[1]
+        if path == DIRECT:
+            return PathStats(0.3 if needs_proxy else 0.9)
+        return PathStats(0.9 if needs_proxy else 0.6)
+
+    def _stats(self, host):
+        domain = registrable_domain(host)
+        stats = self.domains.get(domain)
+        if stats is None:
+            stats = self.domains[domain] = {}
+            while len(self.domains) > self.max_domains:
+                self.domains.popitem(last=False)
+        else:
+            self.domains.move_to_end(domain)
+        for path in self.paths:
+            if path not in stats:
+                stats[path] = self._prior(host, path)
+        return stats
+
+    def score(self, stats):
+        latency_factor = 1.0
+        if stats.latency is not None:
+            latency_factor = 1.0 / (1.0 + stats.latency / ROUTING_LATENCY_SCALE_SEC)
+        return stats.success * latency_factor
+
+    def ranked(self, host):
+        """按得分从高到低返回路径"""
+        with self._lock:
+            stats = self._stats(host)
+            return sorted(self.paths, key=lambda p: self.score(stats[p]), reverse=True)
+
+    def choose(self, host, exclude=()):
+        """选择路径：通常取得分最高的，偶尔探索其他路径（或很久未使用的路径）"""
+        candidates = [p for p in self.ranked(host) if p not in exclude]
+        if not candidates:
+            return None
+        if len(candidates) > 1:
+            with self._lock:
+                stats = self._stats(host)
+                now = time.time()
+                stale = [
+                    p
+                    for p in candidates[1:]
+                    if stats[p].samples and now - stats[p].last_used > self.stale_sec
+                ]
+            if stale:
+                return stale[0]
+            if self.random.random() < self.explore_rate:
+                return self.random.choice(candidates[1:])
+        return candidates[0]
+
+    def expected_latency(self, host, path):
+        """样本足够时返回该路径的平均延迟，否则返回 None"""
+        with self._lock:
+            stats = self._stats(host)[path]
+            if stats.samples >= ROUTING_MIN_SAMPLES:
+                return stats.latency
+        return None
+
+    def record(self, host, path, ok, latency=None):
+        with self._lock:
+            self._stats(host)[path].update(ok, latency, self.alpha)
+            self._dirty += 1
+            should_save = (
+                self.state_path
+                and self._dirty >= ROUTING_SAVE_EVERY
+                and not (self._saver and self._saver.is_alive())
+            )
+            if should_save:
+                self._dirty = 0
+                self._saver = threading.Thread(target=self._save_in_background, daemon=True)
+        if should_save:
+            self._saver.start()
+
+    def _save_in_background(self):
+        try:
+            self.save()
+        except Exception as e:
+            self.logger.warning(f"Failed to save routing state {self.state_path}: {e}")
+
+    # ---- 持久化 ----
+
+    def load(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Failed to load routing state {self.state_path}: {e}")
+            return
+        domains = []
+        for domain, paths in data.get("domains", {}).items():
+            # 只恢复仍然存在的路径，新配置的代理使用先验
+            stats = {
+                path: PathStats.from_list(values)
+                for path, values in paths.items()
+                if path in self.paths
+            }
+            last_used = max((s.last_used for s in stats.values()), default=0)
+            domains.append((last_used, domain, stats))
+        # 按最近使用时间恢复顺序，超出上限时只保留最近使用的域名
+        domains.sort(key=lambda item: item[0])
+        for _, domain, stats in domains[-self.max_domains:]:
+            self.domains[domain] = stats
+        self.logger.info(f"Loaded routing state for {len(self.domains)} domains")
+
+    def save(self):
+        """在锁内复制一份快照，序列化和写文件在锁外进行"""
+        with self._lock:
+            data = {
+                "saved_at": int(time.time()),
+                "domains": {
+                    domain: {path: s.to_list() for path, s in paths.items() if s.samples}
+                    for domain, paths in self.domains.items()
+                },
+            }
+            self._dirty = 0
+        with self._save_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.state_path)
@@ -0,0 +1,165 @@
+"""
+按字节、分块扫描响应体
+不再把整个响应体转换为 str、去掉空白后再复制一份做 Base64 解码：
+- 协议正则编译为 bytes 正则，在 memoryview 切出的块上匹配，相邻块之间保留 SCAN_OVERLAP 字节的重叠窗口，
+  跨块的链接不会被截断，也不会重复输出；
+- Base64 内容按块过滤字母表之外的字节、按 4 字符对齐后增量解码，解码结果直接送入第二个扫描器；
+  块中间出现填充（多段 Base64 拼接）时按填充拆开分别解码，无法解码的字符计数后跳过；
+- 内容哈希同样按块计算。
+每个响应的额外内存只与块大小有关，与响应体大小无关。
+"""
+import binascii
+import logging
+import re
+from hashlib import blake2b
+
+import pybase64
+from w3lib.encoding import html_body_declared_encoding, http_content_type_encoding
+
+from . import metrics
+
+SCAN_CHUNK_SIZE = 1024 * 1024
+SCAN_OVERLAP = 64 * 1024  # 大于最长的单个链接
+_CONTEXT = 16  # 重叠窗口之前额外保留的字节，供正则的后行断言使用
+
+_B64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+# URL 安全字母表映射到标准字母表，其他字节（空白、HTML 等）删除
+_B64_TABLE = bytes.maketrans(b"-_", b"+/")
+_B64_DELETE = bytes(b for b in range(256) if b not in _B64_ALPHABET + b"-_")
+_WHITESPACE = b" \t\r\n\v\f"
+
+base64_skipped = metrics.counter(
+    "crawler_base64_skipped_chars_total", "Base64 characters that could not be decoded"
+)
+logger = logging.getLogger(__name__)
+
+
+def compile_patterns(patterns):
+    """{协议: 正则} -> [(协议, bytes 正则)]"""
+    return [
+        (proto, re.compile(pattern.encode("ascii"), re.IGNORECASE))
+        for proto, pattern in patterns.items()
+    ]
+
+
+def iter_chunks(data, size=SCAN_CHUNK_SIZE):
+    view = memoryview(data)
+    for start in range(0, len(view), size):
+        yield view[start : start + size]
+
+
+def response_encoding(response):
+    """只根据响应头和页面开头声明的编码确定编码，不触发 Scrapy 对整个响应体的解码"""
+    content_type = response.headers.get("Content-Type", b"")
+    if isinstance(content_type, bytes):
+        content_type = content_type.decode("latin-1")
+    return (
+        http_content_type_encoding(content_type)
+        or html_body_declared_encoding(response.body[:4096])
+        or "utf-8"
+    )
+
+
+class StreamScanner:
+    """在连续输入的字节块上查找所有协议的链接，输出 (协议, 链接字节)"""
+
+    def __init__(self, patterns, overlap=SCAN_OVERLAP):
+        self.patterns = patterns
+        self.overlap = overlap
+        self.buffer = b""
+        self.offset = 0  # buffer[0] 在整个输入中的位置
+        self.start = 0  # buffer 中从该位置开始的内容还没有扫描过（之前的是后行断言用的上下文）
+        # 每个协议上一个匹配的结束位置，之后的块中不再输出落在其中的匹配（与整体 findall 一致）
+        self.resume = {proto: 0 for proto, _ in patterns}
+
+    def feed(self, chunk):
+        return self._scan(self.buffer + bytes(chunk), final=False)
+
+    def finish(self):
+        return self._scan(self.buffer, final=True)
+
+    def _scan(self, data, final):
+        # 只输出起点在 limit 之前的匹配，之后的留到下一块和新数据一起扫描
+        limit = len(data) if final else len(data) - self.overlap
+        found = []
+        if limit > self.start:
+            for proto, pattern in self.patterns:
+                pos = max(self.start, self.resume[proto] - self.offset)
+                for match in pattern.finditer(data, pos):
+                    if match.start() >= limit:
+                        break
+                    self.resume[proto] = self.offset + match.end()
+                    found.append((proto, match.group()))
+            keep = max(0, limit - _CONTEXT)
+            self.buffer = data[keep:]
+            self.offset += keep
+            self.start = limit - keep
+        else:
+            self.buffer = data
+        return found
+
+
+def looks_like_base64(data, sample=4096):
+    """去掉空白后的前 20 个字节都属于 Base64 字母表"""
+    head = bytes(memoryview(data)[:sample]).translate(None, _WHITESPACE)
+    return len(head) > 20 and not head[:20].translate(None, _B64_ALPHABET + b"-_")
+
+
+def _b64_blocks(chunks):
+    """过滤并按 4 字符对齐的 Base64 文本块"""
+    carry = b""
+    for chunk in chunks:
+        data = carry + bytes(chunk).translate(_B64_TABLE, _B64_DELETE)
+        aligned = len(data) - len(data) % 4
+        carry = data[aligned:]
+        if aligned:
+            yield data[:aligned]
+    # 末尾缺少的填充补齐，只剩 1 个字符时无法解码
+    if len(carry) > 1:
+        yield carry + b"=" * (4 - len(carry))
+
+
+def _decode_padded_block(block):
+    """
+    解码中间带有填充的块（多段 Base64 拼接而成）：按填充拆成几段分别解码，各段之间用换行分隔，
+    返回 (解码结果, 跳过的字符数)；一段末尾多出的单个字符无法解码，跳过
+    """
+    parts = []
+    skipped = 0
+    for piece in block.split(b"="):
+        if len(piece) % 4 == 1:
+            piece = piece[:-1]
+            skipped += 1
+        if piece:
+            parts.append(pybase64.b64decode(piece + b"=" * (-len(piece) % 4)))
+    return b"\n".join(parts), skipped
+
+
+def decode_base64_chunks(chunks):
+    """增量解码 Base64，输出解码后的字节块"""
+    padded = False
+    for block in _b64_blocks(chunks):
+        if padded:
+            # 上一块以填充结束，是另一段 Base64 的结尾
+            yield b"\n"
+        padded = block.endswith(b"=")
+        # 非严格模式遇到中间的填充时不报错，而是丢弃其后的内容，需要先检查
+        if b"=" not in block.rstrip(b"="):
+            try:
+                yield pybase64.b64decode(block)
+                continue
+            except binascii.Error:
+                pass
+        decoded, skipped = _decode_padded_block(block)
+        if skipped:
+            base64_skipped.inc(skipped)
+            logger.debug(f"Skipped {skipped} undecodable Base64 characters in a {len(block)}-byte block")
+        yield decoded
+
+
+def base64_digest(chunks):
+    """Base64 内容的摘要：对过滤后的 Base64 文本计算，换行和 URL 安全字母表不同的同一内容摘要相同"""
+    h = blake2b(digest_size=16)
+    for block in _b64_blocks(chunks):
+        h.update(block)
+    return h.hexdigest()
@@ -0,0 +1,151 @@
+"""
+常驻爬虫服务
+在同一个进程中保持 Twisted reactor 和 CrawlerRunner，按下一个到期源的时间调度爬取轮次，
+避免每轮都重新启动解释器、导入 Scrapy、初始化数据库。
+内存超过阈值或 supervisor 请求排空（drain）时，在本轮结束后以 EXIT_RECYCLE 退出，
+由 service_launcher 立即重启。
+
+运行方式（在 crawler 目录下）：python -m singbox_crawler.service [-s NAME=VALUE ...]
+"""
+import argparse
+import logging
+import sys
+
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.log import configure_logging
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+
+from . import control
+from .config import config
+from .memory import rss_mb
+
+# 进程因内存达到回收阈值而主动退出时的返回码
+EXIT_RECYCLE = 3
+
+# 两轮爬取之间的最短间隔，避免一直失败的源导致空转
+MIN_ROUND_INTERVAL_SEC = 30
+# 最长多久重新检查一次到期源（其他进程可能添加了新的源）
+MAX_POLL_INTERVAL_SEC = 60
+# 暂存订阅链接的处理间隔
+PENDING_PROCESS_INTERVAL_SEC = 3600
+
+
+class CrawlService:
+    def __init__(self, settings, interval_hours=6, recycle_memory_mb=None):
+        from twisted.internet import reactor
+
+        from .database import Database
+        from .spiders.universal_spider import UniversalSpider
+
+        self.reactor = reactor
+        self.settings = settings
+        self.runner = CrawlerRunner(settings)
+        self.db = Database()
+        self.spider_cls = UniversalSpider
+        self.interval_hours = interval_hours
+        self.recycle_memory_mb = recycle_memory_mb or getattr(
+            config, "service_recycle_memory_mb", 768
+        )
+        self.exit_code = 0
+        self.rounds = 0
+        self.logger = logging.getLogger("CrawlService")
+
+    def run(self):
+        control.clear(control.DRAIN)
+        self.reactor.callWhenRunning(self._loop)
+        self.reactor.run()
+        return self.exit_code
+
+    def _sleep(self, seconds):
+        from twisted.internet import task
+
+        return task.deferLater(self.reactor, seconds, lambda: None)
+
+    def _stop(self, exit_code):
+        self.exit_code = exit_code
+        if self.reactor.running:
+            self.reactor.stop()
+
+    def _loop(self):
+        from twisted.internet import defer, threads
+
+        @defer.inlineCallbacks
+        def loop():
+            last_pending_process = self.reactor.seconds()
+            while True:
+                # 空闲等待期间收到排空请求时直接退出
+                if control.is_requested(control.DRAIN):
+                    self.logger.info("Drain requested while idle, recycling process")
+                    control.clear(control.DRAIN)
+                    self._stop(EXIT_RECYCLE)
+                    return
+
+                # 1. 等到下一个源到期
+                delay = yield threads.deferToThread(
+                    self.db.seconds_until_next_due, self.interval_hours
+                )
+                if delay > 0:
+                    self.logger.info(f"Next source due in {delay:.0f}s")
+                    yield self._sleep(min(delay, MAX_POLL_INTERVAL_SEC))
+                    continue
+
+                # 2. 执行一轮爬取
+                self.rounds += 1
+                started = self.reactor.seconds()
+                self.logger.info(f"Starting crawl round #{self.rounds}")
+                yield self.runner.crawl(self.spider_cls)
+                duration = self.reactor.seconds() - started
+                self.logger.info(
+                    f"Crawl round #{self.rounds} finished in {duration:.2f}s"
+                )
+
+                # 3. 定期处理暂存订阅链接
+                since_pending = self.reactor.seconds() - last_pending_process
+                if since_pending > PENDING_PROCESS_INTERVAL_SEC:
+                    yield threads.deferToThread(self.db.process_pending_subscriptions)
+                    last_pending_process = self.reactor.seconds()
+
+                # 4. 内存超过阈值或被要求排空时退出，由 launcher 重启一个干净的进程
+                usage = rss_mb()
+                if usage > self.recycle_memory_mb or control.is_requested(control.DRAIN):
+                    self.logger.warning(
+                        f"RSS {usage:.2f}MB (recycle threshold {self.recycle_memory_mb}MB), recycling process"
+                    )
+                    control.clear(control.DRAIN)
+                    self._stop(EXIT_RECYCLE)
+                    return
+
+                if duration < MIN_ROUND_INTERVAL_SEC:
+                    yield self._sleep(MIN_ROUND_INTERVAL_SEC - duration)
+
+        d = loop()
+        d.addErrback(self._on_error)
+
+    def _on_error(self, failure):
+        self.logger.error(f"Crawl service failed: {failure.getTraceback()}")
+        self._stop(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="常驻爬虫服务")
+    parser.add_argument(
+        "-s", "--set", action="append", default=[], metavar="NAME=VALUE",
+        help="覆盖设置（与 scrapy crawl -s 相同，多 worker 模式下由 service_launcher 传入）",
+    )
+    args = parser.parse_args(argv)
+    settings = get_project_settings()
+    for item in args.set:
+        name, sep, value = item.partition("=")
+        if not sep:
+            parser.error(f"invalid -s value: {item}")
+        settings.set(name, value, priority="cmdline")
+    if settings.get("TWISTED_REACTOR"):
+        install_reactor(settings["TWISTED_REACTOR"])
+    configure_logging(settings)
+    service = CrawlService(settings)
+    return service.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
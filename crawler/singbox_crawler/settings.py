@@ -13,9 +13,45 @@ LOG_LEVEL = getattr(config, "logging_log_level", "INFO")
 LOG_FILE = None
 
 
-# 开启持久化支持，允许暂停后继续（NSSM 重启后能接着爬）
+# 开启持久化支持，允许暂停后继续（NSSM 重启后能接着爬）；待爬请求在 frontier 中，这里保存去重过滤器和爬虫状态
+# 多 worker 模式下 service_launcher 为每个 worker 指定各自的目录（JOBDIR/worker-N），Bloom 过滤器文件不会互相覆盖
 JOBDIR = "crawls/universal-1"
 
+# 待爬请求保存在 SQLite frontier 中（见 frontier.py），不再使用 JOBDIR 下的 pickle 磁盘队列
+SCHEDULER = "singbox_crawler.frontier.FrontierScheduler"
+FRONTIER_DB_PATH = None  # 默认与爬虫数据库相同
+FRONTIER_DOMAIN_DELAY = 0  # 多个爬虫进程共享 frontier 时，同一域名两次取请求的最小间隔
+FRONTIER_BATCH = 8
+# 入队的请求先缓冲在内存中，由线程池按批写入 frontier（间隔秒数 / 立即写入的缓冲大小）
+FRONTIER_FLUSH_INTERVAL = 0.5
+FRONTIER_FLUSH_SIZE = 500
+# frontier 分区：每个进程只取出本分区的请求，多 worker 模式下由 service_launcher 设置为 worker-N
+FRONTIER_SCOPE = ""
+
+# 请求去重：多代 Bloom 过滤器代替无限增长的 requests.seen（见 dupefilter.py）
+# 指纹在 (GENERATIONS - 1) 到 GENERATIONS 个 GENERATION_SEC 之后被遗忘，来源可以重新爬取
+DUPEFILTER_CLASS = "singbox_crawler.dupefilter.BloomDupeFilter"
+BLOOM_DUPEFILTER_PATH = None  # 默认 JOBDIR/requests.bloom
+BLOOM_DUPEFILTER_CAPACITY = 1_000_000  # 每代容量，写满时提前开始新一代
+BLOOM_DUPEFILTER_ERROR_RATE = 0.001
+BLOOM_DUPEFILTER_GENERATION_SEC = 2 * 3600
+BLOOM_DUPEFILTER_GENERATIONS = 3
+
+# 多 worker 模式：每个爬虫进程通过 sources 表上的租约分批领取到期源并定期续约，
+# 成功爬取后释放；进程崩溃后租约过期，源由其他 worker 重新领取
+SOURCE_LEASE_ENABLED = getattr(config, "crawler_source_leases_enabled", False)
+SOURCE_LEASE_BATCH = 20  # 每次领取的源数量，爬虫空闲时领取下一批
+SOURCE_LEASE_SEC = 600  # 租约有效期，每 1/3 有效期续约一次
+
+# 爬虫对 sources 表的写入（统计、新链接、租约释放）在内存中合并，由写入线程按该间隔批量提交
+SOURCE_WRITER_FLUSH_INTERVAL = 1.0
+# 链接发现：内存中记录最近见过的规范化链接数，重复链接不再写入数据库
+LINK_SEEN_SIZE = 100_000
+# 内容去重：响应体（及 Base64 解码结果）的 blake2b 摘要在 TTL 内再次出现时跳过提取，只记录来源与内容的关联
+CONTENT_DEDUP_ENABLED = True
+CONTENT_DEDUP_TTL_HOURS = 24
+CONTENT_DEDUP_MEMORY_SIZE = 50_000
+
 # 爬取限制
 DEPTH_LIMIT = 3
 # CONCURRENT_REQUESTS = getattr(config, 'crawler_max_concurrent_requests', 5)
@@ -37,6 +73,18 @@ RETRY_TIMES = getattr(config, "crawler_retry_times", 2)
 # Exponential backoff
 RETRY_BACKOFF_FACTOR = getattr(config, "crawler_retry_backoff_factor", 2)
 
+# 下载大小上限（字节）：超过上限的下载被取消，避免单个超大页面占满内存
+DOWNLOAD_MAXSIZE = 32 * 1024 * 1024
+DOWNLOAD_WARNSIZE = 8 * 1024 * 1024
+# 按来源类型覆盖下载上限（类型见 UniversalSpider.source_type），未列出的类型使用 DOWNLOAD_MAXSIZE
+DOWNLOAD_MAXSIZE_BY_SOURCE_TYPE = {
+    "subscription": 32 * 1024 * 1024,
+    "telegram": 4 * 1024 * 1024,
+    "github": 4 * 1024 * 1024,
+    "search": 2 * 1024 * 1024,
+    "default": 8 * 1024 * 1024,
+}
+
 # Memory Limit (Scrapy built-in)
 # Scrapy will close the spider if memory usage exceeds this.
 # NSSM or our launcher will then restart it.
@@ -60,17 +108,50 @@ MAIL_SSL = False
 # --- 智能代理配置 ---
 # 用户本地代理地址
 PROXY_URL = "http://127.0.0.1:12334"
+# 额外的代理出口 {名称: 地址}，与 PROXY_URL 和直连一起参与按域名的路径选择
+PROXY_URLS = {}
+# 按域名学习的路由表（见 routing.py），状态在重启之间保留
+ROUTING_STATE_PATH = "crawls/routing_state.json"
+ROUTING_EXPLORE_RATE = 0.05  # 随机尝试非最优路径的概率
+ROUTING_MAX_DOMAINS = 20000  # 路由表最多保留的域名数，超出时淘汰最久未使用的域名
+ROUTING_TIMEOUT_FACTOR = 4  # 已知延迟的路径下载超时为 延迟 × 该系数（不超过 DOWNLOAD_TIMEOUT）
+
+# 代理池：用数据库中已验证的节点启动本地 sing-box 入站，限速严重的域名在这些出口之间轮换
+PROXY_POOL_ENABLED = getattr(config, "crawler_proxy_pool_enabled", False)
+PROXY_POOL_SIZE = getattr(config, "crawler_proxy_pool_size", 20)
+PROXY_POOL_DOMAINS = [
+    "github.com",
+    "google.com",
+    "bing.com",
+]
+PROXY_POOL_MAX_FAILURES = 3  # 端点连续失败多少次后剔除
+PROXY_POOL_MAX_RETRIES = 2  # 单个请求最多换几个端点重试
+PROXY_POOL_REFILL_INTERVAL = 60  # 检查是否需要补充的间隔（秒）
+PROXY_POOL_SINGBOX_BINARY = None  # 默认 singbox_test/sing-box
 
 DOWNLOADER_MIDDLEWARES = {
     # 启用scrapy-user-agents中间件，用于生成随机User-Agent
     "scrapy_user_agents.middlewares.RandomUserAgentMiddleware": 400,
     # 移除默认的User-Agent中间件
     "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
-    # 暂时禁用代理中间件，因为代理连接不稳定
-    # "singbox_crawler.middlewares.SmartProxyMiddleware": 100,
-    # "scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware": 110,
+    # 代理中间件按域名学习直连 / 代理的成功率和延迟，代理不稳定时会自动偏向直连
+    "singbox_crawler.middlewares.ProxyPoolMiddleware": 95,
+    "singbox_crawler.middlewares.SmartProxyMiddleware": 100,
+    "scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware": 110,
 }
 
+# HTTP 录制 / 回放（见 http_archive.py），默认关闭时直接使用 Scrapy 的 HTTP 下载处理器
+DOWNLOAD_HANDLERS = {
+    "http": "singbox_crawler.http_archive.ArchiveDownloadHandler",
+    "https": "singbox_crawler.http_archive.ArchiveDownloadHandler",
+}
+HTTP_ARCHIVE_MODE = ""  # "record" 或 "replay"
+HTTP_ARCHIVE_PATH = None  # 默认 tmp/http_archive.db
+HTTP_ARCHIVE_LATENCY_MS = 0  # 回放时每个响应的固定延迟
+HTTP_ARCHIVE_LATENCY_JITTER_MS = 0  # 回放时额外的随机延迟上限
+HTTP_ARCHIVE_LATENCY_SCALE = 0  # 回放时按录制耗时的倍数加入延迟（0 表示忽略录制耗时）
+HTTP_ARCHIVE_SEED = 0  # 随机延迟的种子，保证多次回放一致
+
 # 配置scrapy-user-agents
 # 使用现代浏览器的User-Agent
 RANDOM_UA_TYPE = "random"
@@ -87,8 +168,36 @@ EXTENSIONS = {
     "scrapy.extensions.memusage.MemoryUsage": 50,
     "scrapy.extensions.corestats.CoreStats": 500,
     "scrapy.extensions.closespider.CloseSpider": 500,
+    "singbox_crawler.extensions.MetricsExtension": 600,
+    "singbox_crawler.extensions.MemoryDrainExtension": 610,
+    "singbox_crawler.extensions.ProfilingExtension": 620,
+    "singbox_crawler.extensions.CpuPacingExtension": 630,
 }
 
+# 按 service_launcher 给出的运行比例在反应器中让出 CPU（代替挂起进程）
+CPU_PACING_ENABLED = True
+
+# 指标端点与 P99 告警
+METRICS_ENABLED = getattr(config, "monitoring_metrics_enabled", True)
+METRICS_PORT = getattr(config, "monitoring_metrics_port", 9410)
+METRICS_P99_LIMIT_SEC = getattr(config, "monitoring_p99_response_limit_sec", 2)
+METRICS_ALERT_MAIL = MEMUSAGE_NOTIFY_MAIL
+
+# 内存诊断与排空：超过跟踪阈值后开始 tracemalloc 跟踪，接近上限时写快照并停止跟踪，
+# 达到排空阈值或 supervisor 请求时优雅关闭
+MEMDIAG_ENABLED = True
+MEMDIAG_LIMIT_MB = MEMUSAGE_LIMIT_MB
+MEMDIAG_TRACE_RATIO = 0.7
+MEMDIAG_SNAPSHOT_RATIO = 0.9
+MEMDIAG_DRAIN_RATIO = 0.95
+MEMDIAG_CHECK_INTERVAL = 5
+MEMDIAG_TRACEMALLOC_FRAMES = getattr(config, "service_tracemalloc_frames", 1)
+
+# 按阶段的性能分析（见 profiling.py），也可以通过 service_launcher.py --profile 或 SIGUSR2 开启
+PROFILE_STAGES = getattr(config, "monitoring_profile_stages", "")
+PROFILE_MODE = getattr(config, "monitoring_profile_mode", "sample")
+PROFILE_DURATION_SEC = getattr(config, "monitoring_profile_duration_sec", 60)
+
 # 爬虫运行时间限制（秒）
 CLOSESPIDER_TIMEOUT = 300  # 5分钟
 CLOSESPIDER_ITEMCOUNT = None  # 不限制爬取的项目数
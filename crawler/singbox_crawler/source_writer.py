@@ -0,0 +1,242 @@
+"""
+爬虫的 sources 表写入线程
+解析回调在 Twisted 反应器线程中运行，不能等待 SQLite（锁等待和重试可能长达数秒）。
+爬虫只把操作记入内存中的合并缓冲，由单独的线程定期在一个事务中批量写入：
+- 同一来源的多次成功 / 失败统计合并为一次 UPDATE（计数累加，失败计数按最后一次成功后的失败数计算）；
+- 新发现的链接去重后用一次 executemany 插入；
+- 删除标记和租约释放在统计更新之后执行，其他 worker 不会在爬取时间写入前领取到刚释放的源；
+- 来源与内容哈希的关联（见 content_dedup.py）按 (来源, 哈希) 合并。
+写入失败时缓冲保留到下一次刷新，关闭时最后刷新一次。
+"""
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+from . import metrics, profiling
+
+SOURCE_WRITER_FLUSH_INTERVAL = 1.0  # 最长多少秒写入一次
+SOURCE_WRITER_MAX_PENDING = 5000  # 缓冲中的新链接超过该数量时提前写入
+
+db_flush_latency = metrics.histogram(
+    "db_flush_seconds", "Latency of database writes", ["writer"]
+)
+source_writer_pending = metrics.gauge(
+    "source_writer_pending", "Source updates waiting for the writer thread"
+)
+
+
+def _merge_stats(older, newer):
+    """合并同一来源先后两段的统计 [成功次数, 最后一次成功后的失败次数, 最后成功时间]"""
+    if newer[0]:
+        return [older[0] + newer[0], newer[1], newer[2]]
+    return [older[0], older[1] + newer[1], older[2]]
+
+
+class SourceWriter:
+    def __init__(
+        self,
+        db_path,
+        flush_interval=SOURCE_WRITER_FLUSH_INTERVAL,
+        max_pending=SOURCE_WRITER_MAX_PENDING,
+    ):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.written = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._new_sources = {}  # url -> added_at
+        self._stats = {}  # url -> [成功次数, 失败次数, 最后成功时间]
+        self._deleted = set()
+        self._released = {}  # url -> lease owner
+        self._content = {}  # (url, 内容哈希) -> [产出资源数, 次数, 时间]
+        self._thread = threading.Thread(
+            target=self._run, name="SourceWriter", daemon=True
+        )
+        self._started = False
+        self.logger = logging.getLogger(__name__)
+        source_writer_pending.set_function(self.pending)
+
+    def start(self):
+        if not self._started:
+            self._thread.start()
+            self._started = True
+        return self
+
+    def close(self):
+        """停止写入线程，保证缓冲中剩余的更新全部写入"""
+        if not self._started:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._started = False
+
+    def pending(self):
+        return (
+            len(self._new_sources)
+            + len(self._stats)
+            + len(self._deleted)
+            + len(self._released)
+            + len(self._content)
+        )
+
+    # ---- 由反应器线程调用，只修改内存缓冲 ----
+
+    def add_source(self, url):
+        if not url or not url.startswith("http"):
+            return
+        with self._lock:
+            self._new_sources.setdefault(url, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            if len(self._new_sources) >= self.max_pending:
+                self._wakeup.set()
+
+    def update_stats(self, url, is_success):
+        if is_success:
+            update = [1, 0, datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
+        else:
+            update = [0, 1, None]
+        with self._lock:
+            current = self._stats.get(url)
+            self._stats[url] = _merge_stats(current, update) if current else update
+
+    def mark_deleted(self, url):
+        with self._lock:
+            self._deleted.add(url)
+
+    def release_source(self, url, owner):
+        with self._lock:
+            self._released[url] = owner
+
+    def link_content(self, url, digest, items):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            current = self._content.get((url, digest))
+            if current:
+                current[0] = items
+                current[1] += 1
+                current[2] = now
+            else:
+                self._content[(url, digest)] = [items, 1, now]
+
+    # ---- 写入线程 ----
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            while not self._stop.is_set():
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self._flush(conn)
+        finally:
+            # 退出前最后一次刷新
+            if not self._flush(conn):
+                self.logger.error(f"Dropped {self.pending()} source updates on shutdown")
+            conn.close()
+
+    def _take(self):
+        with self._lock:
+            batch = (self._new_sources, self._stats, self._deleted, self._released, self._content)
+            self._new_sources, self._stats, self._released, self._content = {}, {}, {}, {}
+            self._deleted = set()
+        return batch
+
+    def _restore(self, batch):
+        """写入失败时把取出的更新放回缓冲，排在之后产生的更新之前"""
+        new_sources, stats, deleted, released, content = batch
+        with self._lock:
+            for url, added_at in new_sources.items():
+                self._new_sources.setdefault(url, added_at)
+            for url, older in stats.items():
+                newer = self._stats.get(url)
+                self._stats[url] = _merge_stats(older, newer) if newer else older
+            self._deleted |= deleted
+            for url, owner in released.items():
+                self._released.setdefault(url, owner)
+            for key, (items, hits, seen_at) in content.items():
+                newer = self._content.get(key)
+                if newer:
+                    newer[1] += hits
+                else:
+                    self._content[key] = [items, hits, seen_at]
+
+    def _flush(self, conn):
+        """写入缓冲中的全部更新，返回是否成功"""
+        batch = self._take()
+        count = sum(len(part) for part in batch)
+        if not count:
+            return True
+        try:
+            with db_flush_latency.labels("crawler_sources").time(), profiling.stage("db"), conn:
+                self._write_batch(conn, *batch)
+            self.written += count
+            return True
+        except sqlite3.Error as e:
+            self.logger.warning(f"Failed to write {count} source updates, will retry: {e}")
+            self._restore(batch)
+            return False
+
+    def _write_batch(self, conn, new_sources, stats, deleted, released, content):
+        conn.executemany(
+            "INSERT OR IGNORE INTO sources (url, added_at) VALUES (?, ?)",
+            list(new_sources.items()),
+        )
+        conn.executemany(
+            """
+            UPDATE sources
+            SET success_count = success_count + ?,
+                last_crawl_time = ?,
+                last_attempt_time = ?,
+                fail_count = ?
+            WHERE url = ?
+        """,
+            [(s, last, last, f, url) for url, (s, f, last) in stats.items() if s],
+        )
+        # 只失败的来源记录尝试时间，下一个爬取间隔之前不再领取
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn.executemany(
+            "UPDATE sources SET fail_count = fail_count + ?, last_attempt_time = ? WHERE url = ?",
+            [(f, now, url) for url, (s, f, last) in stats.items() if not s],
+        )
+        conn.executemany(
+            "UPDATE sources SET status = 'deleted' WHERE url = ?",
+            [(url,) for url in deleted],
+        )
+        conn.executemany(
+            """
+            UPDATE sources SET lease_owner = NULL, leased_until = NULL
+            WHERE url = ? AND lease_owner = ?
+        """,
+            list(released.items()),
+        )
+        conn.executemany(
+            """
+            INSERT INTO content_hashes (hash, first_source, items, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(hash) DO UPDATE SET
+                items = MAX(items, excluded.items),
+                last_seen = excluded.last_seen
+        """,
+            [
+                (digest, url, items, seen_at, seen_at)
+                for (url, digest), (items, hits, seen_at) in content.items()
+            ],
+        )
+        conn.executemany(
+            """
+            INSERT INTO source_content (source_url, hash, items, hits, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(source_url, hash) DO UPDATE SET
+                items = excluded.items,
+                hits = hits + excluded.hits,
+                last_seen = excluded.last_seen
+        """,
+            [
+                (url, digest, items, hits, seen_at, seen_at)
+                for (url, digest), (items, hits, seen_at) in content.items()
+            ],
+        )
@@ -1,11 +1,33 @@
-import re
+import os
+import socket
 from datetime import datetime
+from urllib.parse import urlparse
 
-import pybase64
 import scrapy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet import task, threads
 
+from .. import profiling
+from ..content_dedup import (
+    CONTENT_DEDUP_MEMORY_SIZE,
+    CONTENT_DEDUP_TTL_HOURS,
+    ContentIndex,
+    content_hash,
+)
 from ..database import Database
 from ..items import SingboxResourceItem
+from ..link_discovery import LINK_SEEN_SIZE, LinkDiscovery
+from ..scanning import (
+    StreamScanner,
+    base64_digest,
+    compile_patterns,
+    decode_base64_chunks,
+    iter_chunks,
+    looks_like_base64,
+    response_encoding,
+)
+from ..source_writer import SOURCE_WRITER_FLUSH_INTERVAL, SourceWriter
 
 
 class UniversalSpider(scrapy.Spider):
@@ -24,7 +46,8 @@ class UniversalSpider(scrapy.Spider):
 
     PROTOCOL_PATTERNS = {
         # ss://base64(加密方式:密码)@服务器:端口#备注 或 ss://加密方式:密码@服务器:端口#备注
-        "ss": r'ss://[a-zA-Z0-9+/=]{20,}(?:#[^ \n\r\t<>"]+)?|ss://[^ \s:@]+:[^ \s:@]+@[^ \s:@]+:[0-9]+(?:#[^ \n\r\t<>"]+)?',
+        # （前面不能紧跟字母数字，避免匹配到 vmess:// 链接的后半部分）
+        "ss": r'(?<![a-z0-9])ss://[a-zA-Z0-9+/=]{20,}(?:#[^ \n\r\t<>"]+)?|(?<![a-z0-9])ss://[^ \s:@]+:[^ \s:@]+@[^ \s:@]+:[0-9]+(?:#[^ \n\r\t<>"]+)?',
         # ssr://base64编码的完整链接，长度通常较长
         "ssr": r'ssr://[a-zA-Z0-9+/=]{50,}(?:#[^ \n\r\t<>"]+)?',
         # vmess://base64编码的完整配置
@@ -49,86 +72,276 @@ class UniversalSpider(scrapy.Spider):
         "singbox_sub": r'https?://[^ \s<>"]+\.json(?:\?[^ \s<>"]+)?',
     }
 
-    def __init__(self, *args, **kwargs):
+    # 直接在响应体字节上匹配的正则（见 scanning.py）
+    _SCAN_PATTERNS = compile_patterns(PROTOCOL_PATTERNS)
+
+    # 按来源类型限制下载大小（DOWNLOAD_MAXSIZE_BY_SOURCE_TYPE），未列出的类型使用 DOWNLOAD_MAXSIZE
+    SOURCE_TYPE_HOSTS = (
+        ("search", ("www.google.com", "www.bing.com")),
+        ("telegram", ("t.me",)),
+        ("subscription", ("raw.githubusercontent.com", "gist.githubusercontent.com")),
+        ("github", ("github.com",)),
+    )
+    SUBSCRIPTION_SUFFIXES = (".txt", ".yaml", ".yml", ".json", ".conf")
+
+    # 常驻服务中每轮都会重新创建爬虫，初始种子每个进程只需入库一次
+    _initial_sources_added = False
+
+    def __init__(self, *args, skip_initial_sources=False, **kwargs):
         super(UniversalSpider, self).__init__(*args, **kwargs)
         self.db = Database()
+        # 离线压测等场景不导入内置种子（-a skip_initial_sources=1）
+        self.skip_initial_sources = str(skip_initial_sources).lower() in ("1", "true", "yes")
         # 确保初始种子入库
-        for url in self.INITIAL_SOURCES:
-            self.db.add_source(url)
+        if not self.skip_initial_sources and not UniversalSpider._initial_sources_added:
+            for url in self.INITIAL_SOURCES:
+                self.db.add_source(url)
+            UniversalSpider._initial_sources_added = True
+        # 多 worker 模式下的租约持有者，None 表示单进程模式
+        self.lease_owner = None
+        self.lease_heartbeat = None
+        # 空闲时的领取在线程中进行：是否有领取正在进行、上一次领取是否已经没有到期源
+        self.claiming = False
+        self.sources_exhausted = False
+        # sources 表的写入接口；通过 crawler 运行时换成写入线程（见 from_crawler），反应器线程不等待 SQLite
+        self.sources = _DirectSourceWriter(self.db)
+        self.link_discovery = LinkDiscovery()
+        # 最近处理过的内容哈希，None 表示不去重（不通过 crawler 直接调用 parse 时）
+        self.content_index = None
+        self.maxsize_by_source_type = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(UniversalSpider, cls).from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        spider.sources = SourceWriter(
+            spider.db.db_path,
+            flush_interval=settings.getfloat(
+                "SOURCE_WRITER_FLUSH_INTERVAL", SOURCE_WRITER_FLUSH_INTERVAL
+            ),
+        ).start()
+        spider.link_discovery = LinkDiscovery(
+            seen_size=settings.getint("LINK_SEEN_SIZE", LINK_SEEN_SIZE)
+        )
+        spider.maxsize_by_source_type = settings.getdict("DOWNLOAD_MAXSIZE_BY_SOURCE_TYPE")
+        if settings.getbool("CONTENT_DEDUP_ENABLED", True):
+            spider.content_index = ContentIndex(
+                ttl_hours=settings.getfloat("CONTENT_DEDUP_TTL_HOURS", CONTENT_DEDUP_TTL_HOURS),
+                memory_size=settings.getint("CONTENT_DEDUP_MEMORY_SIZE", CONTENT_DEDUP_MEMORY_SIZE),
+            )
+            loaded = spider.content_index.load(spider.db.db_path)
+            spider.logger.info(f"Loaded {loaded} recent content hashes")
+        crawler.signals.connect(spider.spider_closed, signal=signals.spider_closed)
+        if settings.getbool("SOURCE_LEASE_ENABLED"):
+            spider.lease_owner = f"{socket.gethostname()}:{os.getpid()}"
+            spider.lease_batch = settings.getint("SOURCE_LEASE_BATCH", 20)
+            spider.lease_sec = settings.getint("SOURCE_LEASE_SEC", 600)
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
 
     def start_requests(self):
         """Generate initial requests from database sources"""
-        # 仅爬取 6 小时内未爬取的活跃源，节省资源
-        urls = self.db.get_sources_to_crawl(interval_hours=6)
-        self.logger.info(f"Found {len(urls)} sources to crawl: {urls}")
-        if not urls:
-            # 强制爬取初始源，即使它们最近被爬取过
-            self.logger.info("Forcing crawl of initial sources...")
-            urls = self.INITIAL_SOURCES[:3]  # 只取前3个初始源，避免太多请求
+        if self.lease_owner:
+            # 多 worker 模式：只爬本 worker 领取到的源，空闲时再领取下一批
+            self.lease_heartbeat = task.LoopingCall(
+                threads.deferToThread,
+                self.db.renew_source_leases,
+                self.lease_owner,
+                self.lease_sec,
+            )
+            self.lease_heartbeat.start(self.lease_sec / 3, now=False)
+            urls = self.claim_sources()
+        else:
+            # 仅爬取 6 小时内未爬取的活跃源，节省资源
+            urls = self.db.get_sources_to_crawl(interval_hours=6)
+            self.logger.info(f"Found {len(urls)} sources to crawl: {urls}")
+            if not urls and not self.skip_initial_sources:
+                # 强制爬取初始源，即使它们最近被爬取过
+                self.logger.info("Forcing crawl of initial sources...")
+                urls = self.INITIAL_SOURCES[:3]  # 只取前3个初始源，避免太多请求
 
         for url in urls:
-            yield scrapy.Request(
-                url=url,
-                callback=self.parse,
-                errback=self.handle_error,
-                meta={"handle_httpstatus_list": [404], "is_start_url": True},
-            )
+            yield self.source_request(url)
+
+    def source_request(self, url):
+        meta = {"handle_httpstatus_list": [404], "is_start_url": True, "source_url": url}
+        if self.lease_owner:
+            # 租约由领取者释放：frontier 中的请求可能在本 worker 重启后（进程号不同）才被取出
+            meta["lease_owner"] = self.lease_owner
+        maxsize = self.maxsize_by_source_type.get(self.source_type(url))
+        if maxsize:
+            # 超过上限的响应由下载器取消，按爬取失败处理
+            meta["download_maxsize"] = int(maxsize)
+        return scrapy.Request(
+            url=url,
+            callback=self.parse,
+            errback=self.handle_error,
+            meta=meta,
+        )
+
+    @classmethod
+    def source_type(cls, url):
+        parsed = urlparse(url)
+        host = (parsed.hostname or "").lower()
+        for source_type, hosts in cls.SOURCE_TYPE_HOSTS:
+            if host in hosts:
+                return source_type
+        if parsed.path.lower().endswith(cls.SUBSCRIPTION_SUFFIXES):
+            return "subscription"
+        return "default"
+
+    def claim_sources(self):
+        urls = self.db.claim_sources(
+            self.lease_owner, self.lease_batch, interval_hours=6, lease_sec=self.lease_sec
+        )
+        self.logger.info(f"{self.lease_owner} claimed {len(urls)} sources: {urls}")
+        return urls
+
+    def spider_idle(self, spider):
+        """空闲时在线程中领取下一批源，领取期间保持爬虫运行；上一次领取为空时允许关闭"""
+        if self.sources_exhausted and not self.claiming:
+            return
+        if not self.claiming:
+            self.claiming = True
+            d = threads.deferToThread(self.claim_sources)
+            d.addCallbacks(self._schedule_claimed, self._claim_failed)
+        raise DontCloseSpider
+
+    def _schedule_claimed(self, urls):
+        self.claiming = False
+        self.sources_exhausted = not urls
+        for url in urls:
+            self.crawler.engine.crawl(self.source_request(url))
+
+    def _claim_failed(self, failure):
+        self.claiming = False
+        # 领取失败时按没有到期源处理，下一次空闲时关闭，由下一轮爬取重新领取
+        self.sources_exhausted = True
+        self.logger.error(f"Failed to claim sources: {failure.value}")
+
+    def spider_closed(self, spider):
+        if self.lease_heartbeat and self.lease_heartbeat.running:
+            self.lease_heartbeat.stop()
+        # 在线程中刷新剩余的 sources 更新，之后再释放租约（爬取时间先于租约释放写入）
+        return threads.deferToThread(self._close_sources)
+
+    def _close_sources(self):
+        self.sources.close()
+        if self.lease_owner:
+            released = self.db.release_source_leases(self.lease_owner)
+            if released:
+                self.logger.info(f"Released {released} unfinished source leases")
 
     def parse(self, response):
+        # 按阶段分析时只统计解析本身，不包括 Scrapy 在两次 next() 之间处理的其他请求
+        yield from profiling.profiled_iter("parse", self._parse(response))
+
+    def _parse(self, response):
         # 1. 专门处理 404 (页面不存在)
         if response.status == 404:
             self.logger.warning(f"404 Not Found, removing source: {response.url}")
-            self.db.mark_source_deleted(response.url)
+            self.sources.mark_deleted(response.url)
             return
 
         # 2. 标记爬取成功
-        self.db.update_source_stats(response.url, is_success=True)
-
-        # 3. 提取内容
-        raw_content = response.text
-
-        # 提取资源
-        yield from self.extract_from_text(raw_content, response.url)
-
-        # 尝试 Base64 解码提取
-        try:
-            clean_content = "".join(raw_content.split())
-            if len(clean_content) > 20 and all(
-                c in "A-Za-z0-9+/=" for c in clean_content[:20]
-            ):
-                decoded = pybase64.b64decode(clean_content).decode(
-                    "utf-8", errors="ignore"
+        self.sources.update_stats(response.url, is_success=True)
+        # 与爬取时间在同一批写入中释放租约（失败的源保留租约直到本 worker 结束，避免在本轮中反复重试）
+        if self.lease_owner:
+            self.sources.release_source(
+                response.meta.get("source_url", response.url),
+                response.meta.get("lease_owner") or self.lease_owner,
+            )
+
+        # 3. 提取资源：按块扫描响应体字节，不把整个响应体转换为 str
+        # 镜像来源返回的相同内容只提取一次，重复时 Base64 解码也一并跳过
+        body = response.body
+        digest = content_hash(body) if self.content_index is not None and body else None
+        is_new = yield from self._extract_new(
+            digest, lambda: iter_chunks(body), response.url, response_encoding(response)
+        )
+
+        # 尝试 Base64 增量解码提取（不同写法的 Base64 可能解码为相同内容，同样按哈希去重）
+        if is_new and looks_like_base64(body):
+            try:
+                digest = base64_digest(iter_chunks(body)) if self.content_index is not None else None
+                yield from self._extract_new(
+                    digest, lambda: decode_base64_chunks(iter_chunks(body)), response.url
                 )
-                yield from self.extract_from_text(decoded, response.url)
-        except:
-            pass
+            except ValueError:
+                pass
 
-        # 4. 发现新链接（自动扩充种子库）
+        # 4. 发现新链接（自动扩充种子库），规范化后只把最近没见过的链接交给写入线程
         if response.headers.get("Content-Type", b"").startswith(b"text/html"):
-            links = response.css("a::attr(href)").getall()
-            for link in links:
-                absolute_url = response.urljoin(link)
-                if absolute_url.startswith("http") and any(
-                    d in absolute_url
-                    for d in ["github.com", "t.me", "blogspot", "v2ray", "free"]
-                ):
-                    if not any(
-                        ext in absolute_url for ext in [".png", ".jpg", ".css", ".js"]
-                    ):
-                        self.db.add_source(absolute_url)
+            for url in self.link_discovery.discover(response):
+                self.sources.add_source(url)
+
+    def _extract_new(self, digest, chunks, source_url, encoding="utf-8"):
+        """
+        摘要为 digest 的内容最近没有处理过时从 chunks() 的字节块中提取资源并返回 True；
+        处理过时只记录来源与已有内容的关联（来源归属和产出统计），返回 False。digest 为 None 时不去重
+        """
+        if digest is None:
+            yield from self.extract_from_chunks(chunks(), source_url, encoding)
+            return True
+        entry = self.content_index.lookup(digest)
+        if entry is not None:
+            self.sources.link_content(source_url, digest, entry[1])
+            self.crawler.stats.inc_value("content_dedup/skipped", spider=self)
+            return False
+        entry = self.content_index.add(digest, source_url)
+        for item in self.extract_from_chunks(chunks(), source_url, encoding):
+            entry[1] += 1
+            yield item
+        self.sources.link_content(source_url, digest, entry[1])
+        return True
 
     def extract_from_text(self, text, source_url):
-        for proto, pattern in self.PROTOCOL_PATTERNS.items():
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            for match in matches:
-                item = SingboxResourceItem()
-                item["url"] = match.strip()
-                item["protocol"] = proto
-                item["source"] = source_url
-                item["crawl_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                yield item
+        if isinstance(text, str):
+            text = text.encode("utf-8")
+        return self.extract_from_chunks(iter_chunks(text), source_url)
+
+    def extract_from_chunks(self, chunks, source_url, encoding="utf-8"):
+        """在字节块序列上提取资源，内存占用与块大小有关，与内容总大小无关"""
+        scanner = StreamScanner(self._SCAN_PATTERNS)
+        for chunk in chunks:
+            yield from self._items(scanner.feed(chunk), source_url, encoding)
+        yield from self._items(scanner.finish(), source_url, encoding)
+
+    def _items(self, matches, source_url, encoding):
+        if not matches:
+            return
+        crawl_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for proto, match in matches:
+            item = SingboxResourceItem()
+            item["url"] = match.decode(encoding, errors="ignore").strip()
+            item["protocol"] = proto
+            item["source"] = source_url
+            item["crawl_time"] = crawl_time
+            yield item
 
     def handle_error(self, failure):
         url = failure.request.url
         self.logger.error(f"Network error on {url}: {str(failure.value)}")
-        self.db.update_source_stats(url, is_success=False)
+        self.sources.update_stats(url, is_success=False)
+
+
+class _DirectSourceWriter:
+    """与 SourceWriter 接口相同、同步写入数据库的实现（不通过 crawler 直接调用 parse 时使用，例如基准测试）"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def add_source(self, url):
+        self.db.add_source(url)
+
+    def update_stats(self, url, is_success):
+        self.db.update_source_stats(url, is_success)
+
+    def mark_deleted(self, url):
+        self.db.mark_source_deleted(url)
+
+    def release_source(self, url, owner):
+        self.db.release_source(url, owner)
+
+    def close(self):
+        pass
@@ -0,0 +1,230 @@
+"""
+基于 SQLite 的持久化工作队列
+流水线（scripts/run_pipeline.py）启动时在 resources 表上安装触发器，之后新插入的资源自动放入 geo 阶段，
+geo 完成后进入 test 阶段；不运行流水线时不安装触发器，爬虫入库的资源不会在队列中堆积。
+各阶段的 worker 通过带过期时间的租约领取任务，进程崩溃后租约到期会被重新领取。
+"""
+import sqlite3
+from datetime import datetime, timedelta
+
+STAGE_GEO = "geo"
+STAGE_TEST = "test"
+
+
+def location_stage(location):
+    """按测试位置区分的 test 阶段，每个位置各自领取和完成自己的任务"""
+    return f"{STAGE_TEST}@{location}"
+
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def ensure_schema(conn, enqueue_new_resources=False):
+    """创建队列表和索引，enqueue_new_resources 时同时创建 resources 插入触发器（可重复调用）"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS work_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            resource_id INTEGER,
+            stage TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            available_at TEXT,
+            lease_owner TEXT,
+            leased_until TEXT,
+            last_error TEXT,
+            created_at TEXT,
+            UNIQUE (resource_id, stage)
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_work_queue_poll ON work_queue(stage, status, available_at)"
+    )
+    if not enqueue_new_resources:
+        return
+    # 新资源入库即入队，不需要再扫描整张 resources 表
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_resources_enqueue_geo
+        AFTER INSERT ON resources
+        BEGIN
+            INSERT OR IGNORE INTO work_queue (resource_id, stage, available_at, created_at)
+            VALUES (NEW.id, '{STAGE_GEO}', datetime('now', 'localtime'), datetime('now', 'localtime'));
+        END
+    """
+    )
+
+
+def drop_trigger(conn):
+    """删除 resources 插入触发器（不再运行流水线时使用）"""
+    conn.execute("DROP TRIGGER IF EXISTS trg_resources_enqueue_geo")
+
+
+class WorkQueue:
+    def __init__(self, db_path, enqueue_new_resources=False):
+        self.db_path = db_path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            ensure_schema(conn, enqueue_new_resources)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # 每次调用使用独立连接，可以在任意线程中使用
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _now():
+        return datetime.now().strftime(TIME_FORMAT)
+
+    def enqueue(self, conn, resource_id, stage, delay_sec=0):
+        """在调用方的事务中把资源放入指定阶段"""
+        available_at = (datetime.now() + timedelta(seconds=delay_sec)).strftime(
+            TIME_FORMAT
+        )
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO work_queue (resource_id, stage, available_at, created_at)
+            VALUES (?, ?, ?, ?)
+        """,
+            (resource_id, stage, available_at, self._now()),
+        )
+
+    def backfill(self, stage, where="1 = 1", params=(), dead_before=None):
+        """
+        把已有资源补充入队（切换到队列模式时，或按位置测试的 worker 定期补充到期资源）
+        dead_before 不为空时，符合条件且在该时间之前被标记为 dead 的任务重置为待处理，
+        否则 (resource_id, stage) 上的唯一约束会让这些资源永远无法再次入队
+        """
+        conn = self._connect()
+        try:
+            now = self._now()
+            conn.execute("BEGIN IMMEDIATE")
+            reset = 0
+            if dead_before:
+                reset = conn.execute(
+                    f"""
+                    UPDATE work_queue
+                    SET status = 'pending', attempts = 0, available_at = ?, last_error = NULL
+                    WHERE stage = ? AND status = 'dead' AND available_at < ?
+                    AND resource_id IN (SELECT id FROM resources WHERE {where})
+                """,
+                    (now, stage, dead_before, *params),
+                ).rowcount
+            cursor = conn.execute(
+                f"""
+                INSERT OR IGNORE INTO work_queue (resource_id, stage, available_at, created_at)
+                SELECT id, ?, ?, ? FROM resources WHERE {where}
+            """,
+                (stage, now, now, *params),
+            )
+            conn.execute("COMMIT")
+            return reset + cursor.rowcount
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, stage, owner, limit, lease_sec=300):
+        """
+        原子地领取最多 limit 个到期任务，返回 [(queue_id, resource_id, attempts)]
+        未完成且租约已过期的任务会被重新领取
+        """
+        if limit <= 0:
+            return []
+        now = self._now()
+        leased_until = (datetime.now() + timedelta(seconds=lease_sec)).strftime(
+            TIME_FORMAT
+        )
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                """
+                SELECT id, resource_id, attempts FROM work_queue
+                WHERE stage = ?
+                AND ((status = 'pending' AND available_at <= ?)
+                     OR (status = 'leased' AND leased_until < ?))
+                ORDER BY available_at
+                LIMIT ?
+            """,
+                (stage, now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                """
+                UPDATE work_queue
+                SET status = 'leased', lease_owner = ?, leased_until = ?, attempts = attempts + 1
+                WHERE id = ?
+            """,
+                [(owner, leased_until, row[0]) for row in rows],
+            )
+            conn.execute("COMMIT")
+            return [(row[0], row[1], row[2] + 1) for row in rows]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def complete(self, conn, queue_id, resource_id=None, next_stage=None):
+        """在调用方的事务中完成任务，并可选地进入下一阶段"""
+        conn.execute("DELETE FROM work_queue WHERE id = ?", (queue_id,))
+        if next_stage:
+            self.enqueue(conn, resource_id, next_stage)
+
+    def fail(self, queue_id, error, attempts, max_attempts=5, retry_delay_sec=60):
+        """任务失败：按指数退避重新排队，超过次数后标记为 dead（available_at 记录标记时间）"""
+        conn = self._connect()
+        try:
+            if attempts >= max_attempts:
+                conn.execute(
+                    """
+                    UPDATE work_queue
+                    SET status = 'dead', available_at = ?, last_error = ?, lease_owner = NULL
+                    WHERE id = ?
+                """,
+                    (self._now(), str(error)[:500], queue_id),
+                )
+            else:
+                available_at = (
+                    datetime.now()
+                    + timedelta(seconds=retry_delay_sec * 2 ** (attempts - 1))
+                ).strftime(TIME_FORMAT)
+                conn.execute(
+                    """
+                    UPDATE work_queue
+                    SET status = 'pending', available_at = ?, last_error = ?, lease_owner = NULL
+                    WHERE id = ?
+                """,
+                    (available_at, str(error)[:500], queue_id),
+                )
+        finally:
+            conn.close()
+
+    def depth(self, stage=None):
+        """各阶段未完成（待处理 + 已领取）的任务数"""
+        conn = self._connect()
+        try:
+            if stage:
+                return conn.execute(
+                    "SELECT COUNT(*) FROM work_queue WHERE stage = ? AND status != 'dead'",
+                    (stage,),
+                ).fetchone()[0]
+            return dict(
+                conn.execute(
+                    "SELECT stage, COUNT(*) FROM work_queue WHERE status != 'dead' GROUP BY stage"
+                ).fetchall()
+            )
+        finally:
+            conn.close()
+
+    def record_batch(self, conn, batch):
+        """作为 ResultWriter 的记录器使用：与测试结果同一事务中完成 test 阶段任务"""
+        conn.executemany(
+            "DELETE FROM work_queue WHERE id = ?",
+            [(r["queue_id"],) for r in batch if r.get("queue_id")],
+        )
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+按测试位置运行的测试 worker
+在不同地区的机器上各运行一个，共享同一个数据库（或定期同步 resource_measurements）。
+每个 worker 只消费自己位置的 test@<位置> 队列，定期把本位置在 interval_hours 内还没有测过的资源补充入队；
+结果只写入带 test_location 的延迟历史，不覆盖 resources 的全局状态（由 run_pipeline.py 负责）。
+各位置的结果由 singbox_test/location_matrix.py 合并为 资源 × 位置 矩阵。
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "crawler"))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "singbox_test"))
+from config import DATABASE_DB_PATH
+from run_pipeline import (
+    METRICS_PORT,
+    ROLLUP_INTERVAL_SEC,
+    StageWorker,
+    queue_depth,
+    rollup_measurements,
+    test_queued_resource,
+)
+from singbox_crawler import profiling
+from singbox_crawler.work_queue import TIME_FORMAT, WorkQueue, location_stage
+from test_resources import ResourceTester, start_metrics
+
+DB_PATH = DATABASE_DB_PATH
+
+# 默认参数
+CONCURRENCY = 5
+INTERVAL_HOURS = 6  # 每个资源在本位置的测试间隔
+REFILL_INTERVAL_SEC = 300  # 补充入队的检查间隔
+
+
+class LocationWorker:
+    def __init__(self, location=None, concurrency=CONCURRENCY, interval_hours=INTERVAL_HOURS):
+        self.queue = WorkQueue(DB_PATH)
+        self.interval_hours = interval_hours
+        self.tester = ResourceTester()
+        if location:
+            self.tester.current_location = location
+        self.location = self.tester.current_location
+        # 资源的全局状态由主流水线维护，这里只记录本位置的测量结果并完成本位置的任务
+        self.tester.writer.update_resources = False
+        self.tester.writer.recorders.append(self.queue)
+        self.tester.timeouts.load(self.tester.measurements)
+        self.stage = location_stage(self.location)
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.worker = StageWorker(
+            self.queue, self.stage, self.handle_test, concurrency, owner
+        )
+        queue_depth.labels(self.stage).set_function(
+            lambda: self.queue.depth(self.stage)
+        )
+
+    def handle_test(self, queue_id, resource_id):
+        test_queued_resource(self.queue, self.tester, queue_id, resource_id)
+
+    def enqueue_due(self):
+        """
+        把本位置在测试间隔内没有测量记录的节点放入本位置队列，返回入队数量
+        在一个测试间隔之前多次失败（dead）的任务重新入队
+        """
+        since = (datetime.now() - timedelta(hours=self.interval_hours)).strftime(
+            TIME_FORMAT
+        )
+        return self.queue.backfill(
+            self.stage,
+            "protocol NOT IN ('clash_sub', 'singbox_sub') AND NOT EXISTS ("
+            "SELECT 1 FROM resource_measurements m WHERE m.resource_id = resources.id "
+            "AND m.test_location = ? AND m.measured_at >= ?)",
+            (self.location, since),
+            dead_before=since,
+        )
+
+    def run(
+        self,
+        refill_interval=REFILL_INTERVAL_SEC,
+        metrics_port=METRICS_PORT,
+        rollup_interval=ROLLUP_INTERVAL_SEC,
+    ):
+        if metrics_port:
+            start_metrics(metrics_port)
+        self.tester.writer.start()
+        self.worker.start()
+        print(
+            f"测试位置 {self.location} 的 worker 已启动: 并发 {self.worker.concurrency}, "
+            f"测试间隔 {self.interval_hours} 小时"
+        )
+        last_refill = 0
+        last_rollup = time.monotonic()
+        try:
+            while True:
+                if time.monotonic() - last_refill >= refill_interval:
+                    added = self.enqueue_due()
+                    last_refill = time.monotonic()
+                    if added:
+                        print(f"[{self.stage}] 补充入队 {added} 个资源")
+                time.sleep(min(30, refill_interval))
+                print(
+                    f"[{self.stage}] 队列深度: {self.queue.depth(self.stage)} | "
+                    f"完成 {self.worker.processed} 失败 {self.worker.failed}"
+                )
+                if time.monotonic() - last_rollup >= rollup_interval:
+                    rollup_measurements(self.tester.measurements)
+                    last_rollup = time.monotonic()
+        except KeyboardInterrupt:
+            print("正在停止测试 worker...")
+        finally:
+            self.worker.stop()
+            self.tester.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按测试位置运行的 sing-box 测试 worker")
+    parser.add_argument(
+        "--location", help="测试位置名称（默认根据本机出口 IP 自动识别）"
+    )
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument(
+        "--interval-hours",
+        type=float,
+        default=INTERVAL_HOURS,
+        help="同一资源在本位置的重新测试间隔",
+    )
+    parser.add_argument(
+        "--refill-interval",
+        type=int,
+        default=REFILL_INTERVAL_SEC,
+        help="检查到期资源并补充入队的间隔（秒）",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=METRICS_PORT,
+        help="本地 /metrics 指标端点端口（0 表示不启用，和流水线在同一台机器上时需换一个端口）",
+    )
+    args = parser.parse_args()
+
+    profiling.install()
+
+    LocationWorker(
+        location=args.location,
+        concurrency=args.concurrency,
+        interval_hours=args.interval_hours,
+    ).run(refill_interval=args.refill_interval, metrics_port=args.metrics_port)
+
+
+if __name__ == "__main__":
+    main()
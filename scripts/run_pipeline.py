@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+事件驱动的资源处理流水线
+爬虫插入的新资源通过 work_queue 依次进入 geo（IP 地理位置解析）和 test（sing-box 测试）阶段，
+两个阶段的 worker 并发消费队列，各自有并发上限；test 阶段积压过多时 geo 阶段暂停领取（背压）。
+不再需要定期对 resources 全表重新扫描。
+"""
+import argparse
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 导入通用配置和各阶段的处理逻辑
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "crawler"))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "singbox_test"))
+from config import DATABASE_DB_PATH
+from update_server_region_fixed import (
+    extract_ip_from_url,
+    geo_api_latency,
+    get_geo_info_comprehensive,
+)
+from singbox_crawler import metrics, profiling
+from singbox_crawler.work_queue import STAGE_GEO, STAGE_TEST, WorkQueue, drop_trigger
+from test_resources import ResourceTester, start_metrics
+
+DB_PATH = DATABASE_DB_PATH
+
+# 默认参数
+GEO_CONCURRENCY = 4
+TEST_CONCURRENCY = 5
+MAX_TEST_BACKLOG = 500  # test 阶段积压超过该值时 geo 阶段暂停领取
+POLL_INTERVAL_SEC = 1.0  # 队列为空时的轮询间隔
+LEASE_SEC = 300  # 任务租约时长，超时未完成的任务会被重新领取
+METRICS_PORT = 9411  # 本地 /metrics 端点端口（爬虫使用 9410）
+ROLLUP_INTERVAL_SEC = 3600  # 延迟历史降采样和清理的间隔（保留期限只在降采样时执行）
+
+stage_processed = metrics.counter(
+    "pipeline_stage_processed_total", "Work items processed per stage", ["stage", "outcome"]
+)
+stage_latency = metrics.histogram(
+    "pipeline_stage_seconds", "Time spent processing one work item", ["stage"]
+)
+queue_depth = metrics.gauge(
+    "work_queue_depth", "Pending and leased work items per stage", ["stage"]
+)
+stage_inflight = metrics.gauge(
+    "pipeline_stage_inflight", "Work items currently being processed", ["stage"]
+)
+
+
+class StageWorker:
+    """从队列领取某一阶段的任务并用线程池处理，只在有空闲容量时领取（背压）"""
+
+    def __init__(self, queue, stage, handler, concurrency, owner, paused=None):
+        self.queue = queue
+        self.stage = stage
+        self.handler = handler
+        self.concurrency = concurrency
+        self.owner = f"{owner}:{stage}"
+        self.paused = paused or (lambda: False)
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix=f"{stage}-worker"
+        )
+        self.inflight = 0
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"{stage}-dispatcher", daemon=True
+        )
+        stage_inflight.labels(stage).set_function(lambda: self.inflight)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.executor.shutdown(wait=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                free = self.concurrency - self.inflight
+            if free <= 0 or self.paused():
+                self._stop.wait(0.1)
+                continue
+            try:
+                items = self.queue.claim(self.stage, self.owner, free, LEASE_SEC)
+            except Exception as e:
+                print(f"[{self.stage}] 领取任务失败: {e}")
+                items = []
+            if not items:
+                self._stop.wait(POLL_INTERVAL_SEC)
+                continue
+            for item in items:
+                with self._lock:
+                    self.inflight += 1
+                self.executor.submit(self._process, item)
+
+    def _process(self, item):
+        queue_id, resource_id, attempts = item
+        start = time.perf_counter()
+        try:
+            self.handler(queue_id, resource_id)
+            with self._lock:
+                self.processed += 1
+            stage_processed.labels(self.stage, "success").inc()
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            stage_processed.labels(self.stage, "failed").inc()
+            print(f"[{self.stage}] 资源 {resource_id} 处理失败 (第 {attempts} 次): {e}")
+            self.queue.fail(queue_id, e, attempts)
+        finally:
+            stage_latency.labels(self.stage).observe(time.perf_counter() - start)
+            with self._lock:
+                self.inflight -= 1
+
+
+def test_queued_resource(queue, tester, queue_id, resource_id):
+    """测试队列中的一个资源，结果和任务完成由写入线程批量提交；资源已删除时直接完成任务"""
+    conn = queue._connect()
+    try:
+        resource = conn.execute(
+            "SELECT id, url, protocol, source, server_region, crawl_time, status FROM resources WHERE id = ?",
+            (resource_id,),
+        ).fetchone()
+    finally:
+        conn.close()
+    if not resource:
+        conn = queue._connect()
+        try:
+            queue.complete(conn, queue_id)
+        finally:
+            conn.close()
+        return None
+    result = tester.test_resource(resource, queue_id=queue_id)
+    print(f"[test] 资源 {resource_id} [{result['status'].upper()}]: {result['url']}")
+    return result
+
+
+def rollup_measurements(store):
+    """降采样延迟历史并清理超过保留期的明细，失败时只打印错误，下一个间隔再试"""
+    try:
+        print(f"延迟历史降采样完成: {store.rollup()}")
+    except sqlite3.Error as e:
+        print(f"延迟历史降采样失败: {e}")
+
+
+class Pipeline:
+    def __init__(
+        self,
+        geo_concurrency=GEO_CONCURRENCY,
+        test_concurrency=TEST_CONCURRENCY,
+        max_test_backlog=MAX_TEST_BACKLOG,
+    ):
+        # 流水线运行后爬虫新插入的资源自动入队
+        self.queue = WorkQueue(DB_PATH, enqueue_new_resources=True)
+        self.max_test_backlog = max_test_backlog
+        self.tester = ResourceTester()
+        # test 阶段的任务与测试结果在写入线程的同一事务中完成
+        self.tester.writer.recorders.append(self.queue)
+        self.tester.timeouts.load(self.tester.measurements)
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.geo = StageWorker(
+            self.queue,
+            STAGE_GEO,
+            self.handle_geo,
+            geo_concurrency,
+            owner,
+            paused=self._test_backlogged,
+        )
+        self.test = StageWorker(
+            self.queue, STAGE_TEST, self.handle_test, test_concurrency, owner
+        )
+        self._test_depth = 0
+        self._test_depth_checked = 0
+        for stage in (STAGE_GEO, STAGE_TEST):
+            queue_depth.labels(stage).set_function(
+                lambda stage=stage: self.queue.depth(stage)
+            )
+
+    def _test_backlogged(self):
+        # 每秒最多查询一次 test 阶段的积压
+        now = time.monotonic()
+        if now - self._test_depth_checked > 1:
+            self._test_depth = self.queue.depth(STAGE_TEST)
+            self._test_depth_checked = now
+        return self._test_depth >= self.max_test_backlog
+
+    def handle_geo(self, queue_id, resource_id):
+        """解析资源的 IP 地理位置，完成后进入 test 阶段"""
+        conn = self.queue._connect()
+        try:
+            row = conn.execute(
+                "SELECT url FROM resources WHERE id = ?", (resource_id,)
+            ).fetchone()
+            geo_info, api_results = None, {}
+            if row:
+                ip = extract_ip_from_url(row[0])
+                if ip:
+                    geo_info, api_results = get_geo_info_comprehensive(ip)
+
+            statuses = [
+                1 if api_results.get(api, False) else 0
+                for api in ("ipinfo", "ipapi_co", "ipgeolocation", "ipwho")
+            ]
+            conn.execute("BEGIN IMMEDIATE")
+            if geo_info:
+                conn.execute(
+                    "UPDATE resources SET server_region = ?, api_ipinfo = ?, api_ipapi_co = ?, api_ipgeolocation = ?, api_ipwho = ? WHERE id = ?",
+                    (geo_info, *statuses, resource_id),
+                )
+            elif row:
+                conn.execute(
+                    "UPDATE resources SET api_ipinfo = ?, api_ipapi_co = ?, api_ipgeolocation = ?, api_ipwho = ? WHERE id = ?",
+                    (*statuses, resource_id),
+                )
+            # 地理位置解析失败不影响 sing-box 测试
+            self.queue.complete(
+                conn, queue_id, resource_id, next_stage=STAGE_TEST if row else None
+            )
+            conn.execute("COMMIT")
+            print(f"[geo] 资源 {resource_id}: {geo_info or '未解析'}")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def handle_test(self, queue_id, resource_id):
+        """用 sing-box 测试资源，结果和任务完成由写入线程批量提交"""
+        test_queued_resource(self.queue, self.tester, queue_id, resource_id)
+
+    def run(self, status_interval=30, metrics_port=METRICS_PORT, rollup_interval=ROLLUP_INTERVAL_SEC):
+        if metrics_port:
+            # 测试延迟之外，geo API 的延迟也受 P99 上限约束
+            start_metrics(metrics_port).watch(geo_api_latency)
+        self.tester.writer.start()
+        self.geo.start()
+        self.test.start()
+        print(
+            f"流水线已启动: geo 并发 {self.geo.concurrency}, test 并发 {self.test.concurrency}, "
+            f"test 积压上限 {self.max_test_backlog}"
+        )
+        last_rollup = time.monotonic()
+        try:
+            while True:
+                time.sleep(status_interval)
+                print(
+                    f"队列深度: {self.queue.depth()} | geo 完成 {self.geo.processed} 失败 {self.geo.failed} | "
+                    f"test 完成 {self.test.processed} 失败 {self.test.failed}"
+                )
+                if time.monotonic() - last_rollup >= rollup_interval:
+                    rollup_measurements(self.tester.measurements)
+                    last_rollup = time.monotonic()
+        except KeyboardInterrupt:
+            print("正在停止流水线...")
+        finally:
+            self.geo.stop()
+            self.test.stop()
+            self.tester.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="geo 解析与 sing-box 测试流水线")
+    parser.add_argument("--geo-concurrency", type=int, default=GEO_CONCURRENCY)
+    parser.add_argument("--test-concurrency", type=int, default=TEST_CONCURRENCY)
+    parser.add_argument("--max-test-backlog", type=int, default=MAX_TEST_BACKLOG)
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=METRICS_PORT,
+        help="本地 /metrics 指标端点端口（0 表示不启用）",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="启动前把尚无地区信息的已有资源放入 geo 队列（切换到流水线时使用一次）",
+    )
+    parser.add_argument(
+        "--remove-trigger",
+        action="store_true",
+        help="删除 resources 表上的入队触发器后退出（不再使用流水线时使用）",
+    )
+    args = parser.parse_args()
+
+    if args.remove_trigger:
+        queue = WorkQueue(DB_PATH)
+        conn = queue._connect()
+        try:
+            drop_trigger(conn)
+        finally:
+            conn.close()
+        print("已删除入队触发器，新资源不再自动进入流水线")
+        return
+
+    profiling.install()
+
+    if args.backfill:
+        added = WorkQueue(DB_PATH).backfill(STAGE_GEO, "server_region IS NULL")
+        print(f"已补充入队 {added} 个资源")
+
+    Pipeline(
+        geo_concurrency=args.geo_concurrency,
+        test_concurrency=args.test_concurrency,
+        max_test_backlog=args.max_test_backlog,
+    ).run(metrics_port=args.metrics_port)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,19 @@ from threading import Lock
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from config import DATABASE_DB_PATH, API_KEYS, cache_lock, ip_cache
 
+# 导入指标
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "crawler"
+))
+from singbox_crawler import metrics, profiling
+
+geo_api_latency = metrics.histogram(
+    "geo_api_latency_seconds", "Latency of geo API requests", ["provider"]
+)
+geo_api_requests = metrics.counter(
+    "geo_api_requests_total", "Geo API requests by outcome", ["provider", "outcome"]
+)
+
 # 数据库路径别名
 DB_PATH = DATABASE_DB_PATH
 
@@ -128,6 +141,7 @@ def update_server_region():
         return False
 
 
+@profiling.profiled("geo")
 def get_geo_info_comprehensive(ip):
     """测试所有API获取IP地理位置信息，返回统一格式'国家代码-国家-城市'和API结果详情"""
     # 检查缓存
@@ -186,6 +200,7 @@ def get_geo_info_comprehensive(ip):
 
 def fetch_geo_info(api_name, url, token):
     """从API获取地理位置信息"""
+    start = time.perf_counter()
     try:
         headers = {}
         if token:
@@ -193,10 +208,15 @@ def fetch_geo_info(api_name, url, token):
 
         response = requests.get(url, headers=headers, timeout=10)
         response.raise_for_status()
-        return response.json()
+        data = response.json()
+        geo_api_requests.labels(api_name, "success").inc()
+        return data
     except Exception as e:
+        geo_api_requests.labels(api_name, "error").inc()
         print(f"Error fetching from {api_name}: {e}")
         return None
+    finally:
+        geo_api_latency.labels(api_name).observe(time.perf_counter() - start)
 
 
 def parse_geo_data(api_name, data):
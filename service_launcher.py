@@ -1,3 +1,4 @@
+import argparse
 import gc
 import logging
 import logging.handlers
@@ -5,13 +6,16 @@ import os
 import smtplib
 import subprocess
 import sys
+import threading
 import time
 from datetime import datetime
 from email.mime.text import MIMEText
 
 import psutil
 
+from crawler.singbox_crawler import control, profiling
 from crawler.singbox_crawler.config import config
+from crawler.singbox_crawler.memory import rss_mb
 
 # Configuration
 LOG_FILE = getattr(config, "logging_log_file_path", "crawler/logs/service.log")
@@ -20,8 +24,21 @@ BACKUP_COUNT = getattr(config, "logging_backup_count", 7)
 
 # Service Configuration
 CPU_LIMIT = getattr(config, "service_cpu_limit_percent", 50)
+CPU_THROTTLE_ENABLED = getattr(config, "service_cpu_throttle_enabled", True)
 MEMORY_LIMIT_MB = getattr(config, "service_memory_limit_mb", 1024)
+DRAIN_TIMEOUT = getattr(config, "service_drain_timeout_sec", 120)
 GC_INTERVAL = getattr(config, "service_gc_interval_hours", 2) * 3600
+PERSISTENT_CRAWLER = getattr(config, "service_persistent_crawler", False)
+CRAWLER_WORKERS = getattr(config, "service_crawler_workers", 1)
+METRICS_PORT = getattr(config, "monitoring_metrics_port", 9410)
+# 多 worker 模式下第 N 个 worker 的指标端口为 METRICS_PORT + 偏移 + N - 1，避开流水线的 9411
+WORKER_METRICS_PORT_OFFSET = 10
+RESTART_DELAY = getattr(config, "service_restart_delay_sec", 30)
+
+# 常驻爬虫进程因内存达到回收阈值主动退出时的返回码（与 singbox_crawler.service 一致）
+EXIT_RECYCLE = 3
+# 爬虫的 JOBDIR（与 settings.JOBDIR 一致，相对 crawler 目录），多 worker 模式下每个 worker 使用其中的子目录
+CRAWLER_JOBDIR = "crawls/universal-1"
 
 # Email Config
 EMAIL_ENABLED = getattr(config, "logging_email_alert_enabled", False)
@@ -76,62 +93,290 @@ def send_email_alert(subject, body):
         logger.error(f"Failed to send email alert: {e}")
 
 
-def monitor_process(process):
-    """Monitor the subprocess for memory and CPU usage."""
+class CpuGovernor(threading.Thread):
+    """
+    CPU budget for the whole crawler process tree.
+
+    Usage is sampled non-blockingly with cpu_percent(None) on cached Process
+    objects and smoothed with an EWMA (100 = one full core, same scale as
+    SERVICE_CPU_LIMIT_PERCENT). When the smoothed usage exceeds the limit the
+    tree is lowered in priority and a run fraction converging to
+    limit / demand is published through the THROTTLE control file; the
+    crawler paces itself cooperatively (CpuPacingExtension).
+
+    The tree is never suspended: a process stopped while holding the SQLite
+    write lock (frontier, sources, leases) would block every other worker
+    until it is resumed.
+    """
+
+    SAMPLE_SEC = 2  # CPU 采样间隔
+    EWMA_ALPHA = 0.3
+    MIN_RUN_FRACTION = 0.1
+    PUBLISH_STEP = 0.02  # 运行比例变化超过该值时才重写控制文件
+
+    def __init__(self, root_pid, limit_percent):
+        super().__init__(name="CpuGovernor", daemon=True)
+        self.root_pid = root_pid
+        self.limit = limit_percent
+        self.run_fraction = 1.0
+        self.usage = None  # EWMA 平滑后的 CPU 使用率
+        self._procs = {}
+        self._niced = set()
+        self._published = 1.0
+        self._stop_event = threading.Event()
+
+    def _refresh_tree(self):
+        """更新进程树缓存，新进程先调用一次 cpu_percent(None) 建立基准"""
+        try:
+            root = self._procs.get(self.root_pid) or psutil.Process(self.root_pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            self._procs = {}
+            return
+        procs = {}
+        for proc in tree:
+            cached = self._procs.get(proc.pid)
+            if cached is None:
+                try:
+                    proc.cpu_percent(None)
+                except psutil.NoSuchProcess:
+                    continue
+                cached = proc
+            procs[proc.pid] = cached
+        self._procs = procs
+
+    def sample(self):
+        """返回自上次采样以来整个进程树的 CPU 使用率（不阻塞）"""
+        total = 0.0
+        for proc in list(self._procs.values()):
+            try:
+                total += proc.cpu_percent(None)
+            except psutil.NoSuchProcess:
+                pass
+        self._refresh_tree()
+        if self.usage is None:
+            self.usage = total
+        else:
+            self.usage = self.EWMA_ALPHA * total + (1 - self.EWMA_ALPHA) * self.usage
+        return self.usage
+
+    def _adjust(self):
+        usage = self.sample()
+        if usage <= 0:
+            self.run_fraction = 1.0
+        else:
+            # 暂停期间测得的是平均使用率，除以运行比例即为进程树的实际需求
+            demand = usage / self.run_fraction
+            self.run_fraction = min(1.0, max(self.MIN_RUN_FRACTION, self.limit / demand))
+        if self.run_fraction < 1.0:
+            self._set_low_priority(True)
+        elif usage < self.limit * 0.5:
+            self._set_low_priority(False)
+
+    def _set_low_priority(self, low):
+        low_value = psutil.BELOW_NORMAL_PRIORITY_CLASS if os.name == "nt" else 10
+        normal_value = psutil.NORMAL_PRIORITY_CLASS if os.name == "nt" else 0
+        for pid, proc in self._procs.items():
+            if low == (pid in self._niced):
+                continue
+            try:
+                proc.nice(low_value if low else normal_value)
+                if low:
+                    self._niced.add(pid)
+                else:
+                    self._niced.discard(pid)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+
+    def _publish(self):
+        """把运行比例写入控制文件，恢复全速时删除"""
+        fraction = self.run_fraction
+        if fraction >= 1.0:
+            if self._published < 1.0:
+                control.clear(control.THROTTLE, self.root_pid)
+                self._published = 1.0
+        elif abs(fraction - self._published) >= self.PUBLISH_STEP:
+            control.request(control.THROTTLE, self.root_pid, f"{fraction:.3f}")
+            self._published = fraction
+
+    def run(self):
+        self._refresh_tree()
+        while not self._stop_event.wait(self.SAMPLE_SEC):
+            self._adjust()
+            self._publish()
+
+    def stop(self):
+        """停止节流，爬虫恢复全速运行（排空前需要先停止）"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        control.clear(control.THROTTLE, self.root_pid)
+        self._published = 1.0
+
+
+def monitor_process(process, governor=None, state=None):
+    """
+    Monitor the subprocess tree for memory usage; CPU is enforced by CpuGovernor.
+
+    Above MEMORY_LIMIT_MB the crawler is asked to drain (stop scheduling,
+    flush and exit on its own); it is only terminated once DRAIN_TIMEOUT
+    has passed without it exiting.
+    """
+    state = state if state is not None else {}
     try:
-        proc = psutil.Process(process.pid)
-
-        # Check Memory
-        mem_info = proc.memory_info()
-        mem_usage_mb = mem_info.rss / 1024 / 1024
-        if mem_usage_mb > MEMORY_LIMIT_MB:
+        # 统计整个进程树（包括 sing-box 等子进程）
+        mem_usage_mb = rss_mb(process.pid)
+        drain_deadline = state.get("drain_deadline")
+        if drain_deadline is None and mem_usage_mb > MEMORY_LIMIT_MB:
+            logger.warning(
+                f"Process tree memory usage {mem_usage_mb:.2f}MB exceeded limit {MEMORY_LIMIT_MB}MB. "
+                f"Requesting drain (deadline {DRAIN_TIMEOUT}s)..."
+            )
+            # 排空时不再节流，尽快写完数据退出
+            if governor:
+                governor.stop()
+            control.request(control.DRAIN, process.pid)
+            state["drain_deadline"] = time.time() + DRAIN_TIMEOUT
+        elif drain_deadline is not None and time.time() > drain_deadline:
             logger.warning(
-                f"Process memory usage {mem_usage_mb:.2f}MB exceeded limit {MEMORY_LIMIT_MB}MB. Restarting..."
+                f"Crawler did not drain within {DRAIN_TIMEOUT}s "
+                f"(memory {mem_usage_mb:.2f}MB). Terminating..."
             )
             process.terminate()
             return False
 
-        # Check CPU (Just logging for now, as hard limiting CPU in Python is tricky without OS tools)
-        # NSSM can set priority, but we can't easily throttle CPU % from here without suspending/resuming.
-        # We rely on Scrapy settings (download delay) to keep CPU low.
-        cpu_percent = proc.cpu_percent(interval=0.1)
-        if cpu_percent > CPU_LIMIT:
-            logger.warning(f"High CPU usage detected: {cpu_percent}%")
+        if governor and governor.run_fraction < 1.0:
+            logger.info(
+                f"CPU throttled: {governor.usage:.1f}% (limit {governor.limit:g}%), "
+                f"running {governor.run_fraction:.0%} of the time"
+            )
 
     except psutil.NoSuchProcess:
         return False
     return True
 
 
-def run_crawler():
+def _report_exit(return_code, duration, persistent, state, name="Crawler"):
+    if return_code == 0:
+        logger.info(f"{name} finished successfully in {duration:.2f}s")
+    elif persistent and return_code == EXIT_RECYCLE:
+        logger.info(f"{name} recycled itself after {duration:.2f}s (memory threshold)")
+    elif "drain_deadline" in state and return_code is not None and return_code >= 0:
+        logger.info(f"{name} drained and exited with code {return_code} after {duration:.2f}s")
+    else:
+        logger.error(f"{name} exited with error code {return_code}")
+        # Send alert if it wasn't a manual termination (which would be -15 or 1)
+        if return_code != 0 and return_code is not None:
+            send_email_alert(
+                f"{name} Failed", f"{name} process exited with code {return_code}"
+            )
+
+
+def run_crawler(persistent=False, workers=1):
+    """
+    Run one crawl (or the persistent service) and wait for it to exit.
+
+    With workers > 1 several crawler processes are started; they claim due
+    sources through leases on the sources table (SOURCE_LEASE_ENABLED), so
+    no source is fetched twice. Each worker gets its own frontier scope and
+    JOBDIR (Bloom filter and spider state) and metrics port, and CPU_LIMIT is
+    split evenly between the workers. The memory limit applies per worker.
+    """
     base_dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(os.path.join(base_dir, "crawler"))
 
-    cmd = [sys.executable, "-m", "scrapy.cmdline", "crawl", "universal"]
+    if persistent:
+        # 常驻模式：子进程内部调度爬取轮次，只在内存达到阈值或出错时退出
+        cmd = [sys.executable, "-m", "singbox_crawler.service"]
+    else:
+        cmd = [sys.executable, "-m", "scrapy.cmdline", "crawl", "universal"]
 
-    start_time = time.time()
+    env = os.environ.copy()
+    if workers > 1:
+        env["CRAWLER_SOURCE_LEASES_ENABLED"] = "true"
 
-    logger.info("Starting crawler process...")
-    process = subprocess.Popen(cmd)
+    start_time = time.time()
 
-    while process.poll() is None:
-        if not monitor_process(process):
-            # Process was killed by monitor
-            break
-        time.sleep(5)
+    logger.info(
+        f"Starting {'persistent ' if persistent else ''}crawler process"
+        + (f"es ({workers} workers)..." if workers > 1 else "...")
+    )
+    processes = []
+    for index in range(workers):
+        worker_cmd = cmd
+        if workers > 1:
+            # 每个 worker 只取出自己入队的请求，去重状态也各自保存
+            scope = f"worker-{index + 1}"
+            worker_cmd = cmd + [
+                "-s",
+                f"FRONTIER_SCOPE={scope}",
+                "-s",
+                f"JOBDIR={os.path.join(CRAWLER_JOBDIR, scope)}",
+                "-s",
+                f"METRICS_PORT={METRICS_PORT + WORKER_METRICS_PORT_OFFSET + index}",
+            ]
+        processes.append(subprocess.Popen(worker_cmd, env=env))
+    # 供 --profile 等命令行工具找到当前的爬虫进程（多个 worker 时为第一个）
+    control.write_pid("crawler", processes[0].pid)
+
+    governors = [None] * workers
+    if CPU_THROTTLE_ENABLED:
+        # CPU 上限是整个爬虫的预算，平均分给各个 worker
+        governors = [
+            CpuGovernor(process.pid, CPU_LIMIT / workers) for process in processes
+        ]
+        for governor in governors:
+            governor.start()
+
+    states = [{} for _ in processes]
+    try:
+        while any(process.poll() is None for process in processes):
+            for process, governor, state in zip(processes, governors, states):
+                if process.poll() is not None:
+                    continue
+                terminated_at = state.get("terminated_at")
+                if terminated_at is None:
+                    if not monitor_process(process, governor, state):
+                        # Process was terminated by monitor
+                        state["terminated_at"] = time.time()
+                elif time.time() - terminated_at > 30:
+                    process.kill()
+            time.sleep(5)
+    finally:
+        for governor in governors:
+            if governor:
+                governor.stop()
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            control.clear(control.DRAIN, process.pid)
+            control.clear(control.PROFILE, process.pid)
+            control.clear(control.THROTTLE, process.pid)
+        control.clear_pid("crawler")
 
-    return_code = process.returncode
     duration = time.time() - start_time
+    for index, (process, state) in enumerate(zip(processes, states)):
+        name = f"Crawler worker {index + 1}" if workers > 1 else "Crawler"
+        _report_exit(process.returncode, duration, persistent, state, name)
 
-    if return_code == 0:
-        logger.info(f"Crawler finished successfully in {duration:.2f}s")
-    else:
-        logger.error(f"Crawler exited with error code {return_code}")
-        # Send alert if it wasn't a manual termination (which would be -15 or 1)
-        if return_code != 0 and return_code is not None:
-            send_email_alert(
-                "Crawler Failed", f"Crawler process exited with code {return_code}"
-            )
+    return next((p.returncode for p in processes if p.returncode != 0), 0)
+
+
+def request_profile(stages, mode, duration, pid=None):
+    """Ask the running crawler child (or another process) to profile itself."""
+    pid = pid or control.read_pid("crawler")
+    if not pid or not psutil.pid_exists(pid):
+        logger.error("No running crawler process found (is the launcher running?)")
+        return False
+    control.request(
+        control.PROFILE, pid, profiling.format_request(stages, mode, duration)
+    )
+    logger.info(
+        f"Profile requested for pid {pid}: stages={','.join(stages)} mode={mode} duration={duration}s; "
+        f"results will be written to {profiling.PROFILE_DIR}"
+    )
+    return True
 
 
 def process_pending_subscriptions():
@@ -144,7 +389,76 @@ def process_pending_subscriptions():
     logger.info("Pending subscriptions processing completed.")
 
 
+def run_persistent():
+    """常驻模式：保持一个爬虫进程，只在其退出时重启"""
+    logger.info("Singbox Crawler Service Started (persistent mode).")
+
+    while True:
+        try:
+            return_code = run_crawler(persistent=True)
+            if return_code == EXIT_RECYCLE:
+                # 主动回收，立即重启
+                continue
+            logger.info(f"Restarting crawler in {RESTART_DELAY}s...")
+            time.sleep(RESTART_DELAY)
+        except KeyboardInterrupt:
+            logger.info("Service stopping by user request.")
+            break
+        except Exception as e:
+            logger.error(f"Critical Service Error: {e}", exc_info=True)
+            send_email_alert("Service Crashed", str(e))
+            time.sleep(RESTART_DELAY)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Singbox crawler service launcher")
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        default=PERSISTENT_CRAWLER,
+        help="keep one long-running crawler process instead of spawning scrapy every cycle",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=CRAWLER_WORKERS,
+        help="number of crawler processes sharing due sources through leases",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="STAGES",
+        help="profile the running crawler child: comma-separated stages "
+        f"({','.join(profiling.STAGES)}) or 'all', then exit",
+    )
+    parser.add_argument(
+        "--profile-mode",
+        choices=[profiling.MODE_SAMPLE, profiling.MODE_CPROFILE],
+        default=profiling.MODE_SAMPLE,
+    )
+    parser.add_argument("--profile-duration", type=float, default=60)
+    parser.add_argument(
+        "--profile-pid",
+        type=int,
+        help="profile another process using profiling.install() (tester, pipeline) instead",
+    )
+    args = parser.parse_args()
+    if args.profile:
+        ok = request_profile(
+            args.profile.split(","),
+            args.profile_mode,
+            args.profile_duration,
+            args.profile_pid,
+        )
+        sys.exit(0 if ok else 1)
+    if args.persistent:
+        if args.workers > 1:
+            logger.warning(
+                "--workers is not supported with --persistent; start additional "
+                "persistent workers with CRAWLER_SOURCE_LEASES_ENABLED=true instead"
+            )
+        run_persistent()
+        return
+
     logger.info("Singbox Crawler Service Started.")
 
     last_gc_time = time.time()
@@ -154,7 +468,7 @@ def main():
     while True:
         try:
             # 1. Run the crawler
-            run_crawler()
+            run_crawler(workers=max(1, args.workers))
 
             # 2. Process pending subscriptions periodically
             if time.time() - last_pending_process_time > PENDING_PROCESS_INTERVAL:
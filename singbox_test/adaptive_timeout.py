@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+自适应测试超时
+根据历史延迟分布为每个探测计算超时：取高分位数乘以余量再加固定缓冲，并限制在上下限之间。
+查找顺序为 资源（端点）-> 协议+地区 -> 协议，都没有足够样本时使用默认超时
+"""
+import threading
+
+from report import LatencyHistogram
+
+ADAPTIVE_TIMEOUT_PERCENTILE = 95  # 使用的历史延迟分位数
+ADAPTIVE_TIMEOUT_MARGIN = 1.5  # 分位数的放大倍数
+ADAPTIVE_TIMEOUT_PADDING_SEC = 1.0  # 额外的固定缓冲
+ADAPTIVE_TIMEOUT_MIN_SEC = 2.0  # 超时下限
+ADAPTIVE_TIMEOUT_MAX_SEC = 30.0  # 超时上限
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 5  # 至少需要多少个成功样本才使用历史数据
+ADAPTIVE_TIMEOUT_HISTORY_DAYS = 14  # 读取多少天的历史
+
+
+class AdaptiveTimeouts:
+    """按端点 / 协议+地区 / 协议维护延迟分布并给出超时（线程安全）"""
+
+    def __init__(
+        self,
+        default_timeout,
+        percentile=ADAPTIVE_TIMEOUT_PERCENTILE,
+        margin=ADAPTIVE_TIMEOUT_MARGIN,
+        padding=ADAPTIVE_TIMEOUT_PADDING_SEC,
+        min_timeout=ADAPTIVE_TIMEOUT_MIN_SEC,
+        max_timeout=ADAPTIVE_TIMEOUT_MAX_SEC,
+        min_samples=ADAPTIVE_TIMEOUT_MIN_SAMPLES,
+    ):
+        self.default_timeout = default_timeout
+        self.percentile = percentile
+        self.margin = margin
+        self.padding = padding
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        # 资源数量可能很大，每个资源只保存算好的超时；分组数量少，保留完整直方图以便在线更新
+        self.endpoint_timeouts = {}
+        self.groups = {}
+        self._lock = threading.Lock()
+
+    def _derive(self, hist):
+        """由直方图计算超时，样本不足时返回 None"""
+        if hist.total < self.min_samples:
+            return None
+        value = hist.percentile(self.percentile) * self.margin + self.padding
+        return round(min(max(value, self.min_timeout), self.max_timeout), 3)
+
+    @staticmethod
+    def _group_keys(protocol, server_region):
+        return (f"{protocol}|{server_region or ''}", protocol)
+
+    def load(self, store, days=ADAPTIVE_TIMEOUT_HISTORY_DAYS):
+        """从延迟历史加载分布"""
+        for resource_id, _, _, hist in store.iter_latency_groups("resource", days):
+            timeout = self._derive(hist)
+            if timeout is not None:
+                self.endpoint_timeouts[resource_id] = timeout
+        for group_by in ("protocol_region", "protocol"):
+            for key, _, _, hist in store.iter_latency_groups(group_by, days):
+                if key is not None:
+                    self.groups[key] = hist
+        return len(self.endpoint_timeouts), len(self.groups)
+
+    def timeout_for(self, resource_id, protocol, server_region):
+        """返回本次探测使用的超时（秒）"""
+        timeout = self.endpoint_timeouts.get(resource_id)
+        if timeout is not None:
+            return timeout
+        with self._lock:
+            for key in self._group_keys(protocol, server_region):
+                hist = self.groups.get(key)
+                if hist is not None:
+                    timeout = self._derive(hist)
+                    if timeout is not None:
+                        return timeout
+        return self.default_timeout
+
+    def observe(self, resource_id, protocol, server_region, latency, success):
+        """用本次探测结果在线更新分布，只有成功的探测计入延迟"""
+        if not success:
+            return
+        with self._lock:
+            for key in self._group_keys(protocol, server_region):
+                hist = self.groups.get(key)
+                if hist is None:
+                    hist = self.groups[key] = LatencyHistogram()
+                hist.add(latency)
+            # 端点自身的超时至少要覆盖本次成功的延迟
+            current = self.endpoint_timeouts.get(resource_id)
+            if current is not None and latency * self.margin + self.padding > current:
+                self.endpoint_timeouts[resource_id] = round(
+                    min(latency * self.margin + self.padding, self.max_timeout), 3
+                )
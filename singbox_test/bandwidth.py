@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+代理带宽测速
+通过 sing-box 为每个已验证节点启动一个本地 mixed 入站，经节点向测速服务器下载 / 上传
+指定大小的数据并记录 Mbps。测速目标默认是进程内启动的本地 HTTP 服务器，可离线运行
+"""
+import json
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# 默认测速参数
+BANDWIDTH_PAYLOAD_BYTES = 10 * 1024 * 1024  # 每个方向传输的数据量
+BANDWIDTH_CONCURRENCY = 2  # 同时测速的节点数，避免占满本机带宽
+BANDWIDTH_MIN_MBPS = 1.0  # 低于该速度的节点提前结束
+BANDWIDTH_EARLY_STOP_SEC = 3.0  # 传输多少秒后开始判断是否过慢
+BANDWIDTH_MAX_SEC = 30.0  # 单个方向最长传输时间
+SINGBOX_START_TIMEOUT = 5.0  # 等待 sing-box 入站端口就绪的时间
+
+CHUNK_SIZE = 64 * 1024
+_ZERO_CHUNK = b"\0" * CHUNK_SIZE
+
+
+class _SpeedHandler(BaseHTTPRequestHandler):
+    """GET /download?bytes=N 返回 N 字节；POST /upload 读取并丢弃请求体"""
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path != "/download":
+            self.send_error(404)
+            return
+        size = int(parse_qs(parts.query).get("bytes", [BANDWIDTH_PAYLOAD_BYTES])[0])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        try:
+            while size > 0:
+                n = min(size, CHUNK_SIZE)
+                self.wfile.write(_ZERO_CHUNK[:n])
+                size -= n
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前结束（慢节点被中止）
+            pass
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/upload":
+            self.send_error(404)
+            return
+        remaining = int(self.headers.get("Content-Length", 0))
+        received = 0
+        try:
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, CHUNK_SIZE))
+                if not data:
+                    break
+                received += len(data)
+                remaining -= len(data)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        body = json.dumps({"received": received}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不输出每个请求的访问日志
+        pass
+
+
+class LocalSpeedServer:
+    """在后台线程中运行的本地测速服务器"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), _SpeedHandler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="LocalSpeedServer", daemon=True
+        )
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TooSlow(Exception):
+    """传输速度低于下限，提前结束"""
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+class _Meter:
+    """统计传输字节数，并在过慢或超时时中止"""
+
+    def __init__(self, min_mbps):
+        self.min_mbps = min_mbps
+        self.start = time.monotonic()
+        self.bytes = 0
+
+    @property
+    def elapsed(self):
+        return max(time.monotonic() - self.start, 1e-6)
+
+    @property
+    def mbps(self):
+        return self.bytes * 8 / self.elapsed / 1_000_000
+
+    def add(self, n):
+        self.bytes += n
+        elapsed = self.elapsed
+        if elapsed >= BANDWIDTH_MAX_SEC:
+            raise TooSlow("超过最长传输时间")
+        if elapsed >= BANDWIDTH_EARLY_STOP_SEC and self.mbps < self.min_mbps:
+            raise TooSlow(f"速度 {self.mbps:.2f} Mbps 低于下限 {self.min_mbps} Mbps")
+
+
+class BandwidthTester:
+    """有界并发的节点带宽测试"""
+
+    def __init__(
+        self,
+        singbox_binary,
+        target_url,
+        payload_bytes=BANDWIDTH_PAYLOAD_BYTES,
+        concurrency=BANDWIDTH_CONCURRENCY,
+        min_mbps=BANDWIDTH_MIN_MBPS,
+        test_location=None,
+    ):
+        self.singbox_binary = singbox_binary
+        self.target_url = target_url.rstrip("/")
+        self.payload_bytes = payload_bytes
+        self.concurrency = concurrency
+        self.min_mbps = min_mbps
+        self.test_location = test_location
+
+    def _download(self, opener):
+        meter = _Meter(self.min_mbps)
+        url = f"{self.target_url}/download?bytes={self.payload_bytes}"
+        with opener.open(url, timeout=BANDWIDTH_MAX_SEC) as response:
+            while True:
+                data = response.read(CHUNK_SIZE)
+                if not data:
+                    break
+                meter.add(len(data))
+        return meter
+
+    def _upload(self, opener):
+        meter = _Meter(self.min_mbps)
+
+        def body():
+            remaining = self.payload_bytes
+            while remaining > 0:
+                n = min(remaining, CHUNK_SIZE)
+                yield _ZERO_CHUNK[:n]
+                remaining -= n
+                meter.add(n)
+
+        request = urllib.request.Request(
+            f"{self.target_url}/upload",
+            data=body(),
+            headers={
+                "Content-Length": str(self.payload_bytes),
+                "Content-Type": "application/octet-stream",
+            },
+            method="POST",
+        )
+        with opener.open(request, timeout=BANDWIDTH_MAX_SEC) as response:
+            response.read()
+        return meter
+
+    def test_one(self, resource_id, url, protocol, outbound):
+        """为单个节点测速，返回结果字典"""
+        result = {
+            "id": resource_id,
+            "url": url,
+            "protocol": protocol,
+            "test_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "test_location": self.test_location,
+            "download_mbps": None,
+            "upload_mbps": None,
+            "bytes": 0,
+            "duration": 0,
+            "status": "failed",
+            "error_message": "",
+        }
+        if outbound is None:
+            result["error_message"] = "无法解析为 sing-box 出站"
+            return result
+
+        port = _free_port()
+        config = {
+            "log": {"level": "error"},
+            "inbounds": [
+                {
+                    "type": "mixed",
+                    "tag": "mixed-in",
+                    "listen": "127.0.0.1",
+                    "listen_port": port,
+                }
+            ],
+            "outbounds": [outbound],
+            "route": {"final": outbound["tag"]},
+        }
+        fd, config_path = tempfile.mkstemp(prefix="bandwidth_", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+
+        process = None
+        start = time.monotonic()
+        try:
+            process = subprocess.Popen(
+                [self.singbox_binary, "run", "-c", config_path],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            if not _wait_for_port(port, SINGBOX_START_TIMEOUT):
+                result["error_message"] = "sing-box 启动超时"
+                return result
+
+            proxy = f"http://127.0.0.1:{port}"
+            opener = urllib.request.build_opener(
+                urllib.request.ProxyHandler({"http": proxy, "https": proxy})
+            )
+            download = self._download(opener)
+            result["download_mbps"] = round(download.mbps, 2)
+            upload = self._upload(opener)
+            result["upload_mbps"] = round(upload.mbps, 2)
+            result["bytes"] = download.bytes + upload.bytes
+            result["status"] = "success"
+        except TooSlow as e:
+            result["status"] = "too_slow"
+            result["error_message"] = str(e)
+        except Exception as e:
+            result["error_message"] = f"测速失败: {e}"
+        finally:
+            result["duration"] = round(time.monotonic() - start, 3)
+            if process:
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            os.remove(config_path)
+        return result
+
+    def run(self, resources, build_outbound, on_result):
+        """并发测试多个节点，每完成一个调用一次 on_result"""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [
+                executor.submit(
+                    self.test_one,
+                    resource_id,
+                    url,
+                    protocol,
+                    build_outbound(url, protocol),
+                )
+                for resource_id, url, protocol in resources
+            ]
+            for future in as_completed(futures):
+                on_result(future.result())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+测试运行检查点
+把每次测试运行的参数、进度和已完成的资源记录到 SQLite，
+进程中途被杀后可以用 --resume 从中断处继续
+"""
+import json
+import sqlite3
+import uuid
+from datetime import datetime
+
+
+class RunCheckpoint:
+    """test_runs / test_run_items 两张表的读写封装"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.run_id = None
+        self.params = {}
+        self._ensure_schema()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _ensure_schema(self):
+        conn = self._connect()
+        try:
+            # WAL 模式下读取资源列表不会阻塞写入线程提交
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS test_runs (
+                    run_id TEXT PRIMARY KEY,
+                    started_at TEXT,
+                    updated_at TEXT,
+                    finished_at TEXT,
+                    status TEXT DEFAULT 'running',
+                    params TEXT,
+                    total INTEGER DEFAULT 0,
+                    completed INTEGER DEFAULT 0,
+                    resume_count INTEGER DEFAULT 0
+                )
+            """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS test_run_items (
+                    run_id TEXT,
+                    resource_id INTEGER,
+                    status TEXT,
+                    protocol TEXT,
+                    server_region TEXT,
+                    response_time REAL,
+                    completed_at TEXT,
+                    PRIMARY KEY (run_id, resource_id)
+                )
+            """
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def start(self, params, total):
+        """登记一次新的测试运行"""
+        now = datetime.now()
+        # 时间前缀便于查找，随机后缀避免同一秒内启动的运行冲突
+        self.run_id = f"{now.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.params = params
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO test_runs (run_id, started_at, updated_at, params, total)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (
+                    self.run_id,
+                    now.strftime("%Y-%m-%d %H:%M:%S"),
+                    now.strftime("%Y-%m-%d %H:%M:%S"),
+                    json.dumps(params, ensure_ascii=False),
+                    total,
+                ),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return self.run_id
+
+    def resume(self, run_id=None):
+        """加载指定（或最近一次）未完成的运行，找不到时返回 None"""
+        conn = self._connect()
+        try:
+            if run_id:
+                row = conn.execute(
+                    "SELECT run_id, params, completed FROM test_runs WHERE run_id = ? AND status != 'completed'",
+                    (run_id,),
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    """
+                    SELECT run_id, params, completed FROM test_runs
+                    WHERE status != 'completed'
+                    ORDER BY started_at DESC LIMIT 1
+                """
+                ).fetchone()
+            if not row:
+                return None
+            self.run_id = row[0]
+            self.params = json.loads(row[1] or "{}")
+            conn.execute(
+                "UPDATE test_runs SET status = 'running', resume_count = resume_count + 1, updated_at = ? WHERE run_id = ?",
+                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.run_id),
+            )
+            conn.commit()
+            return self.run_id
+        finally:
+            conn.close()
+
+    def pending_filter(self):
+        """返回筛选未完成资源的 SQL 条件和参数，用于拼接到资源查询中"""
+        if not self.run_id:
+            return "", ()
+        return (
+            " WHERE id NOT IN (SELECT resource_id FROM test_run_items WHERE run_id = ?)",
+            (self.run_id,),
+        )
+
+    def iter_completed(self, batch_size=500):
+        """逐批返回本次运行已完成的结果，用于合并多次部分运行的报告"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                """
+                SELECT resource_id, status, protocol, server_region, response_time
+                FROM test_run_items WHERE run_id = ?
+            """,
+                (self.run_id,),
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for resource_id, status, protocol, server_region, response_time in rows:
+                    yield {
+                        "id": resource_id,
+                        "status": status,
+                        "protocol": protocol,
+                        "server_region": server_region,
+                        "response_time": response_time or 0,
+                    }
+        finally:
+            conn.close()
+
+    def record_batch(self, conn, batch):
+        """在写入线程的事务中提交一批已完成的资源（与结果更新同一事务）"""
+        if not self.run_id:
+            return
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        before = conn.total_changes
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO test_run_items
+            (run_id, resource_id, status, protocol, server_region, response_time, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+            [
+                (
+                    self.run_id,
+                    r["id"],
+                    r["status"],
+                    r["protocol"],
+                    r["server_region"],
+                    r["response_time"],
+                    now,
+                )
+                for r in batch
+            ],
+        )
+        inserted = conn.total_changes - before
+        conn.execute(
+            "UPDATE test_runs SET completed = completed + ?, updated_at = ? WHERE run_id = ?",
+            (inserted, now, self.run_id),
+        )
+
+    def finish(self):
+        """标记本次运行已完成"""
+        if not self.run_id:
+            return
+        conn = self._connect()
+        try:
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            conn.execute(
+                "UPDATE test_runs SET status = 'completed', finished_at = ?, updated_at = ? WHERE run_id = ?",
+                (now, now, self.run_id),
+            )
+            conn.commit()
+        finally:
+            conn.close()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+多位置测试结果合并
+各位置的测试 worker（scripts/run_location_worker.py）把探测结果按 test_location 写入 resource_measurements，
+这里把最近 days 天的明细和小时汇总合并为 资源 × 测试位置 的可用率 / 延迟矩阵，
+写入 resource_location_matrix 表，供按客户端所在地区挑选最优节点，不需要重新测试
+"""
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from measurements import DB_PATH, TIME_FORMAT, MeasurementStore
+
+
+def ensure_schema(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS resource_location_matrix (
+            resource_id INTEGER,
+            test_location TEXT,
+            probes INTEGER,
+            uptime REAL,
+            p50 REAL,
+            p95 REAL,
+            p99 REAL,
+            updated_at TEXT,
+            PRIMARY KEY (resource_id, test_location)
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_location_matrix_rank ON resource_location_matrix(test_location, uptime, p95)"
+    )
+
+
+def build_matrix(db_path=DB_PATH, days=7, min_probes=1):
+    """重新计算矩阵并整体替换 resource_location_matrix，返回写入的单元格数"""
+    store = MeasurementStore(db_path)
+    updated_at = datetime.now().strftime(TIME_FORMAT)
+    rows = []
+    for key, probes, successes, hist in store.iter_latency_groups(
+        "resource_location", days
+    ):
+        if probes < min_probes:
+            continue
+        resource_id, _, location = str(key).partition("|")
+        rows.append(
+            (
+                int(resource_id),
+                location,
+                probes,
+                round(successes / probes * 100, 2),
+                hist.percentile(50),
+                hist.percentile(95),
+                hist.percentile(99),
+                updated_at,
+            )
+        )
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            ensure_schema(conn)
+            conn.execute("DELETE FROM resource_location_matrix")
+            conn.executemany(
+                """
+                INSERT INTO resource_location_matrix
+                (resource_id, test_location, probes, uptime, p50, p95, p99, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                rows,
+            )
+    finally:
+        conn.close()
+    return len(rows)
+
+
+def locations(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        ensure_schema(conn)
+        return [
+            row[0]
+            for row in conn.execute(
+                "SELECT DISTINCT test_location FROM resource_location_matrix ORDER BY test_location"
+            )
+        ]
+    finally:
+        conn.close()
+
+
+def best_for_location(location, db_path=DB_PATH, limit=20, min_uptime=50):
+    """某个测试位置（客户端所在地区）可用率最高、P95 最低的节点"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        ensure_schema(conn)
+        cursor = conn.execute(
+            """
+            SELECT m.resource_id, r.url, r.protocol, r.server_region,
+                   m.probes, m.uptime, m.p50, m.p95, m.p99
+            FROM resource_location_matrix m
+            JOIN resources r ON r.id = m.resource_id
+            WHERE m.test_location = ? AND m.uptime >= ?
+            ORDER BY m.uptime DESC, m.p95 IS NULL, m.p95
+            LIMIT ?
+        """,
+            (location, min_uptime, limit or -1),
+        )
+        columns = [d[0] for d in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+    finally:
+        conn.close()
+
+
+def export_matrix(path, db_path=DB_PATH):
+    """导出为 {资源 ID: {测试位置: {uptime, p50, p95, p99, probes}}} 的 JSON"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        ensure_schema(conn)
+        matrix = {}
+        for resource_id, location, probes, uptime, p50, p95, p99 in conn.execute(
+            "SELECT resource_id, test_location, probes, uptime, p50, p95, p99 FROM resource_location_matrix"
+        ):
+            matrix.setdefault(str(resource_id), {})[location] = {
+                "probes": probes,
+                "uptime": uptime,
+                "p50": p50,
+                "p95": p95,
+                "p99": p99,
+            }
+    finally:
+        conn.close()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(matrix, f, ensure_ascii=False)
+    return len(matrix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并多位置测试结果为 资源 × 位置 矩阵")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--min-probes", type=int, default=1)
+    parser.add_argument("--rollup", action="store_true", help="合并前先执行一次降采样")
+    parser.add_argument("--best", metavar="LOCATION", help="输出该测试位置的最优节点")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--export", metavar="PATH", help="把矩阵导出为 JSON")
+    args = parser.parse_args()
+
+    if args.rollup:
+        print(f"降采样完成: {MeasurementStore(DB_PATH).rollup()}")
+
+    cells = build_matrix(DB_PATH, args.days, args.min_probes)
+    found = locations(DB_PATH)
+    print(f"矩阵已更新: {cells} 个单元格, {len(found)} 个测试位置: {', '.join(found)}")
+
+    if args.export:
+        count = export_matrix(args.export)
+        print(f"已导出 {count} 个资源到 {args.export}")
+
+    if args.best:
+        print(f"{args.best} 的最优节点:")
+        print(f"{'-'*60}")
+        for r in best_for_location(args.best, limit=args.limit):
+            print(
+                f"{r['resource_id']:8} | {r['protocol']:10} | {str(r['server_region']):20} | "
+                f"可用率: {r['uptime']:6.2f}% | P50: {r['p50']} | P95: {r['p95']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
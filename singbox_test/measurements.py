@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+资源延迟历史记录
+每次探测都追加一条记录到 resource_measurements，并定期降采样为按小时、按天的汇总，
+用于按资源 / 地区 / 协议查询 P50/P95/P99 延迟和可用率。
+明细是否已汇总由每条记录的 rolled_up 标记决定，而不是探测时间：探测开始时间早于上次降采样、
+但之后才提交（或从其他测试位置同步过来）的记录会在下一次降采样时合并进对应的小时 / 天汇总。
+"""
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from report import LatencyHistogram
+
+load_dotenv()
+
+# 从环境变量获取数据库路径，默认为data.db（与 test_resources.py 一致）
+DB_PATH = os.environ.get("DATABASE_DB_PATH", "data.db")
+if not os.path.isabs(DB_PATH):
+    DB_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), DB_PATH
+    )
+
+# P99 延迟上限（秒），超过上限的资源在稳定性排名中会被标记
+P99_RESPONSE_LIMIT_SEC = float(os.environ.get("MONITORING_P99_RESPONSE_LIMIT_SEC", 2))
+
+# 原始记录保留天数，超过后只保留汇总
+RAW_RETENTION_DAYS = 7
+# 小时汇总保留天数，超过后只保留天汇总
+HOURLY_RETENTION_DAYS = 90
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+GROUP_COLUMNS = {
+    "resource": "resource_id",
+    "region": "server_region",
+    "protocol": "protocol",
+    "location": "test_location",
+    "protocol_region": "protocol || '|' || IFNULL(server_region, '')",
+    "resource_location": "resource_id || '|' || IFNULL(test_location, '')",
+}
+
+
+def is_success(result):
+    """本次探测是否成功（status 可能沿用数据库中的旧值，需同时检查错误信息）"""
+    return result["status"] == "success" and not result.get("error_message")
+
+
+class MeasurementStore:
+    """resource_measurements 及其汇总表的读写封装"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._ensure_schema()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _ensure_schema(self):
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS resource_measurements (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    resource_id INTEGER,
+                    measured_at TEXT,
+                    protocol TEXT,
+                    server_region TEXT,
+                    test_location TEXT,
+                    success INTEGER,
+                    latency REAL
+                )
+            """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_measurements_resource ON resource_measurements(resource_id, measured_at)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_measurements_time ON resource_measurements(measured_at)"
+            )
+            columns = {
+                row[1] for row in conn.execute("PRAGMA table_info(resource_measurements)")
+            }
+            if "rolled_up" not in columns:
+                conn.execute(
+                    "ALTER TABLE resource_measurements ADD COLUMN rolled_up INTEGER DEFAULT 0"
+                )
+                # 旧版本按时间水位汇总，水位之前的记录已经汇总过
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS measurement_rollup_state (
+                        level TEXT PRIMARY KEY,
+                        watermark TEXT
+                    )
+                """
+                )
+                conn.execute(
+                    """
+                    UPDATE resource_measurements SET rolled_up = 1
+                    WHERE measured_at < (
+                        SELECT watermark FROM measurement_rollup_state WHERE level = 'hourly'
+                    )
+                """
+                )
+            # 只索引还没有汇总的明细，降采样和查询最新部分时不扫描整张表
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_measurements_pending ON resource_measurements(measured_at) WHERE rolled_up = 0"
+            )
+            for table in ("resource_measurements_hourly", "resource_measurements_daily"):
+                conn.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        resource_id INTEGER,
+                        bucket TEXT,
+                        protocol TEXT,
+                        server_region TEXT,
+                        test_location TEXT,
+                        probes INTEGER DEFAULT 0,
+                        successes INTEGER DEFAULT 0,
+                        latency_sum REAL DEFAULT 0,
+                        latency_hist TEXT,
+                        PRIMARY KEY (resource_id, bucket, test_location)
+                    )
+                """
+                )
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)"
+                )
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{table}_region ON {table}(server_region, bucket)"
+                )
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{table}_protocol ON {table}(protocol, bucket)"
+                )
+            # 带宽测速结果，与延迟记录放在一起
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS resource_bandwidth (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    resource_id INTEGER,
+                    measured_at TEXT,
+                    protocol TEXT,
+                    test_location TEXT,
+                    status TEXT,
+                    download_mbps REAL,
+                    upload_mbps REAL,
+                    bytes INTEGER,
+                    duration REAL
+                )
+            """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_bandwidth_resource ON resource_bandwidth(resource_id, measured_at)"
+            )
+            # 记录每一级汇总已经处理到的时间点
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS measurement_rollup_state (
+                    level TEXT PRIMARY KEY,
+                    watermark TEXT
+                )
+            """
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def record_batch(self, conn, batch):
+        """在写入线程的事务中追加一批探测记录"""
+        conn.executemany(
+            """
+            INSERT INTO resource_measurements
+            (resource_id, measured_at, protocol, server_region, test_location, success, latency)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+            [
+                (
+                    r["id"],
+                    r["test_time"],
+                    r["protocol"],
+                    r["server_region"],
+                    r["test_location"],
+                    1 if is_success(r) else 0,
+                    r["response_time"],
+                )
+                for r in batch
+            ],
+        )
+
+    def record_bandwidth(self, results):
+        """批量写入带宽测速结果"""
+        if not results:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO resource_bandwidth
+                    (resource_id, measured_at, protocol, test_location, status,
+                     download_mbps, upload_mbps, bytes, duration)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                    [
+                        (
+                            r["id"],
+                            r["test_time"],
+                            r["protocol"],
+                            r["test_location"],
+                            r["status"],
+                            r["download_mbps"],
+                            r["upload_mbps"],
+                            r["bytes"],
+                            r["duration"],
+                        )
+                        for r in results
+                    ],
+                )
+        finally:
+            conn.close()
+
+    # ---- 降采样 ----
+
+    def _get_watermark(self, conn, level):
+        row = conn.execute(
+            "SELECT watermark FROM measurement_rollup_state WHERE level = ?", (level,)
+        ).fetchone()
+        return row[0] if row else ""
+
+    def _set_watermark(self, conn, level, watermark):
+        conn.execute(
+            "INSERT OR REPLACE INTO measurement_rollup_state (level, watermark) VALUES (?, ?)",
+            (level, watermark),
+        )
+
+    def _merge_into(self, conn, table, groups):
+        """把分组汇总合并进汇总表（已存在的分桶累加）"""
+        for key, agg in groups.items():
+            resource_id, bucket, test_location = key
+            row = conn.execute(
+                f"""
+                SELECT probes, successes, latency_sum, latency_hist FROM {table}
+                WHERE resource_id = ? AND bucket = ? AND test_location IS ?
+            """,
+                (resource_id, bucket, test_location),
+            ).fetchone()
+            if row:
+                agg["probes"] += row[0]
+                agg["successes"] += row[1]
+                agg["latency_sum"] += row[2]
+                agg["hist"].merge(LatencyHistogram.from_dict(json.loads(row[3] or "{}")))
+            conn.execute(
+                f"""
+                INSERT OR REPLACE INTO {table}
+                (resource_id, bucket, protocol, server_region, test_location,
+                 probes, successes, latency_sum, latency_hist)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    resource_id,
+                    bucket,
+                    agg["protocol"],
+                    agg["server_region"],
+                    test_location,
+                    agg["probes"],
+                    agg["successes"],
+                    agg["latency_sum"],
+                    json.dumps(agg["hist"].to_dict()),
+                ),
+            )
+
+    @staticmethod
+    def _new_group(protocol, server_region):
+        return {
+            "protocol": protocol,
+            "server_region": server_region,
+            "probes": 0,
+            "successes": 0,
+            "latency_sum": 0.0,
+            "hist": LatencyHistogram(),
+        }
+
+    def rollup(self, now=None):
+        """
+        把已结束的小时 / 天汇总到对应表，并清理超过保留期的明细
+        多个进程（流水线、各测试位置的 worker）可以同时调用，整个过程在一个写事务中完成
+        """
+        now = now or datetime.now()
+        hour_start = now.replace(minute=0, second=0, microsecond=0)
+        day_start = hour_start.replace(hour=0)
+        conn = self._connect()
+        try:
+            with conn:
+                # 先取得写锁，其他进程不会同时读到同一批未汇总的明细
+                conn.execute("BEGIN IMMEDIATE")
+                # 1. 未汇总的原始记录 -> 小时汇总（包括在已汇总时段之后才提交的记录）
+                limit = hour_start.strftime(TIME_FORMAT)
+                daily_watermark = self._get_watermark(conn, "daily")
+                groups = {}
+                cursor = conn.execute(
+                    """
+                    SELECT resource_id, measured_at, protocol, server_region, test_location, success, latency
+                    FROM resource_measurements
+                    WHERE rolled_up = 0 AND measured_at < ?
+                """,
+                    (limit,),
+                )
+                for (
+                    resource_id,
+                    measured_at,
+                    protocol,
+                    server_region,
+                    test_location,
+                    success,
+                    latency,
+                ) in cursor:
+                    bucket = measured_at[:13] + ":00:00"
+                    key = (resource_id, bucket, test_location)
+                    agg = groups.get(key)
+                    if agg is None:
+                        agg = groups[key] = self._new_group(protocol, server_region)
+                    agg["probes"] += 1
+                    if success:
+                        agg["successes"] += 1
+                        agg["latency_sum"] += latency or 0
+                        agg["hist"].add(latency or 0)
+                    # 地区可能在后续探测中才解析出来，保留最新的非空值
+                    if server_region:
+                        agg["server_region"] = server_region
+                # 迟到的记录所在的天已经汇总过时，同时合并进天汇总（_merge_into 会修改分组，先复制）
+                late = {}
+                for (resource_id, bucket, test_location), agg in groups.items():
+                    if bucket >= daily_watermark:
+                        continue
+                    key = (resource_id, bucket[:10], test_location)
+                    merged = late.get(key)
+                    if merged is None:
+                        merged = late[key] = self._new_group(agg["protocol"], None)
+                    merged["probes"] += agg["probes"]
+                    merged["successes"] += agg["successes"]
+                    merged["latency_sum"] += agg["latency_sum"]
+                    merged["hist"].merge(agg["hist"])
+                    if agg["server_region"]:
+                        merged["server_region"] = agg["server_region"]
+                self._merge_into(conn, "resource_measurements_hourly", groups)
+                self._merge_into(conn, "resource_measurements_daily", late)
+                conn.execute(
+                    "UPDATE resource_measurements SET rolled_up = 1 WHERE rolled_up = 0 AND measured_at < ?",
+                    (limit,),
+                )
+                self._set_watermark(conn, "hourly", limit)
+                hourly_count = len(groups)
+
+                # 2. 小时汇总 -> 天汇总
+                watermark = self._get_watermark(conn, "daily")
+                limit = day_start.strftime(TIME_FORMAT)
+                groups = {}
+                cursor = conn.execute(
+                    """
+                    SELECT resource_id, bucket, protocol, server_region, test_location,
+                           probes, successes, latency_sum, latency_hist
+                    FROM resource_measurements_hourly
+                    WHERE bucket >= ? AND bucket < ?
+                """,
+                    (watermark, limit),
+                )
+                for (
+                    resource_id,
+                    bucket,
+                    protocol,
+                    server_region,
+                    test_location,
+                    probes,
+                    successes,
+                    latency_sum,
+                    latency_hist,
+                ) in cursor:
+                    key = (resource_id, bucket[:10], test_location)
+                    agg = groups.get(key)
+                    if agg is None:
+                        agg = groups[key] = self._new_group(protocol, server_region)
+                    agg["probes"] += probes
+                    agg["successes"] += successes
+                    agg["latency_sum"] += latency_sum
+                    agg["hist"].merge(
+                        LatencyHistogram.from_dict(json.loads(latency_hist or "{}"))
+                    )
+                    if server_region:
+                        agg["server_region"] = server_region
+                self._merge_into(conn, "resource_measurements_daily", groups)
+                self._set_watermark(conn, "daily", limit)
+                daily_count = len(groups)
+
+                # 3. 清理超过保留期的明细（这些记录已经被汇总过）
+                raw_limit = (now - timedelta(days=RAW_RETENTION_DAYS)).strftime(
+                    TIME_FORMAT
+                )
+                conn.execute(
+                    "DELETE FROM resource_measurements WHERE measured_at < ? AND rolled_up = 1",
+                    (raw_limit,),
+                )
+                hourly_limit = (now - timedelta(days=HOURLY_RETENTION_DAYS)).strftime(
+                    TIME_FORMAT
+                )
+                conn.execute(
+                    "DELETE FROM resource_measurements_hourly WHERE bucket < ? AND bucket < ?",
+                    (hourly_limit, self._get_watermark(conn, "daily")),
+                )
+            return {"hourly_buckets": hourly_count, "daily_buckets": daily_count}
+        finally:
+            conn.close()
+
+    # ---- 查询 ----
+
+    def iter_latency_groups(self, group_by="resource", days=7, now=None):
+        """
+        按分组逐个返回 (key, probes, successes, LatencyHistogram)，结果按 key 排序
+        已汇总的部分读小时表，尚未汇总（rolled_up = 0）的明细读明细表（最多覆盖小时汇总的保留期）；
+        同一时间只在内存中保留一个分组
+        """
+        column = GROUP_COLUMNS[group_by]
+        days = min(days, HOURLY_RETENTION_DAYS)
+        now = now or datetime.now()
+        since = (now - timedelta(days=days)).strftime(TIME_FORMAT)
+
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"""
+                SELECT {column} AS key, probes, successes, latency_hist, NULL
+                FROM resource_measurements_hourly
+                WHERE bucket >= ?
+                UNION ALL
+                SELECT {column} AS key, 1, success, NULL, latency
+                FROM resource_measurements
+                WHERE rolled_up = 0 AND measured_at >= ?
+                ORDER BY key
+            """,
+                (since, since),
+            )
+            current = None
+            for key, probes, successes, latency_hist, latency in cursor:
+                if current is None or key != current[0]:
+                    if current is not None:
+                        yield tuple(current)
+                    current = [key, 0, 0, LatencyHistogram()]
+                current[1] += probes
+                current[2] += successes
+                if latency_hist is not None:
+                    current[3].merge(
+                        LatencyHistogram.from_dict(json.loads(latency_hist))
+                    )
+                elif successes:
+                    current[3].add(latency or 0)
+            if current is not None:
+                yield tuple(current)
+        finally:
+            conn.close()
+
+    def latency_stats(self, group_by="resource", days=7, now=None):
+        """按资源 / 地区 / 协议 / 测试位置统计最近 days 天的可用率与延迟分位数"""
+        stats = []
+        for key, probes, successes, hist in self.iter_latency_groups(
+            group_by, days, now
+        ):
+            p99 = hist.percentile(99)
+            stats.append(
+                {
+                    group_by: key,
+                    "probes": probes,
+                    "uptime": round(successes / probes * 100, 2) if probes else 0,
+                    "p50": hist.percentile(50),
+                    "p95": hist.percentile(95),
+                    "p99": p99,
+                    "p99_ok": p99 is not None and p99 <= P99_RESPONSE_LIMIT_SEC,
+                }
+            )
+        return stats
+
+    def rank_by_stability(self, group_by="resource", days=7, limit=20):
+        """按稳定性排序：可用率高优先，其次 P99 在上限内、P99 低"""
+        stats = self.latency_stats(group_by=group_by, days=days)
+        stats.sort(
+            key=lambda s: (
+                -s["uptime"],
+                not s["p99_ok"],
+                s["p99"] if s["p99"] is not None else float("inf"),
+            )
+        )
+        return stats[:limit] if limit else stats
+
+    def rank_by_bandwidth(self, days=7, limit=20):
+        """按最近 days 天成功测速的平均下载速度排序"""
+        since = (datetime.now() - timedelta(days=days)).strftime(TIME_FORMAT)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                """
+                SELECT resource_id, COUNT(*), AVG(download_mbps), AVG(upload_mbps), MAX(measured_at)
+                FROM resource_bandwidth
+                WHERE measured_at >= ? AND status = 'success'
+                GROUP BY resource_id
+                ORDER BY AVG(download_mbps) DESC
+                LIMIT ?
+            """,
+                (since, limit or -1),
+            )
+            return [
+                {
+                    "resource": resource_id,
+                    "tests": tests,
+                    "download_mbps": round(download or 0, 2),
+                    "upload_mbps": round(upload or 0, 2),
+                    "last_tested": last_tested,
+                }
+                for resource_id, tests, download, upload, last_tested in cursor
+            ]
+        finally:
+            conn.close()
+
+
+def main():
+    """命令行：执行降采样或输出稳定性排名"""
+    parser = argparse.ArgumentParser(description="资源延迟历史统计")
+    parser.add_argument("--rollup", action="store_true", help="执行一次降采样")
+    parser.add_argument(
+        "--group-by", choices=sorted(GROUP_COLUMNS), default="resource"
+    )
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument(
+        "--bandwidth", action="store_true", help="输出带宽排名而不是稳定性排名"
+    )
+    args = parser.parse_args()
+
+    store = MeasurementStore(DB_PATH)
+    if args.rollup:
+        print(f"降采样完成: {store.rollup()}")
+
+    if args.bandwidth:
+        print(f"最近 {args.days} 天带宽排名:")
+        print(f"{'-'*60}")
+        for s in store.rank_by_bandwidth(args.days, args.limit):
+            print(
+                f"{str(s['resource']):10} | 次数: {s['tests']:3} | 下载: {s['download_mbps']:8.2f} Mbps | "
+                f"上传: {s['upload_mbps']:8.2f} Mbps | 最近: {s['last_tested']}"
+            )
+        return
+
+    print(
+        f"最近 {args.days} 天稳定性排名（按 {args.group_by}，P99 上限 {P99_RESPONSE_LIMIT_SEC} 秒）:"
+    )
+    print(f"{'-'*60}")
+    for s in store.rank_by_stability(args.group_by, args.days, args.limit):
+        print(
+            f"{str(s[args.group_by]):30} | 探测: {s['probes']:5} | 可用率: {s['uptime']:6.2f}% | "
+            f"P50: {s['p50']} | P95: {s['p95']} | P99: {s['p99']}{'' if s['p99_ok'] else ' (超限)'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
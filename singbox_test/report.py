@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+流式测试报告
+每条结果完成后立即追加写入 JSONL 文件，统计信息使用在线累加器计算，
+内存占用与测试的资源数量无关，进程被杀时也会留下部分报告
+"""
+import json
+import math
+import os
+import threading
+from datetime import datetime
+
+# 每写入多少条结果刷新一次摘要文件
+SUMMARY_REFRESH_EVERY = 100
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图，用固定内存估算分位数，可合并、可序列化"""
+
+    MIN_VALUE = 0.001  # 1 毫秒
+    MAX_VALUE = 600.0  # 10 分钟
+    GROWTH = 1.1  # 相邻分桶的比例，分位数相对误差约 5%
+
+    _LOG_GROWTH = math.log(GROWTH)
+    BUCKETS = int(math.ceil(math.log(MAX_VALUE / MIN_VALUE) / _LOG_GROWTH)) + 1
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0] * self.BUCKETS
+        self.total = sum(self.counts)
+
+    def _index(self, value):
+        if value <= self.MIN_VALUE:
+            return 0
+        index = int(math.log(value / self.MIN_VALUE) / self._LOG_GROWTH) + 1
+        return min(index, self.BUCKETS - 1)
+
+    def _upper_bound(self, index):
+        return self.MIN_VALUE * (self.GROWTH**index)
+
+    def add(self, value, count=1):
+        self.counts[self._index(value)] += count
+        self.total += count
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.total += other.total
+
+    def percentile(self, p):
+        """返回第 p 百分位的延迟（秒），没有数据时返回 None"""
+        if self.total == 0:
+            return None
+        rank = max(1, int(math.ceil(self.total * p / 100.0)))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return round(self._upper_bound(i), 3)
+        return round(self._upper_bound(self.BUCKETS - 1), 3)
+
+    def to_dict(self):
+        """稀疏表示，只保存非零分桶"""
+        return {str(i): c for i, c in enumerate(self.counts) if c}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        for i, c in (data or {}).items():
+            hist.counts[int(i)] += c
+            hist.total += c
+        return hist
+
+
+class GroupStats:
+    """单个分组（地区或协议）的在线统计"""
+
+    __slots__ = ("total", "success", "failed")
+
+    def __init__(self):
+        self.total = 0
+        self.success = 0
+        self.failed = 0
+
+    def add(self, is_success):
+        self.total += 1
+        if is_success:
+            self.success += 1
+        else:
+            self.failed += 1
+
+    def to_dict(self):
+        return {"total": self.total, "success": self.success, "failed": self.failed}
+
+
+class StreamingReport:
+    """JSONL 明细 + 在线汇总的测试报告"""
+
+    def __init__(self, report_dir, test_location, thread_count, timeout, name=None):
+        os.makedirs(report_dir, exist_ok=True)
+        name = name or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.results_path = os.path.join(
+            report_dir, f"resource_test_report_{name}.jsonl"
+        )
+        self.summary_path = os.path.join(
+            report_dir, f"resource_test_report_{name}_summary.json"
+        )
+        self.test_location = test_location
+        self.thread_count = thread_count
+        self.timeout = timeout
+
+        self.total = 0
+        self.success = 0
+        self.response_time_sum = 0.0
+        self.latency = LatencyHistogram()
+        self.region_stats = {}
+        self.protocol_stats = {}
+
+        self._lock = threading.Lock()
+        # 追加模式打开，行缓冲保证每条结果及时落盘
+        self._file = open(self.results_path, "a", encoding="utf-8", buffering=1)
+
+    def add(self, result):
+        """记录一条测试结果（线程安全）"""
+        line = json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._accumulate(result)
+            if self.total % SUMMARY_REFRESH_EVERY == 0:
+                self._write_summary(complete=False)
+
+    def add_batch(self, batch):
+        """记录一批测试结果（作为 ResultWriter 的监听器，在结果提交后调用）"""
+        for result in batch:
+            self.add(result)
+
+    def seed(self, result):
+        """合并之前部分运行中已完成的结果（只计入统计，不重复写明细）"""
+        with self._lock:
+            self._accumulate(result)
+
+    def _accumulate(self, result):
+        is_success = result["status"] == "success"
+        self.total += 1
+        if is_success:
+            self.success += 1
+        self.response_time_sum += result["response_time"]
+        self.latency.add(result["response_time"])
+
+        region = result["server_region"] or "未知"
+        self.region_stats.setdefault(region, GroupStats()).add(is_success)
+        protocol = result["protocol"]
+        self.protocol_stats.setdefault(protocol, GroupStats()).add(is_success)
+
+    def summary(self, complete=True):
+        total = self.total
+        success_rate = (self.success / total * 100) if total > 0 else 0
+        avg_response_time = self.response_time_sum / total if total > 0 else 0
+        return {
+            "summary": {
+                "total_resources": total,
+                "success": self.success,
+                "failed": total - self.success,
+                "success_rate": round(success_rate, 2),
+                "avg_response_time": round(avg_response_time, 3),
+                "p50_response_time": self.latency.percentile(50),
+                "p95_response_time": self.latency.percentile(95),
+                "p99_response_time": self.latency.percentile(99),
+                "test_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "test_location": self.test_location,
+                "thread_count": self.thread_count,
+                "timeout": self.timeout,
+                "complete": complete,
+                "detailed_results": os.path.basename(self.results_path),
+            },
+            "region_stats": {k: v.to_dict() for k, v in self.region_stats.items()},
+            "protocol_stats": {
+                k: v.to_dict() for k, v in self.protocol_stats.items()
+            },
+        }
+
+    def _write_summary(self, complete):
+        # 先写临时文件再替换，避免进程被杀时留下半个 JSON
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(complete), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.summary_path)
+
+    def finish(self):
+        """写入最终摘要并关闭明细文件"""
+        with self._lock:
+            self._write_summary(complete=True)
+            if not self._file.closed:
+                self._file.close()
+        return self.summary()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
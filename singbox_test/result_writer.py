@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试结果写入线程
+测试线程只把结果放进队列，由单独的写入线程批量写入 SQLite
+"""
+import queue
+import sqlite3
+import threading
+import time
+
+from singbox_crawler import metrics, profiling
+
+# 批量写入参数
+WRITER_BATCH_SIZE = 200  # 累积多少条结果后写入
+WRITER_FLUSH_INTERVAL = 2.0  # 最长多少秒写入一次
+WRITER_QUEUE_SIZE = 10000  # 队列上限，写入跟不上时测试线程会阻塞等待
+
+_STOP = object()
+
+db_flush_latency = metrics.histogram(
+    "db_flush_seconds", "Latency of database writes", ["writer"]
+)
+writer_queue_depth = metrics.gauge(
+    "result_writer_queue_depth", "Results waiting for the writer thread"
+)
+
+
+class ResultWriter:
+    """单连接、批量 executemany 的结果写入器"""
+
+    def __init__(
+        self,
+        db_path,
+        batch_size=WRITER_BATCH_SIZE,
+        flush_interval=WRITER_FLUSH_INTERVAL,
+        max_queue_size=WRITER_QUEUE_SIZE,
+        recorders=(),
+        update_resources=True,
+    ):
+        self.db_path = db_path
+        # 为 False 时只写记录器（多位置测试 worker 不覆盖资源的全局状态）
+        self.update_resources = update_resources
+        # 额外的记录器（检查点、延迟历史等），与结果更新在同一事务中写入
+        self.recorders = list(recorders)
+        # 事务提交成功后调用 listener(batch)，例如 JSONL 报告：报告中的结果一定已经记入检查点，
+        # 中断后恢复时不会重复写入
+        self.listeners = []
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        writer_queue_depth.set_function(self.queue.qsize)
+        self.written = 0
+        self.failed = 0
+        self._thread = threading.Thread(
+            target=self._run, name="ResultWriter", daemon=True
+        )
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self._thread.start()
+            self._started = True
+        return self
+
+    def submit(self, result):
+        """由测试线程调用，只入队不触碰数据库"""
+        self.queue.put(result)
+
+    def close(self):
+        """停止写入线程，保证队列中剩余的结果全部写入"""
+        if not self._started:
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._started = False
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while True:
+                timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is _STOP:
+                    break
+                if item is not None:
+                    batch.append(item)
+
+                # 按数量或按时间刷新
+                if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    self._flush(conn, batch)
+                    batch = []
+                    deadline = time.monotonic() + self.flush_interval
+        finally:
+            # 退出前最后一次刷新
+            self._flush(conn, batch)
+            conn.close()
+
+    def _flush(self, conn, batch):
+        if not batch:
+            return
+        try:
+            with db_flush_latency.labels("test_results").time(), profiling.stage("db"), conn:
+                self._write_batch(conn, batch)
+            self.written += len(batch)
+            print(f"  数据库已批量更新: {len(batch)} 条 (累计 {self.written})")
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"  批量更新数据库失败 ({len(batch)} 条): {e}")
+            return
+        for listener in self.listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                print(f"  结果监听器出错: {e}")
+
+    def _write_batch(self, conn, batch):
+        """在同一个事务中写入一批结果"""
+        if self.update_resources:
+            conn.executemany(
+                "UPDATE resources SET status = ?, server_region = ? WHERE id = ?",
+                [(r["status"], r["server_region"], r["id"]) for r in batch],
+            )
+        # 检查点等记录与结果在同一事务中提交，崩溃后不会出现只写了一半的情况
+        for recorder in self.recorders:
+            recorder.record_batch(conn, batch)
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import argparse
 import json
 import os
 import platform
@@ -28,6 +29,9 @@ if not os.path.isabs(DB_PATH):
 SINGBOX_BINARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sing-box")
 THREAD_COUNT = 5
 TEST_TIMEOUT = 10  # 每个资源的测试超时时间（秒）
+REPORT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tmp"
+)
 
 # 确保可执行文件扩展符合平台要求
 if platform.system() == "Windows":
@@ -39,12 +43,55 @@ sys.path.insert(0, os.path.join(
 ))
 from ip_verification.ip_geo import IPGeoResolver
 
+# 导入分享链接 -> sing-box 出站的解析器和指标
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "crawler"
+))
+from singbox_crawler import metrics, profiling
+from singbox_crawler.outbounds import build_outbound
+
+from adaptive_timeout import AdaptiveTimeouts
+from bandwidth import (
+    BANDWIDTH_CONCURRENCY,
+    BANDWIDTH_MIN_MBPS,
+    BANDWIDTH_PAYLOAD_BYTES,
+    BandwidthTester,
+    LocalSpeedServer,
+)
+from checkpoint import RunCheckpoint
+from measurements import MeasurementStore, is_success
+from report import StreamingReport
+from result_writer import ResultWriter
+
+# P99 延迟上限（秒），超过时触发告警钩子
+P99_RESPONSE_LIMIT_SEC = float(os.environ.get("MONITORING_P99_RESPONSE_LIMIT_SEC", 2))
+
+test_outcomes = metrics.counter(
+    "test_outcomes_total", "Resource test outcomes", ["protocol", "outcome"]
+)
+test_latency = metrics.histogram(
+    "test_latency_seconds", "Response time of successful resource tests", ["protocol"]
+)
+
 
 class ResourceTester:
-    def __init__(self):
-        # 不在这里创建数据库连接，而是在每个线程中创建
+    def __init__(self, resume=None, adaptive_timeout=True):
+        # 测试线程不直接访问数据库，结果统一交给写入线程批量写入
         self.resolver = IPGeoResolver()
-        self.test_results = []
+        self.checkpoint = RunCheckpoint(DB_PATH)
+        self.measurements = MeasurementStore(DB_PATH)
+        self.writer = ResultWriter(
+            DB_PATH, recorders=[self.checkpoint, self.measurements]
+        )
+        # resume 为 "latest" 或具体的运行 ID，None 表示开始新的运行
+        self.resume = resume
+        # 本次运行的线程数和默认超时；恢复中断的运行时改为该运行登记的参数
+        self.thread_count = THREAD_COUNT
+        self.timeout = TEST_TIMEOUT
+        # 按历史延迟为每个探测计算超时，关闭时所有探测都使用 self.timeout
+        self.adaptive_timeout = adaptive_timeout
+        self.timeouts = AdaptiveTimeouts(self.timeout)
+        self.report = None
         # 获取当前位置，如果失败则使用默认值
         try:
             self.current_location = self.resolver.get_current_location()
@@ -52,20 +99,40 @@ class ResourceTester:
             print(f"获取当前位置失败: {e}")
             self.current_location = "未知-未知-未知"
 
-    def get_resources(self):
-        """获取所有资源"""
+    def count_resources(self, pending_only=False):
+        """统计资源数量，pending_only 时只统计本次运行中尚未完成的资源"""
+        where, params = self.checkpoint.pending_filter() if pending_only else ("", ())
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            return conn.execute(
+                "SELECT COUNT(*) FROM resources" + where, params
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def get_resources(self, batch_size=500):
+        """逐批读取本次运行尚未完成的资源，避免一次性加载整张表"""
+        where, params = self.checkpoint.pending_filter()
         # 在主线程中创建数据库连接来获取资源
         conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT id, url, protocol, source, server_region, crawl_time, status FROM resources"
-        )
-        resources = cursor.fetchall()
-        conn.close()
-        return resources
+        try:
+            cursor = conn.execute(
+                "SELECT id, url, protocol, source, server_region, crawl_time, status FROM resources"
+                + where
+                + " ORDER BY id",
+                params,
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
 
-    def test_resource(self, resource):
-        """测试单个资源的可用性"""
+    @profiling.profiled("test")
+    def test_resource(self, resource, queue_id=None):
+        """测试单个资源的可用性（queue_id 为流水线工作队列中的任务 ID）"""
         resource_id, url, protocol, source, server_region, crawl_time, status = resource
 
         result = {
@@ -79,9 +146,16 @@ class ResourceTester:
             "test_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "test_location": self.current_location,
             "response_time": 0,
+            "timeout": (
+                self.timeouts.timeout_for(resource_id, protocol, server_region)
+                if self.adaptive_timeout
+                else self.timeout
+            ),
             "error_message": "",
             "details": {},
         }
+        if queue_id is not None:
+            result["queue_id"] = queue_id
 
         start_time = time.time()
 
@@ -89,10 +163,10 @@ class ResourceTester:
             # 根据协议类型执行不同的测试
             if protocol in ["clash_sub", "singbox_sub"]:
                 # 订阅链接测试
-                self._test_subscription(url, result)
+                self._test_subscription(url, result, result["timeout"])
             else:
                 # 普通代理链接测试
-                self._test_proxy(url, protocol, result)
+                self._test_proxy(url, protocol, result, result["timeout"])
 
             # 更新服务器区域（如果之前为空）
             if not result["server_region"] and hasattr(
@@ -106,35 +180,35 @@ class ResourceTester:
         end_time = time.time()
         result["response_time"] = round(end_time - start_time, 3)
 
+        # 用本次结果更新延迟分布（固定超时时不需要）
+        success = is_success(result)
+        if self.adaptive_timeout:
+            self.timeouts.observe(
+                resource_id,
+                protocol,
+                result["server_region"],
+                result["response_time"],
+                success,
+            )
+        test_outcomes.labels(protocol, "success" if success else "failed").inc()
+        if success:
+            test_latency.labels(protocol).observe(result["response_time"])
+
         # 更新数据库
         self._update_resource_in_db(result)
 
         return result
 
     def _update_resource_in_db(self, result):
-        """将测试结果更新到数据库"""
-        try:
-            # 在每次调用时创建新的数据库连接，避免跨线程问题
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE resources SET status = ?, server_region = ? WHERE id = ?",
-                (result["status"], result["server_region"], result["id"]),
-            )
-            conn.commit()
-            conn.close()
-            print(
-                f"  数据库已更新: ID {result['id']} - 状态: {result['status']} - 区域: {result['server_region']}"
-            )
-        except Exception as e:
-            print(f"  更新数据库失败: {e}")
+        """将测试结果交给写入线程，由其批量更新到数据库"""
+        self.writer.submit(result)
 
-    def _test_subscription(self, url, result):
+    def _test_subscription(self, url, result, timeout=TEST_TIMEOUT):
         """测试订阅链接"""
         import requests
 
         try:
-            response = requests.get(url, timeout=TEST_TIMEOUT)
+            response = requests.get(url, timeout=timeout)
             if response.status_code < 400:
                 result["status"] = "success"
                 result["details"] = {
@@ -147,7 +221,7 @@ class ResourceTester:
         except Exception as e:
             result["error_message"] = f"订阅链接测试失败: {e}"
 
-    def _test_proxy(self, url, protocol, result):
+    def _test_proxy(self, url, protocol, result, timeout=TEST_TIMEOUT):
         """测试普通代理链接"""
         # 检查sing-box是否存在
         if not os.path.exists(SINGBOX_BINARY):
@@ -204,7 +278,7 @@ class ResourceTester:
             # 启动sing-box测试
             cmd = [SINGBOX_BINARY, "check", "--config", config_path]
             process = subprocess.run(
-                cmd, capture_output=True, text=True, timeout=TEST_TIMEOUT
+                cmd, capture_output=True, text=True, timeout=timeout
             )
 
             if process.returncode == 0:
@@ -221,137 +295,156 @@ class ResourceTester:
             if os.path.exists(config_path):
                 os.remove(config_path)
 
+    def _apply_run_params(self, params):
+        """
+        恢复运行时沿用该运行登记的线程数、超时和超时模式，使各次部分运行的结果可比；
+        数据库或测试位置不同的运行不能恢复，返回 False
+        """
+        for key, current in (("db_path", DB_PATH), ("test_location", self.current_location)):
+            if params.get(key) not in (None, current):
+                print(f"运行参数 {key} 不一致（登记为 {params[key]}，当前为 {current}），不能恢复")
+                return False
+        self.thread_count = params.get("thread_count", self.thread_count)
+        self.timeout = params.get("timeout", self.timeout)
+        self.adaptive_timeout = params.get("adaptive_timeout", self.adaptive_timeout)
+        self.timeouts.default_timeout = self.timeout
+        return True
+
     def test_resources(self):
         """批量测试所有资源"""
+        # 恢复中断的运行，或登记新的运行
+        run_id = None
+        if self.resume:
+            run_id = self.checkpoint.resume(
+                None if self.resume == "latest" else self.resume
+            )
+            if run_id and not self._apply_run_params(self.checkpoint.params):
+                run_id = None
+            if run_id:
+                print(f"恢复测试运行: {run_id}")
+            else:
+                print("没有找到可恢复的测试运行，开始新的运行")
+        if not run_id:
+            run_id = self.checkpoint.start(
+                {
+                    "db_path": DB_PATH,
+                    "thread_count": self.thread_count,
+                    "timeout": self.timeout,
+                    "adaptive_timeout": self.adaptive_timeout,
+                    "test_location": self.current_location,
+                },
+                self.count_resources(),
+            )
+            print(f"测试运行 ID: {run_id}")
+
         print(f"{'-'*60}")
         print(f"资源测试器 v1.0")
         print(f"测试执行位置: {self.current_location}")
         print(f"测试时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print(f"线程数: {THREAD_COUNT}")
-        print(f"超时时间: {TEST_TIMEOUT}秒")
+        print(f"线程数: {self.thread_count}")
+        if self.adaptive_timeout:
+            print(f"超时时间: 按历史延迟自适应（默认 {self.timeout}秒）")
+        else:
+            print(f"超时时间: {self.timeout}秒")
         print(f"{'-'*60}")
 
-        # 获取所有资源
-        resources = self.get_resources()
-        total = len(resources)
-        print(f"共找到 {total} 个资源，开始测试...")
+        # 加载历史延迟分布，用于计算每个探测的超时
+        if self.adaptive_timeout:
+            endpoints, groups = self.timeouts.load(self.measurements)
+            print(f"已加载延迟历史: {endpoints} 个端点, {groups} 个协议/地区分组")
 
-        # 创建队列
-        resource_queue = queue.Queue()
-        result_queue = queue.Queue()
+        # 获取本次需要测试的资源数量
+        total = self.count_resources(pending_only=True)
+        print(f"共找到 {total} 个待测试资源，开始测试...")
 
-        for resource in resources:
-            resource_queue.put(resource)
+        # 启动数据库写入线程
+        self.writer.start()
 
-        # 定义工作线程
+        # 测试结果边完成边写入报告，不在内存中保留；同一运行的多次部分运行写入同一份报告
+        self.report = StreamingReport(
+            REPORT_DIR, self.current_location, self.thread_count, self.timeout, name=run_id
+        )
+        merged = 0
+        for result in self.checkpoint.iter_completed():
+            self.report.seed(result)
+            merged += 1
+        if merged:
+            print(f"已合并之前完成的 {merged} 个结果")
+        # 结果与检查点在同一事务中提交后才写入明细，中断恢复时不会重复
+        self.writer.listeners.append(self.report.add_batch)
+        print(f"测试明细实时写入: {self.report.results_path}")
+
+        # 有界队列：资源边读边测，内存占用与资源总数无关
+        resource_queue = queue.Queue(maxsize=self.thread_count * 4)
+
+        # 定义工作线程，收到 None 时退出
         def worker():
             while True:
+                resource = resource_queue.get()
                 try:
-                    resource = resource_queue.get(timeout=1)
+                    if resource is None:
+                        return
                     result = self.test_resource(resource)
-                    result_queue.put(result)
                     print(f"测试完成 [{result['status'].upper()}]: {resource[1]}")
-                    resource_queue.task_done()
-                except queue.Empty:
-                    break
                 except Exception as e:
                     print(f"工作线程错误: {e}")
-                    break
+                finally:
+                    resource_queue.task_done()
 
         # 启动工作线程
         threads = []
-        for _ in range(min(THREAD_COUNT, total)):
+        for _ in range(max(1, min(self.thread_count, total))):
             t = threading.Thread(target=worker)
             t.daemon = True
             t.start()
             threads.append(t)
 
+        for resource in self.get_resources():
+            resource_queue.put(resource)
+        for _ in threads:
+            resource_queue.put(None)
+
         # 等待所有任务完成
-        resource_queue.join()
+        for t in threads:
+            t.join()
 
-        # 收集结果
-        while not result_queue.empty():
-            self.test_results.append(result_queue.get())
+        # 等待写入线程把剩余结果写入数据库
+        self.writer.close()
+        if self.writer.failed:
+            print(
+                f"有 {self.writer.failed} 个结果未能写入数据库，可使用 --resume {run_id} 重新测试"
+            )
+        else:
+            self.checkpoint.finish()
+
+        # 把已结束时段的探测记录降采样为小时 / 天汇总
+        try:
+            print(f"延迟历史降采样: {self.measurements.rollup()}")
+        except Exception as e:
+            print(f"延迟历史降采样失败: {e}")
 
         print(f"\n{'-'*60}")
         print("所有测试完成!")
         self.generate_report()
 
     def generate_report(self):
-        """生成测试报告"""
-        # 统计结果
-        total = len(self.test_results)
-        success = sum(1 for r in self.test_results if r["status"] == "success")
-        failed = total - success
-        success_rate = (success / total * 100) if total > 0 else 0
-        avg_response_time = (
-            sum(r["response_time"] for r in self.test_results) / total
-            if total > 0
-            else 0
-        )
-
-        # 按地区统计
-        region_stats = {}
-        for result in self.test_results:
-            region = result["server_region"] or "未知"
-            if region not in region_stats:
-                region_stats[region] = {"total": 0, "success": 0, "failed": 0}
-            region_stats[region]["total"] += 1
-            if result["status"] == "success":
-                region_stats[region]["success"] += 1
-            else:
-                region_stats[region]["failed"] += 1
-
-        # 按协议统计
-        protocol_stats = {}
-        for result in self.test_results:
-            protocol = result["protocol"]
-            if protocol not in protocol_stats:
-                protocol_stats[protocol] = {"total": 0, "success": 0, "failed": 0}
-            protocol_stats[protocol]["total"] += 1
-            if result["status"] == "success":
-                protocol_stats[protocol]["success"] += 1
-            else:
-                protocol_stats[protocol]["failed"] += 1
-
-        # 生成报告文件名（放到tmp目录）
-        tmp_dir = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tmp"
-        )
-        os.makedirs(tmp_dir, exist_ok=True)
-        report_filename = (
-            f"resource_test_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        )
-        report_path = os.path.join(tmp_dir, report_filename)
-
-        # 生成JSON报告
-        report = {
-            "summary": {
-                "total_resources": total,
-                "success": success,
-                "failed": failed,
-                "success_rate": round(success_rate, 2),
-                "avg_response_time": round(avg_response_time, 3),
-                "test_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "test_location": self.current_location,
-                "thread_count": THREAD_COUNT,
-                "timeout": TEST_TIMEOUT,
-            },
-            "region_stats": region_stats,
-            "protocol_stats": protocol_stats,
-            "detailed_results": self.test_results,
-        }
-
-        with open(report_path, "w", encoding="utf-8") as f:
-            json.dump(report, f, ensure_ascii=False, indent=2)
+        """生成测试报告（明细已在测试过程中写入 JSONL，这里只写最终摘要）"""
+        report = self.report.finish()
+        summary = report["summary"]
+        protocol_stats = report["protocol_stats"]
+        region_stats = report["region_stats"]
 
         # 打印简要报告
         print(f"\n测试报告摘要:")
         print(f"{'-'*60}")
-        print(f"总资源数: {total}")
-        print(f"成功: {success} ({success_rate:.2f}%)")
-        print(f"失败: {failed}")
-        print(f"平均响应时间: {avg_response_time:.3f}秒")
+        print(f"总资源数: {summary['total_resources']}")
+        print(f"成功: {summary['success']} ({summary['success_rate']:.2f}%)")
+        print(f"失败: {summary['failed']}")
+        print(f"平均响应时间: {summary['avg_response_time']:.3f}秒")
+        print(
+            f"响应时间分位数: P50 {summary['p50_response_time']}秒 | "
+            f"P95 {summary['p95_response_time']}秒 | P99 {summary['p99_response_time']}秒"
+        )
         print(f"{'-'*60}")
 
         print(f"\n按协议统计:")
@@ -375,21 +468,169 @@ class ResourceTester:
             )
 
         print(f"\n{'-'*60}")
-        print(f"详细报告已保存到: {report_path}")
+        print(f"详细结果已保存到: {self.report.results_path}")
+        print(f"报告摘要已保存到: {self.report.summary_path}")
+        print(f"{'-'*60}")
+
+    def get_verified_proxies(self):
+        """逐个返回已验证的代理节点（订阅链接不参与测速）"""
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            cursor = conn.execute(
+                """
+                SELECT id, url, protocol FROM resources
+                WHERE status IN ('success', 'verified')
+                AND protocol NOT IN ('clash_sub', 'singbox_sub')
+                ORDER BY id
+            """
+            )
+            yield from cursor
+        finally:
+            conn.close()
+
+    def test_bandwidth(
+        self,
+        target_url=None,
+        payload_bytes=BANDWIDTH_PAYLOAD_BYTES,
+        concurrency=BANDWIDTH_CONCURRENCY,
+        min_mbps=BANDWIDTH_MIN_MBPS,
+    ):
+        """对已验证节点做带宽测试，结果写入 resource_bandwidth"""
+        if not os.path.exists(SINGBOX_BINARY):
+            print("sing-box 二进制文件不存在，跳过带宽测试")
+            return
+
+        # 未指定测速地址时启动本地测速服务器
+        server = None
+        if not target_url:
+            server = LocalSpeedServer().start()
+            target_url = server.url
+
+        print(f"\n{'-'*60}")
+        print(f"带宽测试: 目标 {target_url} | 数据量 {payload_bytes} 字节 | 并发 {concurrency}")
         print(f"{'-'*60}")
 
+        tester = BandwidthTester(
+            SINGBOX_BINARY,
+            target_url,
+            payload_bytes=payload_bytes,
+            concurrency=concurrency,
+            min_mbps=min_mbps,
+            test_location=self.current_location,
+        )
+        pending = []
+        counts = {}
+
+        def on_result(result):
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            print(
+                f"带宽测试 [{result['status'].upper()}]: {result['url']} "
+                f"下载 {result['download_mbps']} Mbps / 上传 {result['upload_mbps']} Mbps "
+                f"{result['error_message']}"
+            )
+            pending.append(result)
+            if len(pending) >= 50:
+                self.measurements.record_bandwidth(pending)
+                pending.clear()
+
+        try:
+            tester.run(self.get_verified_proxies(), build_outbound, on_result)
+        finally:
+            self.measurements.record_bandwidth(pending)
+            if server:
+                server.close()
+        print(f"带宽测试完成: {counts}")
+
     def close(self):
         """关闭资源"""
-        # 只关闭 IP 解析器，因为数据库连接是在每次调用时创建和关闭的
+        # 先停止写入线程（会刷新剩余结果），再关闭 IP 解析器
+        self.writer.close()
+        if self.report:
+            self.report.close()
         self.resolver.close()
 
 
+def start_metrics(port):
+    """启动 /metrics 端点和测试延迟的 P99 告警"""
+    port = metrics.start_http_server(port)
+    alerter = metrics.P99Alerter(P99_RESPONSE_LIMIT_SEC)
+    alerter.watch(test_latency)
+    alerter.start()
+    print(f"指标端点: http://127.0.0.1:{port}/metrics")
+    return alerter
+
+
 def main():
     """主函数"""
-    tester = ResourceTester()
+    parser = argparse.ArgumentParser(description="使用 sing-box 测试资源可用性")
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const="latest",
+        metavar="RUN_ID",
+        help="继续之前中断的测试运行（不指定 RUN_ID 时继续最近一次）",
+    )
+    parser.add_argument(
+        "--bandwidth", action="store_true", help="可用性测试后对已验证节点做带宽测试"
+    )
+    parser.add_argument(
+        "--bandwidth-only", action="store_true", help="只做带宽测试，跳过可用性测试"
+    )
+    parser.add_argument(
+        "--bandwidth-url",
+        help="测速服务器地址（提供 /download 和 /upload），默认启动本地测速服务器",
+    )
+    parser.add_argument(
+        "--bandwidth-bytes",
+        type=int,
+        default=BANDWIDTH_PAYLOAD_BYTES,
+        help="每个方向传输的字节数",
+    )
+    parser.add_argument(
+        "--bandwidth-concurrency",
+        type=int,
+        default=BANDWIDTH_CONCURRENCY,
+        help="同时测速的节点数",
+    )
+    parser.add_argument(
+        "--bandwidth-min-mbps",
+        type=float,
+        default=BANDWIDTH_MIN_MBPS,
+        help="低于该速度提前结束",
+    )
+
+    parser.add_argument(
+        "--fixed-timeout",
+        action="store_true",
+        help=f"所有探测都使用固定超时 {TEST_TIMEOUT} 秒，不按历史延迟自适应",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="在本地该端口提供 /metrics 指标端点（0 表示不启用）",
+    )
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_metrics(args.metrics_port)
+    # 按 MONITORING_PROFILE_* 环境变量开启分析，运行中可用 SIGUSR2 / 控制文件开启
+    profiling.install()
+
+    tester = ResourceTester(
+        resume=args.resume, adaptive_timeout=not args.fixed_timeout
+    )
 
     try:
-        tester.test_resources()
+        if not args.bandwidth_only:
+            tester.test_resources()
+        if args.bandwidth or args.bandwidth_only:
+            tester.test_bandwidth(
+                target_url=args.bandwidth_url,
+                payload_bytes=args.bandwidth_bytes,
+                concurrency=args.bandwidth_concurrency,
+                min_mbps=args.bandwidth_min_mbps,
+            )
     finally:
         tester.close()
 
@@ -0,0 +1,8 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 与 scripts/ 下的脚本一致，直接导入 singbox_test 和 crawler 中的模块
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "crawler"))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "singbox_test"))
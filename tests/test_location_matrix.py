@@ -0,0 +1,33 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+from location_matrix import build_matrix
+from measurements import TIME_FORMAT, MeasurementStore
+
+
+def test_matrix_includes_rows_synced_after_rollup(tmp_path):
+    db_path = str(tmp_path / "data.db")
+    store = MeasurementStore(db_path)
+    hour = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+    conn = sqlite3.connect(db_path)
+    insert = """
+        INSERT INTO resource_measurements
+        (resource_id, measured_at, protocol, server_region, test_location, success, latency)
+        VALUES (?, ?, 'vmess', 'US', ?, 1, ?)
+    """
+    with conn:
+        conn.execute(insert, (1, (hour + timedelta(minutes=10)).strftime(TIME_FORMAT), "HK", 0.2))
+    store.rollup()
+
+    # 另一个测试位置同一小时的结果在降采样之后才同步到共享数据库
+    with conn:
+        conn.execute(insert, (1, (hour + timedelta(minutes=20)).strftime(TIME_FORMAT), "JP", 0.5))
+    assert build_matrix(db_path) == 2
+    store.rollup()
+    assert build_matrix(db_path) == 2
+
+    cells = conn.execute(
+        "SELECT test_location, probes FROM resource_location_matrix ORDER BY test_location"
+    ).fetchall()
+    conn.close()
+    assert cells == [("HK", 1), ("JP", 1)]
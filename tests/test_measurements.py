@@ -0,0 +1,66 @@
+import sqlite3
+from datetime import datetime
+
+from measurements import MeasurementStore
+
+
+def _insert(db_path, resource_id, measured_at, latency, location="HK"):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO resource_measurements
+            (resource_id, measured_at, protocol, server_region, test_location, success, latency)
+            VALUES (?, ?, 'vmess', 'US', ?, 1, ?)
+        """,
+            (resource_id, measured_at, location, latency),
+        )
+    conn.close()
+
+
+def _hourly(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT resource_id, bucket, probes FROM resource_measurements_hourly ORDER BY resource_id, bucket"
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def _probes(store, now):
+    return {key: probes for key, probes, _, _ in store.iter_latency_groups("resource", 7, now)}
+
+
+def test_row_committed_after_rollup_is_rolled_up_later(tmp_path):
+    db_path = str(tmp_path / "data.db")
+    store = MeasurementStore(db_path)
+    _insert(db_path, 1, "2026-10-19 09:59:40", 0.2)
+    store.rollup(now=datetime(2026, 10, 19, 10, 0, 5))
+    assert _hourly(db_path) == [(1, "2026-10-19 09:00:00", 1)]
+
+    # 探测在 10 点前开始、降采样之后才提交
+    _insert(db_path, 1, "2026-10-19 09:59:50", 0.3)
+    now = datetime(2026, 10, 19, 10, 30)
+    assert _probes(store, now) == {1: 2}
+
+    store.rollup(now=datetime(2026, 10, 19, 11, 0, 5))
+    assert _hourly(db_path) == [(1, "2026-10-19 09:00:00", 2)]
+    assert _probes(store, now) == {1: 2}
+
+
+def test_late_row_for_rolled_up_day_reaches_daily_table(tmp_path):
+    db_path = str(tmp_path / "data.db")
+    store = MeasurementStore(db_path)
+    _insert(db_path, 1, "2026-10-18 12:00:00", 0.2)
+    store.rollup(now=datetime(2026, 10, 19, 1, 0))
+
+    # 其他测试位置前一天的结果在天汇总之后才同步过来
+    _insert(db_path, 1, "2026-10-18 23:59:00", 0.4, location="JP")
+    store.rollup(now=datetime(2026, 10, 19, 2, 0))
+
+    conn = sqlite3.connect(db_path)
+    daily = conn.execute(
+        "SELECT bucket, test_location, probes FROM resource_measurements_daily ORDER BY test_location"
+    ).fetchall()
+    conn.close()
+    assert daily == [("2026-10-18", "HK", 1), ("2026-10-18", "JP", 1)]
@@ -0,0 +1,28 @@
+import json
+
+from singbox_crawler.routing import DIRECT, RoutingTable
+
+
+def test_table_evicts_least_recently_used_domains(tmp_path):
+    state_path = str(tmp_path / "routing_state.json")
+    table = RoutingTable([DIRECT, "proxy"], state_path=state_path, max_domains=2)
+    table.record("a.example.com", DIRECT, True, 0.1)
+    table.record("www.example.org", DIRECT, True, 0.1)
+    # 再次使用 example.com 后，淘汰的是 example.org
+    table.ranked("example.com")
+    table.record("example.net", DIRECT, False)
+    assert list(table.domains) == ["example.com", "example.net"]
+
+    table.save()
+    with open(state_path, encoding="utf-8") as f:
+        assert set(json.load(f)["domains"]) == {"example.com", "example.net"}
+    assert len(RoutingTable([DIRECT], state_path=state_path, max_domains=1).domains) == 1
+
+
+def test_periodic_save_runs_in_background(tmp_path):
+    state_path = tmp_path / "routing_state.json"
+    table = RoutingTable([DIRECT], state_path=str(state_path))
+    for _ in range(50):
+        table.record("example.com", DIRECT, True, 0.2)
+    table._saver.join()
+    assert "example.com" in json.loads(state_path.read_text(encoding="utf-8"))["domains"]